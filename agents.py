@@ -4,24 +4,7 @@ Esqueleto de agentes CrewAI para la demo de Tutor Inteligente.
 """
 
 from crewai import Agent, Task
-import psycopg2
-import os
-
-# Configuración de conexión PostgreSQL
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_PORT = os.getenv("PG_PORT", "5432")
-PG_DB = os.getenv("PG_DB", "tutor_db")
-PG_USER = os.getenv("PG_USER", "tutor_user")
-PG_PASSWORD = os.getenv("PG_PASSWORD", "tutor_pass")
-
-def get_pg_conn():
-    return psycopg2.connect(
-        host=PG_HOST,
-        port=PG_PORT,
-        dbname=PG_DB,
-        user=PG_USER,
-        password=PG_PASSWORD
-    )
+from db import get_conn
 
 # --- Agente Perfil Estudiante ---
 class StudentProfileAgent(Agent):
@@ -29,7 +12,7 @@ class StudentProfileAgent(Agent):
         pass
 
     def get_profile(self, student_id):
-        with get_pg_conn() as conn:
+        with get_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT id, name, email, career, grade, language FROM students WHERE id=%s", (student_id,))
                 return cur.fetchone()
@@ -38,7 +21,7 @@ class StudentProfileAgent(Agent):
         # updates: dict con los campos a actualizar
         set_clause = ", ".join([f"{k}=%s" for k in updates.keys()])
         values = list(updates.values()) + [student_id]
-        with get_pg_conn() as conn:
+        with get_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(f"UPDATE students SET {set_clause} WHERE id=%s", values)
                 conn.commit()
@@ -49,7 +32,7 @@ class SubjectAgent(Agent):
         pass
 
     def get_subjects(self, student_id):
-        with get_pg_conn() as conn:
+        with get_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     SELECT s.id, s.name, s.description, e.progress
@@ -60,7 +43,7 @@ class SubjectAgent(Agent):
                 return cur.fetchall()
 
     def update_progress(self, student_id, subject_id, progress):
-        with get_pg_conn() as conn:
+        with get_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     "UPDATE enrollments SET progress=%s, last_interaction=NOW() WHERE student_id=%s AND subject_id=%s",
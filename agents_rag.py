@@ -7,76 +7,67 @@ Agentes para demo de Tutor Inteligente con RAG y metadata.
 """
 
 
-import psycopg2
+import asyncio
+import json
+import logging
 import time
-from typing import Optional
+from typing import AsyncIterator, Iterator, Optional
 import os
-from langchain_qdrant import Qdrant
-from langchain_ollama import OllamaEmbeddings
-from qdrant_client import QdrantClient
 from crewai import Agent, Task, Crew
-
-# Configuración PostgreSQL
-PG_HOST = "localhost"
-PG_PORT = 5432
-PG_DB = "tutor_db"
-PG_USER = "tutor_user"
-PG_PASSWORD = "tutor_pass"
+from app_logging import get_logger, should_sample_prompt
+from async_http import get_async_client
+from collection_config import search_params
+from conversation_memory import conversation_memory
+from db import get_conn
+from hybrid_search import hybrid_search
+from llm_dispatch import PRIORITY_BACKGROUND, llm_dispatcher
+from local_index import LocalVectorStore, get_local_index
+from metrics_sink import STAGE_COLUMNS, metrics_sink
+from prompt_builder import PromptPlan, build_prompt as build_budgeted_prompt, token_budget
+from retrieval_cache import RETRIEVAL_CACHE_ENABLED, retrieval_cache
+from retrieval_clients import lease_retrieval_clients
+from semantic_cache import SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_STANDALONE, cacheable_profile, is_standalone, semantic_cache
+from settings_cache import get_settings
+from stage_pipeline import Stage, run_stages
+from subject_sharding import get_router, subject_filter
+from token_accounting import count_tokens, usage_from_response
+from tracing import span, trace, traced
 
 # Configuración Qdrant (valores por defecto; pueden ser sobrescritos por app_settings)
 QDRANT_URL = "http://localhost:6333"
 QDRANT_COLLECTION = "tutor_demo"
 EMBED_MODEL = "nomic-embed-text"
 
+logger = get_logger(__name__)
+
+# Parte fija del prompt del tutor: token_accounting la cuenta una sola vez
+SYSTEM_PROMPT = """
+Eres un tutor inteligente. Tu objetivo es ayudar al estudiante de manera personalizada y contextual, siguiendo estas reglas:
+
+- Explicaciones personalizadas: Adapta el nivel y estilo de explicación según el perfil y la pregunta del estudiante.
+- Respuestas contextuales: Limítate a responder solo con base en el contenido relevante del curso proporcionado.
+- Generación de pistas: Si el estudiante lo solicita o parece atascado, ofrece pistas antes que respuestas directas.
+- Clarificación de conceptos: Si el estudiante pide aclaraciones, desglosa los conceptos y usa ejemplos claros.
+- Retroalimentación automática: Si el estudiante responde una pregunta o ejercicio, proporciona feedback constructivo y sugerencias de mejora.
+- Si el alumno pide recursos adicionales, sugiere materiales complementarios relacionados con la materia.
+- Si el alumno quiere preguntas tipo quiz o examen, genera preguntas con opciones múltiples, espera la respuesta y proporciona feedback.
+
+"""
+
+@traced('settings')
 def load_settings_from_db():
-    """Lee la fila de configuración desde app_settings (id=1)."""
-    try:
-        conn = psycopg2.connect(
-            host=PG_HOST,
-            port=PG_PORT,
-            dbname=PG_DB,
-            user=PG_USER,
-            password=PG_PASSWORD,
-        )
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT llm_backend, llm_model, ollama_url, qdrant_url, qdrant_collection, logging_enabled
-                FROM app_settings WHERE id=1
-                """
-            )
-            row = cur.fetchone()
-        conn.close()
-        if not row:
-            return {
-                'llm_backend': 'ollama',
-                'llm_model': 'gemma3:4b',
-                'ollama_url': 'http://localhost:11434',
-                'qdrant_url': QDRANT_URL,
-                'qdrant_collection': QDRANT_COLLECTION,
-                'logging_enabled': True,
-            }
-        keys = ['llm_backend','llm_model','ollama_url','qdrant_url','qdrant_collection','logging_enabled']
-        return dict(zip(keys, row))
-    except Exception:
-        # En caso de error, usar defaults
-        return {
-            'llm_backend': 'ollama',
-            'llm_model': 'gemma3:4b',
-            'ollama_url': 'http://localhost:11434',
-            'qdrant_url': QDRANT_URL,
-            'qdrant_collection': QDRANT_COLLECTION,
-            'logging_enabled': True,
-        }
+    """Lee la fila de configuración app_settings (id=1) a través de la caché con TTL."""
+    return get_settings()
+
+def llm_base_url(settings: dict, backend: str) -> str:
+    """URL base del proveedor de LLM según el backend configurado."""
+    if backend == "ollama":
+        return settings.get('ollama_url', 'http://localhost:11434')
+    return settings.get('openai_base_url', 'https://api.openai.com')
 
 def estimate_tokens(text: str) -> int:
-    """Estimación simple de tokens si tiktoken no está disponible."""
-    try:
-        import tiktoken  # type: ignore
-        enc = tiktoken.get_encoding("cl100k_base")
-        return len(enc.encode(text or ""))
-    except Exception:
-        return max(1, len((text or "").split()))
+    """Tokens de `text` con el encoder compartido (ver token_accounting.py)."""
+    return count_tokens(text)
 
 
 class StudentProfileAgent(Agent):
@@ -84,34 +75,21 @@ class StudentProfileAgent(Agent):
         super().__init__(**kwargs)
 
     def get_subject_ids(self, student_id):
-        import psycopg2
-        conn = psycopg2.connect(
-            host=PG_HOST,
-            port=PG_PORT,
-            dbname=PG_DB,
-            user=PG_USER,
-            password=PG_PASSWORD
-        )
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT subject_id FROM enrollments WHERE student_id = %s
-            """, (student_id,))
-            return [row[0] for row in cur.fetchall()]
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT subject_id FROM enrollments WHERE student_id = %s
+                """, (student_id,))
+                return [row[0] for row in cur.fetchall()]
 
 
 class TutorAgent(Agent):
-    def call_llm(self, backend: str, prompt: str, model: str, base_url: str) -> str:
-        """
-        Llama al proveedor de LLM según el backend seleccionado.
-        - backend == 'ollama': usa /api/generate de Ollama
-        - backend == 'openai': usa /v1/chat/completions compatible con OpenAI
-        """
+    def _llm_request(self, backend: str, prompt: str, model: str, base_url: str, stream: bool):
+        """Arma (url, headers, payload) para el backend de LLM indicado."""
         if backend == "ollama":
             url = f"{base_url.rstrip('/')}/api/generate"
-            payload = {"model": model, "prompt": prompt, "stream": False}
-            resp = requests.post(url, json=payload, timeout=120)
-            resp.raise_for_status()
-            return resp.json().get("response", "")
+            payload = {"model": model, "prompt": prompt, "stream": stream}
+            return url, None, payload
         elif backend == "openai":
             base = base_url.rstrip('/') or "https://api.openai.com"
             url = f"{base}/v1/chat/completions"
@@ -126,163 +104,617 @@ class TutorAgent(Agent):
                     {"role": "system", "content": "Eres un tutor educativo útil."},
                     {"role": "user", "content": prompt},
                 ],
-                "stream": False,
+                "stream": stream,
             }
-            resp = requests.post(url, headers=headers, json=payload, timeout=120)
-            resp.raise_for_status()
-            data = resp.json()
-            return ((data.get("choices") or [{}])[0].get("message") or {}).get("content", "")
+            if stream:
+                # Pide el uso de tokens en el último evento del stream
+                payload["stream_options"] = {"include_usage": True}
+            return url, headers, payload
         else:
             raise ValueError(f"Backend LLM no soportado: {backend}")
 
+    def _parse_llm_response(self, backend: str, data: dict) -> str:
+        if backend == "ollama":
+            return data.get("response", "")
+        return ((data.get("choices") or [{}])[0].get("message") or {}).get("content", "")
+
+    def _parse_stream_line(self, backend: str, line: str):
+        """
+        Interpreta una línea del stream del LLM y devuelve (texto, terminado, datos).
+        - Ollama responde NDJSON (un objeto por línea con 'response' y 'done')
+        - OpenAI responde SSE ('data: {...}' con choices[0].delta.content y 'data: [DONE]')
+        `datos` es el objeto decodificado (para leer el uso de tokens), o None.
+        """
+        if backend == "ollama":
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(data["error"])
+            return data.get("response") or "", bool(data.get("done")), data
+        if not line.startswith("data:"):
+            return "", False, None
+        chunk = line[len("data:"):].strip()
+        if chunk == "[DONE]":
+            return "", True, None
+        data = json.loads(chunk)
+        return ((data.get("choices") or [{}])[0].get("delta") or {}).get("content") or "", False, data
+
+    def _store_usage(self, backend: str, data, usage) -> None:
+        """Copia en `usage` los tokens informados por el backend, si vienen en `data`."""
+        if usage is None or data is None:
+            return
+        reported = usage_from_response(backend, data)
+        if reported is not None:
+            usage['prompt_tokens'], usage['completion_tokens'] = reported
+
+    @traced('llm')
+    def call_llm(self, backend: str, prompt: str, model: str, base_url: str, usage: Optional[dict] = None) -> str:
+        """
+        Llama al proveedor de LLM según el backend seleccionado.
+        - backend == 'ollama': usa /api/generate de Ollama
+        - backend == 'openai': usa /v1/chat/completions compatible con OpenAI
+        Si se pasa `usage` (dict), se completa con prompt_tokens/completion_tokens
+        cuando el backend los informa.
+        """
+        url, headers, payload = self._llm_request(backend, prompt, model, base_url, stream=False)
+        resp = requests.post(url, headers=headers, json=payload, timeout=120)
+        resp.raise_for_status()
+        data = resp.json()
+        self._store_usage(backend, data, usage)
+        return self._parse_llm_response(backend, data)
+
+    def call_llm_stream(self, backend: str, prompt: str, model: str, base_url: str, usage: Optional[dict] = None) -> Iterator[str]:
+        """
+        Versión en streaming de call_llm: genera los fragmentos de texto a
+        medida que llegan (NDJSON de Ollama o SSE de OpenAI).
+        """
+        url, headers, payload = self._llm_request(backend, prompt, model, base_url, stream=True)
+        with span('llm'), requests.post(url, headers=headers, json=payload, timeout=120, stream=True) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                text, done, data = self._parse_stream_line(backend, line)
+                self._store_usage(backend, data, usage)
+                if text:
+                    yield text
+                if done:
+                    return
+
+    @traced('llm')
+    async def call_llm_async(self, backend: str, prompt: str, model: str, base_url: str, usage: Optional[dict] = None) -> str:
+        """Variante asíncrona de call_llm sobre el AsyncClient compartido (async_http.py)."""
+        url, headers, payload = self._llm_request(backend, prompt, model, base_url, stream=False)
+        resp = await get_async_client().post(url, headers=headers, json=payload)
+        resp.raise_for_status()
+        data = resp.json()
+        self._store_usage(backend, data, usage)
+        return self._parse_llm_response(backend, data)
+
+    async def call_llm_stream_async(self, backend: str, prompt: str, model: str, base_url: str, usage: Optional[dict] = None) -> AsyncIterator[str]:
+        """Variante asíncrona de call_llm_stream."""
+        url, headers, payload = self._llm_request(backend, prompt, model, base_url, stream=True)
+        with span('llm'):
+            async with get_async_client().stream("POST", url, headers=headers, json=payload) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if not line:
+                        continue
+                    text, done, data = self._parse_stream_line(backend, line)
+                    self._store_usage(backend, data, usage)
+                    if text:
+                        yield text
+                    if done:
+                        return
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
+    @traced('subject_context')
     def get_subject_context(self, subject_ids):
         """
         Dado uno o varios subject_ids, retorna el contenido de la descripción de la materia (campo description de subjects)
         """
-        conn = psycopg2.connect(
-            host=PG_HOST,
-            port=PG_PORT,
-            dbname=PG_DB,
-            user=PG_USER,
-            password=PG_PASSWORD
-        )
-        cur = conn.cursor()
         format_strings = ','.join(['%s'] * len(subject_ids))
-        cur.execute(f"SELECT name, description FROM subjects WHERE id IN ({format_strings})", tuple(subject_ids))
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT name, description FROM subjects WHERE id IN ({format_strings})", tuple(subject_ids))
+                rows = cur.fetchall()
         # Devuelve un string con el nombre y la descripción de cada materia
         return '\n\n'.join([f"Materia: {row[0]}\n{row[1]}" for row in rows])
 
-    def answer_question(self, question, subject_ids, student_profile=None, llm_backend="ollama", llm_model="gemma3:4b", chat_history=None):
-        settings = load_settings_from_db()
-        backend = settings.get('llm_backend', llm_backend)
-        model = settings.get('llm_model', llm_model)
-        ollama_url = settings.get('ollama_url', 'http://localhost:11434')
-        openai_base_url = settings.get('openai_base_url', 'https://api.openai.com')
+    @traced('embed')
+    def embed_question(self, question, settings):
+        """
+        Embedding de la pregunta con el cliente compartido del proceso; las
+        preguntas repetidas salen del nivel 1 de retrieval_cache.py.
+        """
         qdrant_url = settings.get('qdrant_url', QDRANT_URL)
         collection = settings.get('qdrant_collection', QDRANT_COLLECTION)
-        logging_enabled = settings.get('logging_enabled', True)
-
-        embeddings = OllamaEmbeddings(model=EMBED_MODEL)
-        client = QdrantClient(url=qdrant_url)
-        vectorstore = Qdrant(
-            collection_name=collection,
-            client=client,
-            embeddings=embeddings,
-        )
-        # Qdrant filter: formato correcto con 'must' y 'match'
-        if len(subject_ids) == 1:
-            filter = {"must": [{"key": "subject_id", "match": {"value": subject_ids[0]}}]}
+        version = settings.get('collection_version')
+        if RETRIEVAL_CACHE_ENABLED:
+            cached = retrieval_cache.get_embedding(EMBED_MODEL, question, version)
+            if cached is not None:
+                return cached
+        with lease_retrieval_clients(qdrant_url, collection, EMBED_MODEL) as clients:
+            vector = clients.embeddings.embed_query(question)
+        if RETRIEVAL_CACHE_ENABLED:
+            retrieval_cache.put_embedding(EMBED_MODEL, question, vector, version)
+        return vector
+
+    @traced('retrieval')
+    def retrieve_chunks(self, question, subject_ids, settings, query_vector=None, k=5, lexical_weight=None):
+        """
+        Búsqueda híbrida (Qdrant + índice léxico) de los k chunks relevantes
+        filtrando por subject_id. Si se pasa query_vector se reutiliza en lugar
+        de volver a calcular el embedding de la pregunta, y la búsqueda pasa por
+        el nivel 2 de retrieval_cache.py (reformulaciones cercanas incluidas).
+        Con app_settings.retrieval_backend = 'local' la parte densa usa el
+        índice en disco de local_index.py en lugar de Qdrant. lexical_weight
+        reemplaza el peso léxico de la fusión (0 = solo densa; lo usa
+        benchmarks/retrieval_eval.py).
+        """
+        qdrant_url = settings.get('qdrant_url', QDRANT_URL)
+        collection = settings.get('qdrant_collection', QDRANT_COLLECTION)
+        version = settings.get('collection_version')
+        local = settings.get('retrieval_backend') == 'local'
+        cache_scope = f"local/{collection}" if local else f"{qdrant_url}/{collection}"
+        if lexical_weight is not None:
+            cache_scope = f"{cache_scope}#lexical={lexical_weight}"
+        use_cache = RETRIEVAL_CACHE_ENABLED and query_vector is not None
+        if use_cache:
+            cached = retrieval_cache.get_results(query_vector, cache_scope, subject_ids, k, version)
+            if cached is not None:
+                return cached
+
+        # Filtro nativo sobre subject_id (usa el índice de payload de la colección)
+        filter = subject_filter(subject_ids)
+        # Sin índice local (aún no construido) se recurre a Qdrant
+        index = get_local_index(collection) if local else None
+        if index is not None:
+            if query_vector is None:
+                query_vector = self.embed_question(question, settings)
+            results = hybrid_search(
+                LocalVectorStore(index, collection),
+                question,
+                subject_ids,
+                filter,
+                collection,
+                k=k,
+                query_vector=query_vector,
+                weight=lexical_weight,
+            )
+        else:
+            # Clientes de larga vida compartidos por el proceso (ver retrieval_clients.py)
+            with lease_retrieval_clients(qdrant_url, collection, EMBED_MODEL) as clients:
+                # Con QDRANT_SHARDING la búsqueda densa va a los shards de subject_ids
+                vectorstore = get_router(clients.client, collection).vectorstore(clients.vectorstore, clients.embeddings)
+                # Densa + BM25 fusionadas con RRF (ver hybrid_search.py)
+                results = hybrid_search(
+                    vectorstore,
+                    question,
+                    subject_ids,
+                    filter,
+                    collection,
+                    k=k,
+                    query_vector=query_vector,
+                    weight=lexical_weight,
+                    search_params=search_params(),
+                )
+        if use_cache:
+            retrieval_cache.put_results(query_vector, cache_scope, subject_ids, k, results, version)
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, doc in enumerate(results, 1):
+                logger.debug("Chunk %d: %s | metadata=%s", i, doc.page_content, doc.metadata)
+        return results
+
+    def build_prompt(self, question, subject_ids, student_profile=None, chat_history=None, settings=None, query_vector=None, summary=""):
+        """
+        Recupera los chunks relevantes, el contexto de la materia y el historial,
+        y arma el prompt para el LLM.
+        """
+        plan, _ = self.prepare_prompt(question, subject_ids, student_profile, chat_history, settings, query_vector, summary)
+        return plan.prompt
+
+    def prepare_prompt(self, question, subject_ids, student_profile=None, chat_history=None, settings=None, query_vector=None, summary=""):
+        """
+        Arma el prompt con un pipeline de etapas (stage_pipeline.py): la búsqueda
+        en Qdrant y el contexto de la materia son independientes y corren en
+        paralelo; el armado con presupuesto de tokens (prompt_builder.py, que
+        también incorpora el historial) espera a ambas. Si no se pasa
+        query_vector, el embedding de la pregunta es una etapa previa a la
+        búsqueda. Devuelve (PromptPlan, milisegundos por etapa).
+        """
+        settings = settings or load_settings_from_db()
+        model = settings.get('llm_model')
+        stages = [
+            Stage('subject_context', lambda: self.get_subject_context(subject_ids)),
+            Stage(
+                'format',
+                lambda results, subject_context: self.format_prompt(
+                    question, results, subject_context, chat_history, student_profile, model, summary
+                ),
+                ('retrieval', 'subject_context'),
+            ),
+        ]
+        if query_vector is None:
+            stages.append(Stage('embed', lambda: self.embed_question(question, settings)))
+            stages.append(Stage('retrieval', lambda vector: self.retrieve_chunks(question, subject_ids, settings, vector), ('embed',)))
         else:
-            filter = {"must": [{"key": "subject_id", "match": {"any": subject_ids}}]}
-        results = vectorstore.similarity_search(
+            stages.append(Stage('retrieval', lambda: self.retrieve_chunks(question, subject_ids, settings, query_vector)))
+
+        results, timings = run_stages(stages)
+        plan = results['format']
+        logger.info(
+            "Prompt armado",
+            extra={'fields': {
+                'subject_ids': subject_ids,
+                'chunks_retrieved': len(results['retrieval']),
+                'chunks_used': plan.chunks_used,
+                'chunks_deduped': plan.chunks_deduped,
+                'history_turns': plan.turns_used,
+                'token_budget': plan.budget,
+                'prompt_chars': len(plan.prompt),
+                **{f"{section}_tokens": tokens for section, tokens in plan.section_tokens.items()},
+                **{f"{stage}_ms": ms for stage, ms in timings.items()},
+            }},
+        )
+        return plan, timings
+
+    @traced('prompt')
+    def format_prompt(self, question, results, subject_context, chat_history=None, student_profile=None, model=None, summary="") -> PromptPlan:
+        """
+        Arma el prompt personalizado para el LLM a partir de las piezas ya
+        obtenidas, dentro del presupuesto de tokens del modelo (prompt_builder.py).
+        `summary` es el resumen de la conversación guardado en el servidor.
+        """
+        logger.debug("subject_context:\n%s", subject_context)
+        logger.debug("chat_history: %s", chat_history)
+        logger.debug("student_profile: %s", student_profile)
+        logger.debug("question: %s", question)
+        plan = build_budgeted_prompt(
+            SYSTEM_PROMPT,
             question,
-            k=5,
-            filter=filter
+            [doc.page_content for doc in results],
+            subject_context,
+            chat_history,
+            student_profile,
+            token_budget(model),
+            summary=summary,
         )
-        print("[INFO] Resultados relevantes:")
-        for i, doc in enumerate(results, 1):
-            print(f"--- Chunk {i} ---")
-            print("Texto:", doc.page_content)
-            print("Metadata:", doc.metadata)
-
-        # Obtener contexto de la(s) materia(s)
-        subject_context = self.get_subject_context(subject_ids)
-        print("[DEBUG] subject_context:\n", subject_context)
-
-        # Historial de conversación
-        history_prompt = self.build_history_prompt(chat_history)
-        print("[DEBUG] history_prompt:\n", history_prompt)
-
-        # Construir el prompt personalizado para el LLM
-        context = "\n---\n".join([doc.page_content for doc in results])
-        print("[DEBUG] context (chunks relevantes):\n", context)
-        print("[DEBUG] student_profile:\n", student_profile)
-        print("[DEBUG] question:\n", question)
-        prompt = f"""
-Eres un tutor inteligente. Tu objetivo es ayudar al estudiante de manera personalizada y contextual, siguiendo estas reglas:
+        # El volcado completo solo para una muestra de peticiones (LOG_PROMPT_SAMPLE_RATE)
+        if should_sample_prompt():
+            logger.info("Prompt generado para el LLM (muestra):\n%s", plan.prompt, extra={'fields': {'prompt_chars': len(plan.prompt)}})
+        return plan
 
-- Explicaciones personalizadas: Adapta el nivel y estilo de explicación según el perfil y la pregunta del estudiante.
-- Respuestas contextuales: Limítate a responder solo con base en el contenido relevante del curso proporcionado.
-- Generación de pistas: Si el estudiante lo solicita o parece atascado, ofrece pistas antes que respuestas directas.
-- Clarificación de conceptos: Si el estudiante pide aclaraciones, desglosa los conceptos y usa ejemplos claros.
-- Retroalimentación automática: Si el estudiante responde una pregunta o ejercicio, proporciona feedback constructivo y sugerencias de mejora.
-- Si el alumno pide recursos adicionales, sugiere materiales complementarios relacionados con la materia.
-- Si el alumno quiere preguntas tipo quiz o examen, genera preguntas con opciones múltiples, espera la respuesta y proporciona feedback.
+    def record_metrics(self, settings, student_profile, subject_ids, backend, model, prompt_tokens, llm_response, latency_ms, ttft_ms=None, cache_hit=False, stage_ms=None, usage=None):
+        """
+        Calcula los tokens y encola la métrica si el registro está habilitado.
+        Si `usage` trae los conteos informados por el backend se usan tal cual;
+        si no, prompt_tokens es el total del PromptPlan (el prompt no se vuelve
+        a tokenizar) y solo se tokeniza la respuesta. stage_ms es la traza de
+        la petición (tracing.py) con los milisegundos de cada etapa.
+        """
+        if not settings.get('logging_enabled', True):
+            return
+        stage_ms = stage_ms if stage_ms is not None else {}
+        # Un acierto de caché no consume tokens del LLM
+        with trace(stage_ms), span('tokenize'):
+            if cache_hit:
+                prompt_tokens = completion_tokens = 0
+            elif usage and 'prompt_tokens' in usage:
+                prompt_tokens, completion_tokens = usage['prompt_tokens'], usage['completion_tokens']
+            else:
+                completion_tokens = count_tokens(llm_response or "")
+        total_tokens = prompt_tokens + completion_tokens
 
-{history_prompt}Contexto de la materia:
-{subject_context}
+        # Persistir métrica (encolada; la escribe en lote metrics_sink)
+        metrics_sink.record(
+            user_id=(student_profile or {}).get('id'),
+            subject_id=subject_ids[0] if subject_ids else None,
+            backend=backend,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=total_tokens,
+            latency_ms=latency_ms,
+            ttft_ms=ttft_ms,
+            cache_hit=cache_hit,
+            **{column: stage_ms.get(stage) for stage, column in STAGE_COLUMNS.items()},
+        )
 
-Material de referencia (fragmentos relevantes):
-{context}
+    def load_history(self, chat_history, conversation_id=None):
+        """
+        Devuelve (resumen, turnos) para el prompt. Con conversation_id se usa la
+        conversación guardada en el servidor (conversation_memory.py) en lugar
+        del historial enviado por el cliente.
+        """
+        if conversation_id is None:
+            return "", chat_history or []
+        try:
+            memory = conversation_memory.context(conversation_id)
+        except Exception as e:
+            logger.warning("No se pudo cargar la conversación: %s", e)
+            return "", chat_history or []
+        return memory.summary, memory.turns
+
+    def remember_turn(self, conversation_id, question, answer, settings):
+        """Guarda el turno en la conversación del servidor; el resumen se actualiza en segundo plano."""
+        if conversation_id is None or not answer:
+            return
+        try:
+            conversation_memory.append(
+                conversation_id,
+                question,
+                answer,
+                lambda previous, turns: self.summarize_conversation(settings, previous, turns),
+            )
+        except Exception as e:
+            logger.warning("No se pudo guardar el turno de la conversación: %s", e)
+
+    @traced('conversation_summary')
+    def summarize_conversation(self, settings, previous_summary, turns):
+        """Incorpora `turns` al resumen previo con una llamada corta al LLM configurado."""
+        backend = settings.get('llm_backend', 'ollama')
+        transcript = "".join(f"Estudiante: {t['user']}\nTutor: {t['tutor']}\n" for t in turns)
+        prompt = (
+            "Actualiza el resumen de una conversación entre un estudiante y su tutor. "
+            "Conserva los temas tratados, las dudas pendientes y lo que el estudiante ya entendió. "
+            "Responde solo con el resumen, en un máximo de 120 palabras.\n\n"
+            f"Resumen previo:\n{previous_summary or '(vacío)'}\n\n"
+            f"Nuevos turnos:\n{transcript}"
+        )
+        model = settings.get('llm_model', 'gemma3:4b')
+        # Detrás del chat en la cola del LLM (llm_dispatch.py)
+        with llm_dispatcher.acquire(backend, model, priority=PRIORITY_BACKGROUND):
+            summary = self.call_llm(
+                backend=backend,
+                prompt=prompt,
+                model=model,
+                base_url=llm_base_url(settings, backend),
+            )
+        return (summary or "").strip()
 
-Pregunta del estudiante:
-{question}
+    def lookup_cached_answer(self, question, subject_ids, chat_history, settings, backend, model, student_profile=None):
+        """
+        Calcula el embedding de la pregunta y consulta la caché semántica.
+        chat_history es el historial (o resumen) de la conversación, si lo hay.
+        Devuelve (query_vector, cache_key, respuesta_cacheada_o_None); cache_key
+        es None cuando la caché no aplica: deshabilitada, o con historial si la
+        pregunta es de seguimiento (is_standalone), ya que su respuesta depende
+        de la conversación previa. Si aplica, el prompt se arma sin historial
+        (prompt_history) y con el perfil reducido de prompt_profile.
+        """
+        query_vector = self.embed_question(question, settings)
+        if not SEMANTIC_CACHE_ENABLED:
+            return query_vector, None, None
+        if chat_history and not (SEMANTIC_CACHE_STANDALONE and is_standalone(question)):
+            semantic_cache.bypass()
+            return query_vector, None, None
+        cache_key = semantic_cache.group_key(backend, model, subject_ids, student_profile)
+        cached = semantic_cache.lookup(query_vector, cache_key, settings.get('collection_version'))
+        return query_vector, cache_key, cached
+
+    @staticmethod
+    def prompt_profile(student_profile, cache_key):
+        """Perfil para el prompt: sin datos personales si la respuesta irá a la caché semántica."""
+        return cacheable_profile(student_profile) if cache_key is not None else student_profile
+
+    @staticmethod
+    def prompt_history(chat_history, summary, cache_key):
+        """Historial y resumen para el prompt: ninguno si la respuesta irá a la caché semántica."""
+        return ([], "") if cache_key is not None else (chat_history, summary)
+
+    def answer_question(self, question, subject_ids, student_profile=None, llm_backend="ollama", llm_model="gemma3:4b", chat_history=None, conversation_id=None):
+        settings = load_settings_from_db()
+        backend = settings.get('llm_backend', llm_backend)
+        model = settings.get('llm_model', llm_model)
+        summary, chat_history = self.load_history(chat_history, conversation_id)
+
+        stage_ms = {}
+        start = time.time()
+        with trace(stage_ms):
+            query_vector, cache_key, cached = self.lookup_cached_answer(question, subject_ids, chat_history or summary, settings, backend, model, student_profile)
+        if cached is not None:
+            latency_ms = int((time.time() - start) * 1000)
+            self.record_metrics(settings, student_profile, subject_ids, backend, model, 0, cached, latency_ms, cache_hit=True, stage_ms=stage_ms)
+            self.remember_turn(conversation_id, question, cached, settings)
+            return cached
+
+        chat_history, summary = self.prompt_history(chat_history, summary, cache_key)
+        with trace(stage_ms):
+            plan, _ = self.prepare_prompt(question, subject_ids, self.prompt_profile(student_profile, cache_key), chat_history, settings, query_vector, summary)
+
+        # Turno en la cola del LLM (llm_dispatch.py); LLMOverloaded llega al endpoint como 429
+        with trace(stage_ms):
+            slot = llm_dispatcher.acquire(backend, model, user=(student_profile or {}).get('id'))
 
-Perfil del estudiante:
-{student_profile if student_profile else 'No disponible'}
-"""
-        print("\n[INFO] Prompt generado para el LLM:\n")
-        print(prompt)
         # Llamada al LLM según backend seleccionado (Ollama u OpenAI-compatible)
         llm_response: Optional[str] = None
+        usage = {}
         start = time.time()
         try:
-            base = ollama_url if backend == "ollama" else openai_base_url
-            llm_response = self.call_llm(backend=backend, prompt=prompt, model=model, base_url=base)
+            base = llm_base_url(settings, backend)
+            with slot:
+                llm_response = self.call_llm(backend=backend, prompt=plan.prompt, model=model, base_url=base, usage=usage)
         except Exception as e:
-            print("[WARN] Error al invocar LLM:", e)
+            logger.warning("Error al invocar LLM: %s", e, extra={'fields': {'backend': backend, 'model': model}})
             llm_response = ""
         latency_ms = int((time.time() - start) * 1000)
 
-        # Métricas aproximadas de tokens
-        prompt_tokens = estimate_tokens(prompt)
-        completion_tokens = estimate_tokens(llm_response or "")
-        total_tokens = prompt_tokens + completion_tokens
+        self.record_metrics(settings, student_profile, subject_ids, backend, model, plan.section_tokens['total'], llm_response, latency_ms, stage_ms=stage_ms, usage=usage)
+        self.remember_turn(conversation_id, question, llm_response, settings)
+        if cache_key is not None:
+            semantic_cache.store(query_vector, cache_key, llm_response, settings.get('collection_version'))
+        return llm_response
 
-        # Persistir métrica
-        if logging_enabled:
-            try:
-                conn = psycopg2.connect(
-                    host=PG_HOST,
-                    port=PG_PORT,
-                    dbname=PG_DB,
-                    user=PG_USER,
-                    password=PG_PASSWORD,
-                )
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        INSERT INTO chat_metrics (user_id, subject_id, backend, model, prompt_tokens, completion_tokens, total_tokens, latency_ms)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                        """,
-                        (
-                            (student_profile or {}).get('id'),
-                            subject_ids[0] if subject_ids else None,
-                            backend,
-                            model,
-                            prompt_tokens,
-                            completion_tokens,
-                            total_tokens,
-                            latency_ms,
-                        ),
-                    )
-                    conn.commit()
-                conn.close()
-            except Exception as e:
-                print("[WARN] No se pudo registrar métrica:", e)
+    def answer_question_stream(self, question, subject_ids, student_profile=None, llm_backend="ollama", llm_model="gemma3:4b", chat_history=None, conversation_id=None):
+        """
+        Igual que answer_question pero entrega la respuesta como un generador de
+        fragmentos de texto a medida que el LLM los produce. Registra el tiempo
+        al primer token (ttft_ms) y la latencia total. Los errores del LLM se
+        propagan al consumidor tras registrar la métrica.
+        """
+        settings = load_settings_from_db()
+        backend = settings.get('llm_backend', llm_backend)
+        model = settings.get('llm_model', llm_model)
+        summary, chat_history = self.load_history(chat_history, conversation_id)
+
+        stage_ms = {}
+        start = time.time()
+        with trace(stage_ms):
+            query_vector, cache_key, cached = self.lookup_cached_answer(question, subject_ids, chat_history or summary, settings, backend, model, student_profile)
+        if cached is not None:
+            latency_ms = int((time.time() - start) * 1000)
+            self.record_metrics(settings, student_profile, subject_ids, backend, model, 0, cached, latency_ms, latency_ms, cache_hit=True, stage_ms=stage_ms)
+            self.remember_turn(conversation_id, question, cached, settings)
+            yield cached
+            return
+
+        chat_history, summary = self.prompt_history(chat_history, summary, cache_key)
+        with trace(stage_ms):
+            plan, _ = self.prepare_prompt(question, subject_ids, self.prompt_profile(student_profile, cache_key), chat_history, settings, query_vector, summary)
+
+        with trace(stage_ms):
+            slot = llm_dispatcher.acquire(backend, model, user=(student_profile or {}).get('id'))
+
+        parts = []
+        completed = False
+        ttft_ms = None
+        usage = {}
+        start = time.time()
+        try:
+            base = llm_base_url(settings, backend)
+            with slot:
+                for token in self.call_llm_stream(backend=backend, prompt=plan.prompt, model=model, base_url=base, usage=usage):
+                    if ttft_ms is None:
+                        ttft_ms = int((time.time() - start) * 1000)
+                    parts.append(token)
+                    yield token
+            completed = True
+        except Exception as e:
+            logger.warning("Error al invocar LLM (stream): %s", e, extra={'fields': {'backend': backend, 'model': model}})
+            raise
+        finally:
+            latency_ms = int((time.time() - start) * 1000)
+            self.record_metrics(settings, student_profile, subject_ids, backend, model, plan.section_tokens['total'], "".join(parts), latency_ms, ttft_ms, stage_ms=stage_ms, usage=usage)
+        # Solo se cachean respuestas completas
+        if completed:
+            self.remember_turn(conversation_id, question, "".join(parts), settings)
+        if completed and cache_key is not None:
+            semantic_cache.store(query_vector, cache_key, "".join(parts), settings.get('collection_version'))
+
+    async def build_prompt_async(self, question, subject_ids, student_profile, chat_history, settings, query_vector=None, summary=""):
+        """
+        Variante asíncrona de build_prompt: la búsqueda en Qdrant y la consulta
+        del contexto de la materia corren en paralelo (asyncio.gather sobre hilos).
+        Devuelve el PromptPlan.
+        """
+        results, subject_context = await asyncio.gather(
+            asyncio.to_thread(self.retrieve_chunks, question, subject_ids, settings, query_vector),
+            asyncio.to_thread(self.get_subject_context, subject_ids),
+        )
+        return self.format_prompt(question, results, subject_context, chat_history, student_profile, settings.get('llm_model'), summary)
+
+    async def answer_question_async(self, question, subject_ids, student_profile=None, llm_backend="ollama", llm_model="gemma3:4b", chat_history=None, conversation_id=None):
+        """Variante asíncrona de answer_question para la ruta ASGI (asgi_app.py)."""
+        settings = await asyncio.to_thread(load_settings_from_db)
+        backend = settings.get('llm_backend', llm_backend)
+        model = settings.get('llm_model', llm_model)
+        summary, chat_history = await asyncio.to_thread(self.load_history, chat_history, conversation_id)
+
+        stage_ms = {}
+        start = time.time()
+        with trace(stage_ms):
+            query_vector, cache_key, cached = await asyncio.to_thread(
+                self.lookup_cached_answer, question, subject_ids, chat_history or summary, settings, backend, model, student_profile
+            )
+        if cached is not None:
+            latency_ms = int((time.time() - start) * 1000)
+            self.record_metrics(settings, student_profile, subject_ids, backend, model, 0, cached, latency_ms, cache_hit=True, stage_ms=stage_ms)
+            await asyncio.to_thread(self.remember_turn, conversation_id, question, cached, settings)
+            return cached
 
+        chat_history, summary = self.prompt_history(chat_history, summary, cache_key)
+        with trace(stage_ms):
+            plan = await self.build_prompt_async(question, subject_ids, self.prompt_profile(student_profile, cache_key), chat_history, settings, query_vector, summary)
+
+        with trace(stage_ms):
+            slot = await llm_dispatcher.acquire_async(backend, model, user=(student_profile or {}).get('id'))
+
+        usage = {}
+        start = time.time()
+        try:
+            base = llm_base_url(settings, backend)
+            with slot:
+                llm_response = await self.call_llm_async(backend=backend, prompt=plan.prompt, model=model, base_url=base, usage=usage)
+        except Exception as e:
+            logger.warning("Error al invocar LLM: %s", e, extra={'fields': {'backend': backend, 'model': model}})
+            llm_response = ""
+        latency_ms = int((time.time() - start) * 1000)
+
+        self.record_metrics(settings, student_profile, subject_ids, backend, model, plan.section_tokens['total'], llm_response, latency_ms, stage_ms=stage_ms, usage=usage)
+        await asyncio.to_thread(self.remember_turn, conversation_id, question, llm_response, settings)
+        if cache_key is not None:
+            semantic_cache.store(query_vector, cache_key, llm_response, settings.get('collection_version'))
         return llm_response
 
-    def run_crew(self, student_id, question, student_profile=None, llm_backend="ollama", llm_model="gemma3:4b", chat_history=None):
+    async def answer_question_stream_async(self, question, subject_ids, student_profile=None, llm_backend="ollama", llm_model="gemma3:4b", chat_history=None, conversation_id=None):
+        """Variante asíncrona de answer_question_stream para la ruta ASGI."""
+        settings = await asyncio.to_thread(load_settings_from_db)
+        backend = settings.get('llm_backend', llm_backend)
+        model = settings.get('llm_model', llm_model)
+        summary, chat_history = await asyncio.to_thread(self.load_history, chat_history, conversation_id)
+
+        stage_ms = {}
+        start = time.time()
+        with trace(stage_ms):
+            query_vector, cache_key, cached = await asyncio.to_thread(
+                self.lookup_cached_answer, question, subject_ids, chat_history or summary, settings, backend, model, student_profile
+            )
+        if cached is not None:
+            latency_ms = int((time.time() - start) * 1000)
+            self.record_metrics(settings, student_profile, subject_ids, backend, model, 0, cached, latency_ms, latency_ms, cache_hit=True, stage_ms=stage_ms)
+            await asyncio.to_thread(self.remember_turn, conversation_id, question, cached, settings)
+            yield cached
+            return
+
+        chat_history, summary = self.prompt_history(chat_history, summary, cache_key)
+        with trace(stage_ms):
+            plan = await self.build_prompt_async(question, subject_ids, self.prompt_profile(student_profile, cache_key), chat_history, settings, query_vector, summary)
+
+        with trace(stage_ms):
+            slot = await llm_dispatcher.acquire_async(backend, model, user=(student_profile or {}).get('id'))
+
+        parts = []
+        completed = False
+        ttft_ms = None
+        usage = {}
+        start = time.time()
+        try:
+            base = llm_base_url(settings, backend)
+            with slot:
+                async for token in self.call_llm_stream_async(backend=backend, prompt=plan.prompt, model=model, base_url=base, usage=usage):
+                    if ttft_ms is None:
+                        ttft_ms = int((time.time() - start) * 1000)
+                    parts.append(token)
+                    yield token
+            completed = True
+        except Exception as e:
+            logger.warning("Error al invocar LLM (stream): %s", e, extra={'fields': {'backend': backend, 'model': model}})
+            raise
+        finally:
+            latency_ms = int((time.time() - start) * 1000)
+            self.record_metrics(settings, student_profile, subject_ids, backend, model, plan.section_tokens['total'], "".join(parts), latency_ms, ttft_ms, stage_ms=stage_ms, usage=usage)
+        if completed:
+            await asyncio.to_thread(self.remember_turn, conversation_id, question, "".join(parts), settings)
+        if completed and cache_key is not None:
+            semantic_cache.store(query_vector, cache_key, "".join(parts), settings.get('collection_version'))
+
+    def run_crew(self, student_id, question, student_profile=None, llm_backend="ollama", llm_model="gemma3:4b", chat_history=None, conversation_id=None):
         """
         Orquesta el flujo CrewAI: obtiene subject_ids y responde la pregunta usando los agentes y tareas CrewAI.
         chat_history: lista de dicts [{'user':..., 'tutor':...}]
+        conversation_id: conversación guardada en el servidor (reemplaza a chat_history)
         """
         # Instanciar agentes CrewAI
         profile_agent = StudentProfileAgent(
@@ -321,7 +753,8 @@ Perfil del estudiante:
             student_profile=student_profile,
             llm_backend=llm_backend,
             llm_model=llm_model,
-            chat_history=chat_history
+            chat_history=chat_history,
+            conversation_id=conversation_id,
         )
         return respuesta
 
@@ -0,0 +1,142 @@
+# app_logging.py
+"""
+Logging del servidor con niveles, formato diferido y escritura no bloqueante.
+
+Los módulos obtienen su logger con get_logger(__name__) y registran con
+argumentos diferidos (logger.debug("... %s", valor)), de modo que el texto
+solo se formatea si el nivel está habilitado. Los registros pasan por una
+cola acotada (QueueHandler) y un hilo de fondo (QueueListener) los escribe
+en stderr: el camino de la petición nunca espera a la terminal. Si la cola
+se llena, el registro se descarta y se contabiliza.
+
+Los campos medibles (tiempos, tamaños) se pasan como
+extra={'fields': {...}}; con LOG_FORMAT=json cada línea es un objeto JSON
+listo para analizar, con LOG_FORMAT=text se añaden como clave=valor.
+El volcado completo del prompt se muestrea con LOG_PROMPT_SAMPLE_RATE.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_PROMPT_SAMPLE_RATE = float(os.getenv("LOG_PROMPT_SAMPLE_RATE", "0.01"))
+
+ROOT_LOGGER = "tutor"
+
+_lock = threading.Lock()
+_configured_pid = None
+_listener = None
+_handler = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """Texto legible o JSON por línea, incluyendo los campos de extra['fields']."""
+
+    def __init__(self, fmt_type: str = LOG_FORMAT):
+        super().__init__("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+        self.fmt_type = fmt_type
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        if self.fmt_type == "json":
+            entry = {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+                **fields,
+            }
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (y cuenta) en lugar de bloquear si la cola está llena."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El formateo (getMessage, JSON) lo hace el hilo del listener, no la petición
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Tras un fork el hilo del listener no existe en el hijo: se vuelve a crear
+        if _configured_pid != os.getpid():
+            configure_logging()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging() -> None:
+    """Configura (una vez por proceso) el logger 'tutor'; la cola y el hilo se rehacen tras un fork."""
+    global _configured_pid, _listener, _handler
+    pid = os.getpid()
+    if _configured_pid == pid:
+        return
+    with _lock:
+        if _configured_pid == pid:
+            return
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(StructuredFormatter())
+        if _handler is None:
+            _handler = DroppingQueueHandler(log_queue)
+            root = logging.getLogger(ROOT_LOGGER)
+            root.addHandler(_handler)
+            root.setLevel(LOG_LEVEL)
+            # Evita duplicar líneas en los handlers de Flask/uvicorn
+            root.propagate = False
+        else:
+            _handler.queue = log_queue
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        _configured_pid = pid
+
+
+def get_logger(name: str) -> logging.Logger:
+    configure_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def should_sample_prompt() -> bool:
+    """True para la fracción LOG_PROMPT_SAMPLE_RATE de las peticiones."""
+    return LOG_PROMPT_SAMPLE_RATE > 0 and random.random() < LOG_PROMPT_SAMPLE_RATE
+
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+
+def shutdown_logging(timeout: float = 2.0) -> None:
+    """Vacía la cola pendiente (apagado del proceso)."""
+    if _listener is None or _configured_pid != os.getpid():
+        return
+    deadline = time.monotonic() + timeout
+    while _listener.queue.full() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    try:
+        _listener.stop()
+    except queue.Full:
+        pass
+
+
+atexit.register(shutdown_logging)
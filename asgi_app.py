@@ -0,0 +1,152 @@
+# asgi_app.py
+"""
+Servidor ASGI del tutor.
+
+Atiende /api/chat y /api/chat/stream con las variantes asíncronas del
+TutorAgent (httpx + asyncio), de modo que las peticiones que esperan al LLM
+no ocupan un hilo cada una. El resto de rutas (login, dashboard, admin...)
+las sirve la aplicación Flask de auth_app.py montada como WSGI. La sesión
+es la misma cookie firmada de Flask.
+
+Ejecutar:
+    uvicorn asgi_app:app --port 5000
+"""
+
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from async_http import close_async_client
+from llm_dispatch import LLMOverloaded
+from auth_app import app as flask_app, parse_chat_request, resolve_conversation, session_student_profile, sse_event, tutor_agent
+
+
+def load_flask_session(request: Request) -> dict:
+    """Decodifica la cookie de sesión de Flask (mismo SECRET_KEY)."""
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return {}
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if serializer is None:
+        return {}
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+async def _read_chat_request(request: Request):
+    sess = load_flask_session(request)
+    if 'user_id' not in sess:
+        return None, JSONResponse({'error': 'Not authenticated'}, status_code=401)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    message, subject_id, chat_history, conversation_id, error = parse_chat_request(data if isinstance(data, dict) else {})
+    if error:
+        return None, JSONResponse({'error': error}, status_code=400)
+    # La consulta a PostgreSQL (solo en un fallo del LRU) no bloquea el event loop
+    conversation_id, error = await run_in_threadpool(resolve_conversation, sess, subject_id, conversation_id)
+    if error:
+        return None, JSONResponse({'error': error}, status_code=404)
+    return (message, subject_id, chat_history, session_student_profile(sess), conversation_id), None
+
+
+def overloaded_response(error: LLMOverloaded) -> JSONResponse:
+    return JSONResponse({'error': 'LLM overloaded', 'retry_after': error.retry_after}, status_code=429,
+                        headers={'Retry-After': str(error.retry_after)})
+
+
+async def api_chat(request: Request):
+    """Igual que POST /api/chat de Flask, sin bloquear un hilo durante la llamada al LLM."""
+    parsed, error_response = await _read_chat_request(request)
+    if error_response is not None:
+        return error_response
+    message, subject_id, chat_history, student_profile, conversation_id = parsed
+    try:
+        reply = await tutor_agent.answer_question_async(
+            question=message,
+            subject_ids=[subject_id],
+            student_profile=student_profile,
+            llm_backend="ollama",
+            llm_model="gemma3:4b",
+            chat_history=chat_history,
+            conversation_id=conversation_id,
+        )
+    except LLMOverloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return JSONResponse({'error': 'Chat processing failed', 'detail': str(e)}, status_code=500)
+    return JSONResponse({'reply': reply or '', 'conversation_id': conversation_id})
+
+
+async def api_chat_stream(request: Request):
+    """Igual que POST /api/chat/stream de Flask (Server-Sent Events), asíncrono."""
+    parsed, error_response = await _read_chat_request(request)
+    if error_response is not None:
+        return error_response
+    message, subject_id, chat_history, student_profile, conversation_id = parsed
+
+    tokens = tutor_agent.answer_question_stream_async(
+        question=message,
+        subject_ids=[subject_id],
+        student_profile=student_profile,
+        llm_backend="ollama",
+        llm_model="gemma3:4b",
+        chat_history=chat_history,
+        conversation_id=conversation_id,
+    )
+    # Como en Flask: el primer fragmento se pide antes de responder para poder devolver 429
+    first, failure = [], None
+    try:
+        first.append(await tokens.__anext__())
+    except StopAsyncIteration:
+        pass
+    except LLMOverloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        failure = e
+
+    async def generate():
+        parts = list(first)
+        for token in first:
+            yield sse_event({'token': token})
+        try:
+            if failure is not None:
+                raise failure
+            async for token in tokens:
+                parts.append(token)
+                yield sse_event({'token': token})
+        except Exception as e:
+            yield sse_event({'error': 'Chat processing failed', 'detail': str(e)}, event='error')
+            return
+        yield sse_event({'reply': ''.join(parts), 'conversation_id': conversation_id}, event='done')
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await close_async_client()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/chat', api_chat, methods=['POST']),
+        Route('/api/chat/stream', api_chat_stream, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,39 @@
+# async_http.py
+"""
+Cliente HTTP asíncrono compartido (httpx) para las llamadas al LLM desde la
+ruta ASGI. Un único AsyncClient por proceso reutiliza conexiones keep-alive
+hacia Ollama / el servidor compatible con OpenAI, de modo que cientos de
+chats concurrentes esperan al LLM sin ocupar un hilo cada uno.
+"""
+
+import os
+from typing import Optional
+
+import httpx
+
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "200"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "50"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """AsyncClient del proceso; se crea en el primer uso dentro del event loop."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_HTTP_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+            ),
+        )
+    return _client
+
+
+async def close_async_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
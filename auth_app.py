@@ -2,48 +2,31 @@
 Aplicación Flask para autenticación de usuarios con interfaz moderna.
 Incluye endpoint de chat nativo (sin Gradio) que integra con el Tutor RAG.
 """
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-import psycopg2
+from flask import Flask, Response, g, render_template, request, redirect, url_for, session, jsonify, stream_with_context
 import hashlib
+import itertools
+import json
 import os
 from datetime import datetime, timedelta
 from agents_rag import StudentProfileAgent, TutorAgent
+from app_logging import dropped_records, get_logger
+from conversation_memory import conversation_memory
+from db import get_conn, pool_stats
+from embedding_cache import get_embedding_cache
+from llm_dispatch import LLMOverloaded, llm_dispatcher
+from metrics_sink import metrics_sink
+from retrieval_cache import retrieval_cache
+from semantic_cache import semantic_cache
+from settings_cache import get_settings, invalidate_settings
+from tracing import finish_span, render_prometheus, start_span, traced
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
-
-# Configuración de base de datos
-PG_CONFIG = {
-    'host': 'localhost',
-    'port': 5432,
-    'dbname': 'tutor_db',
-    'user': 'tutor_user',
-    'password': 'tutor_pass'
-}
-
-def get_db_connection():
-    return psycopg2.connect(**PG_CONFIG)
+logger = get_logger(__name__)
 
 def load_settings():
-    """Fetch app settings (single-row table)."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT llm_backend, llm_model, ollama_url, openai_base_url, qdrant_url, qdrant_collection, logging_enabled FROM app_settings WHERE id=1;")
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    if not row:
-        return {
-            'llm_backend': 'ollama',
-            'llm_model': 'gemma3:4b',
-            'ollama_url': 'http://localhost:11434',
-            'openai_base_url': 'https://api.openai.com',
-            'qdrant_url': 'http://localhost:6333',
-            'qdrant_collection': 'tutor_demo',
-            'logging_enabled': True,
-        }
-    keys = ['llm_backend','llm_model','ollama_url','openai_base_url','qdrant_url','qdrant_collection','logging_enabled']
-    return dict(zip(keys, row))
+    """Fetch app settings (single-row table), served from the in-process TTL cache."""
+    return get_settings()
 
 def is_admin():
     """Simple admin check using ADMIN_EMAILS env (comma-separated)."""
@@ -53,20 +36,33 @@ def is_admin():
     allowed = {e.strip().lower() for e in emails.split(',') if e.strip()}
     return session.get('user_email','').lower() in allowed
 
+@app.before_request
+def start_request_span():
+    # Una etapa por endpoint (http.<endpoint>): latencia, en curso y errores 5xx
+    g.request_span = start_span(f"http.{request.endpoint or 'unknown'}")
+
+@app.after_request
+def remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_span(exc):
+    handle = g.pop('request_span', None)
+    if handle is not None:
+        finish_span(handle, error=exc is not None or g.get('response_status', 500) >= 500)
+
+@traced('db.verify_user')
 def verify_user(email, password):
     """Verifica las credenciales del usuario"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT id, name, career, grade, language 
-        FROM students 
-        WHERE email = %s AND password = %s
-    """, (email, password))
-    
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, name, career, grade, language 
+                FROM students 
+                WHERE email = %s AND password = %s
+            """, (email, password))
+            user = cur.fetchone()
     
     if user:
         return {
@@ -127,17 +123,15 @@ def dashboard():
         return redirect(url_for('index'))
     
     # Obtener materias del usuario
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT s.name, s.id
-        FROM subjects s
-        JOIN enrollments e ON s.id = e.subject_id
-        WHERE e.student_id = %s
-    """, (session['user_id'],))
-    subjects = cur.fetchall()
-    cur.close()
-    conn.close()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT s.name, s.id
+                FROM subjects s
+                JOIN enrollments e ON s.id = e.subject_id
+                WHERE e.student_id = %s
+            """, (session['user_id'],))
+            subjects = cur.fetchall()
     
     return render_template('dashboard.html', 
                          user=session, 
@@ -159,42 +153,61 @@ def admin_page():
             'qdrant_url': request.form.get('qdrant_url','http://localhost:6333'),
             'qdrant_collection': request.form.get('qdrant_collection','tutor_demo'),
             'logging_enabled': True if request.form.get('logging_enabled') == 'on' else False,
+            'retrieval_backend': 'local' if request.form.get('retrieval_backend') == 'local' else 'qdrant',
         }
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            UPDATE app_settings SET
-              llm_backend=%s,
-              llm_model=%s,
-              ollama_url=%s,
-              openai_base_url=%s,
-              qdrant_url=%s,
-              qdrant_collection=%s,
-              logging_enabled=%s,
-              updated_at=NOW()
-            WHERE id=1
-            """,
-            (data['llm_backend'], data['llm_model'], data['ollama_url'], data['openai_base_url'], data['qdrant_url'], data['qdrant_collection'], data['logging_enabled'])
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE app_settings SET
+                      llm_backend=%s,
+                      llm_model=%s,
+                      ollama_url=%s,
+                      openai_base_url=%s,
+                      qdrant_url=%s,
+                      qdrant_collection=%s,
+                      logging_enabled=%s,
+                      retrieval_backend=%s,
+                      updated_at=NOW()
+                    WHERE id=1
+                    """,
+                    (data['llm_backend'], data['llm_model'], data['ollama_url'], data['openai_base_url'], data['qdrant_url'], data['qdrant_collection'], data['logging_enabled'], data['retrieval_backend'])
+                )
+            conn.commit()
+        # El trigger de app_settings notifica al resto de workers; aquí invalidamos el propio
+        invalidate_settings()
 
     # Reload settings and metrics
     settings = load_settings()
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, user_id, subject_id, backend, model, prompt_tokens, completion_tokens, total_tokens, latency_ms, created_at
-        FROM chat_metrics
-        ORDER BY created_at DESC
-        LIMIT 50
-    """)
-    metrics = cur.fetchall()
-    cur.close()
-    conn.close()
-    return render_template('admin.html', settings=settings, metrics=metrics, user=session)
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, user_id, subject_id, backend, model, prompt_tokens, completion_tokens, total_tokens, latency_ms, created_at, ttft_ms, cache_hit,
+                       embed_ms, retrieval_ms, subject_context_ms, prompt_ms, tokenize_ms
+                FROM chat_metrics
+                ORDER BY created_at DESC
+                LIMIT 50
+            """)
+            metrics = cur.fetchall()
+            cur.execute("""
+                SELECT COUNT(*) FILTER (WHERE cache_hit), COUNT(*)
+                FROM chat_metrics
+                WHERE created_at > NOW() - INTERVAL '24 hours'
+            """)
+            hits, total = cur.fetchone()
+            # Dónde se va el tiempo: promedio por etapa en las últimas 24 h
+            cur.execute("""
+                SELECT AVG(embed_ms), AVG(retrieval_ms), AVG(subject_context_ms), AVG(prompt_ms), AVG(tokenize_ms), AVG(queue_ms), AVG(latency_ms)
+                FROM chat_metrics
+                WHERE created_at > NOW() - INTERVAL '24 hours'
+            """)
+            stage_avgs = cur.fetchone()
+    stage_names = ['Embedding', 'Qdrant', 'Contexto materia (SQL)', 'Prompt', 'Tokens', 'Cola LLM', 'LLM']
+    stages = [(name, int(avg) if avg is not None else None) for name, avg in zip(stage_names, stage_avgs)]
+    cache = {'hits': hits, 'total': total, 'hit_rate': round(hits / total, 3) if total else 0.0}
+    embed_cache = get_embedding_cache()
+    embed_cache = embed_cache.stats() if embed_cache is not None else None
+    return render_template('admin.html', settings=settings, metrics=metrics, pool=pool_stats(), metrics_writer=metrics_sink.stats(), cache=cache, semantic_cache=semantic_cache.stats(), embed_cache=embed_cache, retrieval_cache=retrieval_cache.stats(), llm_lanes=llm_dispatcher.stats(), stages=stages, user=session)
 
 @app.route('/chat/<int:subject_id>')
 def chat(subject_id):
@@ -202,69 +215,201 @@ def chat(subject_id):
         return redirect(url_for('index'))
     
     # Verificar que el usuario esté inscrito en la materia
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT s.name
-        FROM subjects s
-        JOIN enrollments e ON s.id = e.subject_id
-        WHERE e.student_id = %s AND s.id = %s
-    """, (session['user_id'], subject_id))
-    subject = cur.fetchone()
-    cur.close()
-    conn.close()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT s.name
+                FROM subjects s
+                JOIN enrollments e ON s.id = e.subject_id
+                WHERE e.student_id = %s AND s.id = %s
+            """, (session['user_id'], subject_id))
+            subject = cur.fetchone()
     
     if not subject:
         return redirect(url_for('dashboard'))
+
+    # Retoma la última conversación guardada en la materia (?new=1 inicia otra)
+    conversation_id, history = None, []
+    try:
+        conversation_id = conversation_memory.resolve(session['user_id'], subject_id, new=bool(request.args.get('new')))
+        history = conversation_memory.transcript(conversation_id)
+    except Exception as e:
+        logger.warning("No se pudo abrir la conversación: %s", e)
     
     return render_template('chat.html', 
                          subject_name=subject[0],
                          subject_id=subject_id,
+                         conversation_id=conversation_id or '',
+                         history=history,
                          gradio_port=7860)
 
+def session_student_profile(sess=None):
+    """Perfil básico del estudiante a partir de la sesión Flask (o de un dict de sesión)."""
+    sess = session if sess is None else sess
+    return {
+        'id': sess.get('user_id'),
+        'name': sess.get('user_name'),
+        'email': sess.get('user_email'),
+        'career': sess.get('user_career'),
+        'grade': sess.get('user_grade'),
+        'language': sess.get('user_language'),
+    }
+
+def resolve_conversation(sess, subject_id, conversation_id=None):
+    """
+    Conversación del servidor para el chat. Devuelve (conversation_id, error):
+    un conversation_id ajeno o inexistente es un error; sin él se retoma la
+    última conversación del usuario en la materia. Si la base no responde se
+    sigue sin memoria (None) y se usa el chat_history del cliente.
+    """
+    try:
+        resolved = conversation_memory.resolve(sess.get('user_id'), subject_id, conversation_id)
+    except Exception as e:
+        logger.warning("No se pudo abrir la conversación: %s", e)
+        return None, None
+    if conversation_id and resolved is None:
+        return None, 'Unknown conversation_id'
+    return resolved, None
+
+def parse_chat_request(data):
+    """Valida el JSON de chat. Devuelve (message, subject_id, chat_history, conversation_id, error)."""
+    message = (data.get('message') or '').strip()
+    subject_id = data.get('subject_id')
+    chat_history = data.get('chat_history')
+    conversation_id = data.get('conversation_id') or None
+    if not message:
+        return None, None, None, None, 'Empty message'
+    if not subject_id:
+        return None, None, None, None, 'Missing subject_id'
+    try:
+        subject_id = int(subject_id)
+    except (TypeError, ValueError):
+        return None, None, None, None, 'Invalid subject_id'
+    if conversation_id is not None and not isinstance(conversation_id, str):
+        return None, None, None, None, 'Invalid conversation_id'
+    return message, subject_id, chat_history, conversation_id, None
+
+def overloaded_response(error):
+    """429 con Retry-After cuando la cola del LLM (llm_dispatch.py) rechaza la petición."""
+    response = jsonify({'error': 'LLM overloaded', 'retry_after': error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def sse_event(data, event=None):
+    """Serializa un evento Server-Sent Events."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.route('/api/chat', methods=['POST'])
 def api_chat():
     """Endpoint de chat nativo para el tutor.
-    Espera JSON: { message: str, subject_id: int, chat_history?: [{user,tutor}, ...] }
-    Devuelve: { reply: str }
+    Espera JSON: { message: str, subject_id: int, conversation_id?: str, chat_history?: [{user,tutor}, ...] }
+    El historial lo guarda el servidor (conversation_memory.py): basta con el
+    conversation_id (sin él se usa la última conversación del usuario en la
+    materia). chat_history solo se usa si la base de conversaciones no responde.
+    Devuelve: { reply: str, conversation_id: str }, o 429 con Retry-After si
+    el LLM está saturado.
     """
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    data = request.get_json(silent=True) or {}
-    message = data.get('message', '').strip()
-    subject_id = data.get('subject_id')
-    chat_history = data.get('chat_history')
-
-    if not message:
-        return jsonify({'error': 'Empty message'}), 400
-    if not subject_id:
-        return jsonify({'error': 'Missing subject_id'}), 400
+    message, subject_id, chat_history, conversation_id, error = parse_chat_request(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({'error': error}), 400
+    conversation_id, error = resolve_conversation(session, subject_id, conversation_id)
+    if error:
+        return jsonify({'error': error}), 404
 
     # Construir perfil del estudiante (básico) desde la sesión
-    student_profile = {
-        'id': session.get('user_id'),
-        'name': session.get('user_name'),
-        'email': session.get('user_email'),
-        'career': session.get('user_career'),
-        'grade': session.get('user_grade'),
-        'language': session.get('user_language'),
-    }
+    student_profile = session_student_profile()
 
     try:
         # Llamar al TutorAgent con el subject_id actual
         reply = tutor_agent.answer_question(
             question=message,
-            subject_ids=[int(subject_id)],
+            subject_ids=[subject_id],
             student_profile=student_profile,
             llm_backend="ollama",
             llm_model="gemma3:4b",
             chat_history=chat_history,
+            conversation_id=conversation_id,
         )
+    except LLMOverloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'error': 'Chat processing failed', 'detail': str(e)}), 500
 
-    return jsonify({'reply': reply or ''})
+    return jsonify({'reply': reply or '', 'conversation_id': conversation_id})
+
+@app.route('/api/chat/stream', methods=['POST'])
+def api_chat_stream():
+    """Versión en streaming de /api/chat (Server-Sent Events).
+    Espera el mismo JSON que /api/chat. Emite eventos `data: {"token": str}`
+    a medida que el LLM genera, y al final `event: done` con la respuesta
+    completa o `event: error` si la generación falla. Si el LLM está saturado
+    responde 429 con Retry-After antes de abrir el stream.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    message, subject_id, chat_history, conversation_id, error = parse_chat_request(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({'error': error}), 400
+    conversation_id, error = resolve_conversation(session, subject_id, conversation_id)
+    if error:
+        return jsonify({'error': error}), 404
+
+    student_profile = session_student_profile()
+
+    tokens = tutor_agent.answer_question_stream(
+        question=message,
+        subject_ids=[subject_id],
+        student_profile=student_profile,
+        llm_backend="ollama",
+        llm_model="gemma3:4b",
+        chat_history=chat_history,
+        conversation_id=conversation_id,
+    )
+    # El primer fragmento se pide antes de responder: el rechazo de la cola del LLM sale como 429
+    first, failure = [], None
+    try:
+        first.append(next(tokens))
+    except StopIteration:
+        pass
+    except LLMOverloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        failure = e
+
+    def generate():
+        parts = []
+        try:
+            if failure is not None:
+                raise failure
+            for token in itertools.chain(first, tokens):
+                parts.append(token)
+                yield sse_event({'token': token})
+        except Exception as e:
+            yield sse_event({'error': 'Chat processing failed', 'detail': str(e)}, event='error')
+            return
+        yield sse_event({'reply': ''.join(parts), 'conversation_id': conversation_id}, event='done')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/metrics')
+def metrics():
+    """Latencias por etapa en formato Prometheus (histogramas, en curso y errores)."""
+    body = render_prometheus() + llm_dispatcher.render_prometheus() + (
+        "# HELP tutor_log_records_dropped_total Registros de log descartados por cola llena.\n"
+        "# TYPE tutor_log_records_dropped_total counter\n"
+        f"tutor_log_records_dropped_total {dropped_records()}\n"
+    )
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/user-info')
 def api_user_info():
@@ -0,0 +1,197 @@
+# benchmarks/collection_configs.py
+"""
+Benchmark de configuraciones de la colección (collection_config.py):
+memoria estimada, recall y latencia de la búsqueda densa.
+
+Copia los puntos de --source-collection (vectores y subject_id) a una
+colección temporal bench_<config> por cada configuración de --configs y,
+para cada hnsw_ef de --ef y cada opción de --rescore, busca las preguntas de
+--questions filtrando por materia. Se reporta:
+
+- recall@k frente a la búsqueda exacta (float32, sin índice) en la colección
+  original: mide lo que se pierde por HNSW y cuantización, no la relevancia;
+- latencia p50/p95;
+- memoria estimada: vectores originales (en RAM o en disco), vectores
+  cuantizados y enlaces del grafo HNSW (nivel 0: 2·m por punto).
+
+Qdrant busca por fuerza bruta en segmentos pequeños y en filtros con pocos
+puntos, y así todas las configuraciones darían el mismo resultado. Por eso las
+colecciones del benchmark bajan indexing_threshold y full_scan_threshold
+para forzar el índice HNSW.
+
+Requiere Qdrant y Ollama (embeddings de las preguntas). Ejemplo:
+
+    python benchmarks/collection_configs.py --configs float32,scalar,product --ef 16,64,128 --rescore 1,0
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qdrant_client import QdrantClient  # noqa: E402
+from qdrant_client.models import FieldCondition, Filter, HnswConfigDiff, MatchValue, OptimizersConfigDiff, PointStruct  # noqa: E402
+
+from collection_config import CollectionConfig, provision_collection, search_params  # noqa: E402
+from retrieval_clients import lease_retrieval_clients  # noqa: E402
+from retrieval_metrics import DEFAULT_QUESTIONS, load_questions, percentile  # noqa: E402
+
+PRESETS = {
+    "float32": {"quantization": "none", "on_disk": False},
+    "float32-disk": {"quantization": "none", "on_disk": True},
+    "scalar": {"quantization": "scalar", "on_disk": True},
+    "product": {"quantization": "product", "on_disk": True},
+}
+COMPRESSION = {"x4": 4, "x8": 8, "x16": 16, "x32": 32, "x64": 64}
+
+
+def estimate_memory(n, dim, config):
+    """Bytes estimados en RAM y en disco de los vectores y el grafo HNSW."""
+    original = n * dim * 4
+    if config.quantization == "scalar":
+        quantized = n * dim
+    elif config.quantization == "product":
+        quantized = original // COMPRESSION[config.pq_compression]
+    else:
+        quantized = 0
+    hnsw = n * 2 * config.hnsw_m * 4
+    ram = hnsw + (0 if config.on_disk else original) + (quantized if config.always_ram else 0)
+    return {"ram_mb": round(ram / 2**20, 2), "disk_mb": round((original + quantized) / 2**20, 2),
+            "vectors_mb": round(original / 2**20, 2), "quantized_mb": round(quantized / 2**20, 2),
+            "hnsw_mb": round(hnsw / 2**20, 2)}
+
+
+def scroll_points(client, collection, batch_size=1000):
+    points, offset = [], None
+    while True:
+        batch, offset = client.scroll(collection_name=collection, limit=batch_size, offset=offset,
+                                      with_payload=["subject_id"], with_vectors=True)
+        points.extend(batch)
+        if offset is None:
+            return points
+
+
+def search_ids(client, collection, vector, subject_id, k, params):
+    query_filter = Filter(must=[FieldCondition(key="subject_id", match=MatchValue(value=subject_id))])
+    if hasattr(client, "query_points"):
+        points = client.query_points(collection_name=collection, query=vector, query_filter=query_filter,
+                                     limit=k, search_params=params).points
+    else:
+        points = client.search(collection_name=collection, query_vector=vector, query_filter=query_filter,
+                               limit=k, search_params=params)
+    return [str(p.id) for p in points]
+
+
+def wait_indexed(client, collection, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = client.get_collection(collection)
+        if str(getattr(info.status, "value", info.status)) == "green" and (info.indexed_vectors_count or 0) > 0:
+            return
+        time.sleep(1)
+    print(f"[WARN] {collection} sigue indexando tras {timeout}s; los resultados pueden ser de fuerza bruta.")
+
+
+def build_collection(client, name, points, dim, config):
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    provision_collection(client, name, dim, config)
+    client.update_collection(collection_name=name, optimizer_config=OptimizersConfigDiff(indexing_threshold=1),
+                             hnsw_config=HnswConfigDiff(full_scan_threshold=1))
+    for start in range(0, len(points), 256):
+        client.upsert(collection_name=name, points=[
+            PointStruct(id=p.id, vector=p.vector, payload={"subject_id": (p.payload or {}).get("subject_id")})
+            for p in points[start:start + 256]
+        ])
+    start = time.perf_counter()
+    wait_indexed(client, name)
+    return time.perf_counter() - start
+
+
+def run(args):
+    client = QdrantClient(url=args.qdrant_url, timeout=120)
+    points = scroll_points(client, args.source_collection)
+    if not points:
+        sys.exit(f"La colección {args.source_collection} está vacía o no existe.")
+    dim = len(points[0].vector)
+    with lease_retrieval_clients(args.qdrant_url, args.source_collection, args.embed_model) as clients:
+        queries = [(item["subject_id"], clients.embeddings.embed_query(item["query"])) for item in load_questions(args.questions)]
+    exact = search_params(exact=True)
+    truth = [search_ids(client, args.source_collection, vector, subject, args.k, exact) for subject, vector in queries]
+
+    report = {"points": len(points), "dim": dim, "queries": len(queries), "k": args.k, "results": []}
+    for name in args.configs:
+        config = CollectionConfig(hnsw_m=args.m, hnsw_ef_construct=args.ef_construct, pq_compression=args.pq_compression,
+                                  **PRESETS[name])
+        collection = f"bench_{name.replace('-', '_')}"
+        index_seconds = build_collection(client, collection, points, dim, config)
+        memory = estimate_memory(len(points), dim, config)
+        # Sin cuantización el rescoring no cambia nada
+        rescores = args.rescore if config.quantization != "none" else args.rescore[:1]
+        for ef in args.ef:
+            for rescore in rescores:
+                params = search_params(ef=ef, rescore=bool(rescore), oversampling=args.oversampling)
+                recalls, ms = [], []
+                for (subject, vector), expected in zip(queries, truth):
+                    found = None
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        found = search_ids(client, collection, vector, subject, args.k, params)
+                        ms.append((time.perf_counter() - start) * 1000)
+                    if expected:
+                        recalls.append(len(set(found) & set(expected)) / len(expected))
+                report["results"].append({
+                    "config": name, "ef": ef, "rescore": bool(rescore),
+                    f"recall@{args.k}": round(statistics.fmean(recalls), 4) if recalls else 0.0,
+                    "p50_ms": round(percentile(ms, 50), 2), "p95_ms": round(percentile(ms, 95), 2),
+                    "index_s": round(index_seconds, 1), **memory,
+                })
+        if not args.keep:
+            client.delete_collection(collection)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria, recall y latencia por configuración de la colección de Qdrant.")
+    parser.add_argument("--qdrant-url", default=os.getenv("QDRANT_URL", "http://localhost:6333"))
+    parser.add_argument("--source-collection", default=os.getenv("QDRANT_COLLECTION", "tutor_demo"))
+    parser.add_argument("--embed-model", default=os.getenv("EMBED_MODEL", "nomic-embed-text"))
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--configs", type=lambda v: v.split(","), default=list(PRESETS),
+                        help=f"Configuraciones separadas por coma: {', '.join(PRESETS)}.")
+    parser.add_argument("--m", type=int, default=16, help="HNSW m de todas las configuraciones.")
+    parser.add_argument("--ef-construct", type=int, default=100)
+    parser.add_argument("--pq-compression", choices=list(COMPRESSION), default="x16")
+    parser.add_argument("--ef", type=lambda v: [int(x) for x in v.split(",")], default=[16, 64, 128],
+                        help="Valores de hnsw_ef en la búsqueda.")
+    parser.add_argument("--rescore", type=lambda v: [int(x) for x in v.split(",")], default=[1, 0])
+    parser.add_argument("--oversampling", type=float, default=2.0)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por pregunta para medir latencia.")
+    parser.add_argument("--keep", action="store_true", help="No borra las colecciones bench_* al terminar.")
+    parser.add_argument("--json", action="store_true", help="Imprime el resultado como JSON.")
+    args = parser.parse_args()
+    unknown = [c for c in args.configs if c not in PRESETS]
+    if unknown:
+        parser.error(f"configuraciones desconocidas: {', '.join(unknown)}")
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    recall = f"recall@{args.k}"
+    print(f"Puntos: {report['points']} (dim {report['dim']}), preguntas: {report['queries']}, m={args.m}, "
+          f"ef_construct={args.ef_construct}, oversampling={args.oversampling}")
+    print(f"{'config':<13} {'ef':>4} {'rescore':>7} {recall:>10} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'RAM MB':>8} {'disco MB':>9} {'index s':>8}")
+    for r in report["results"]:
+        print(f"{r['config']:<13} {r['ef']:>4} {str(r['rescore']):>7} {r[recall]:>10} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['ram_mb']:>8} {r['disk_mb']:>9} {r['index_s']:>8}")
+
+
+if __name__ == "__main__":
+    main()
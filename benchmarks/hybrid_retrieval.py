@@ -0,0 +1,105 @@
+# benchmarks/hybrid_retrieval.py
+"""
+Benchmark de la recuperación híbrida (hybrid_search.py) contra la densa.
+
+Para cada consulta de --queries se calcula el embedding una sola vez (costo
+común a ambos modos) y se mide, con la colección y el índice léxico reales:
+
+- recall@k: chunks relevantes entre los k devueltos / min(k, relevantes).
+  Son relevantes los chunks de la materia que contienen todos los marcadores
+  de la consulta (sin acentos ni mayúsculas; "a|b" acepta cualquiera); como
+  el índice léxico tiene todos los chunks, el conjunto relevante es exacto.
+- MRR: inverso de la posición del primer chunk relevante.
+- latencia p50/p95 de la búsqueda (densa, o densa + BM25 + fusión).
+
+Requiere Qdrant y Ollama en marcha y el índice léxico construido
+(python ingest_pipeline.py --rebuild-lexical). Ejemplo:
+
+    python benchmarks/hybrid_retrieval.py --k 5 --repeat 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hybrid_search import hybrid_search, lexical_weight  # noqa: E402
+from lexical_index import get_lexical_index  # noqa: E402
+from retrieval_clients import lease_retrieval_clients  # noqa: E402
+from retrieval_metrics import DEFAULT_QUESTIONS, load_questions, percentile, relevant_ids, score_ranking  # noqa: E402
+from subject_sharding import subject_filter  # noqa: E402
+
+
+def run(args):
+    queries = load_questions(args.queries)
+    index = get_lexical_index(args.collection)
+    if index is None:
+        sys.exit("No hay índice léxico: ejecuta python ingest_pipeline.py --rebuild-lexical")
+    documents = list(zip(index.ids, index.texts, index.subjects))
+
+    modes = {"dense": {"recall": [], "rr": [], "ms": []}, "hybrid": {"recall": [], "rr": [], "ms": []}}
+    skipped = 0
+    with lease_retrieval_clients(args.qdrant_url, args.collection, args.embed_model) as clients:
+        for item in queries:
+            subject_ids = [item["subject_id"]]
+            relevant = relevant_ids(documents, subject_ids, item["relevant"])
+            if not relevant:
+                skipped += 1
+                print(f"[WARN] Sin chunks relevantes en la colección para: {item['query']}")
+                continue
+            vector = clients.embeddings.embed_query(item["query"])
+            filter = subject_filter(subject_ids)
+            weights = {"dense": 0.0, "hybrid": lexical_weight(subject_ids) or 1.0}
+            for mode, weight in weights.items():
+                docs = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    docs = hybrid_search(clients.vectorstore, item["query"], subject_ids, filter, args.collection,
+                                         k=args.k, query_vector=vector, weight=weight)
+                    modes[mode]["ms"].append((time.perf_counter() - start) * 1000)
+                recall, rr = score_ranking(docs, relevant, args.k)
+                modes[mode]["recall"].append(recall)
+                modes[mode]["rr"].append(rr)
+
+    report = {"k": args.k, "queries": len(queries) - skipped, "skipped": skipped}
+    for mode, data in modes.items():
+        report[mode] = {
+            f"recall@{args.k}": round(statistics.fmean(data["recall"]), 3) if data["recall"] else 0.0,
+            "mrr": round(statistics.fmean(data["rr"]), 3) if data["rr"] else 0.0,
+            "p50_ms": round(percentile(data["ms"], 50), 2),
+            "p95_ms": round(percentile(data["ms"], 95), 2),
+        }
+    report["overhead_p50_ms"] = round(report["hybrid"]["p50_ms"] - report["dense"]["p50_ms"], 2)
+    report["recall_gain"] = round(report["hybrid"][f"recall@{args.k}"] - report["dense"][f"recall@{args.k}"], 3)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall y latencia: búsqueda densa vs híbrida (BM25 + RRF).")
+    parser.add_argument("--queries", default=DEFAULT_QUESTIONS, help="JSON con consultas, subject_id y marcadores de relevancia.")
+    parser.add_argument("--qdrant-url", default=os.getenv("QDRANT_URL", "http://localhost:6333"))
+    parser.add_argument("--collection", default=os.getenv("QDRANT_COLLECTION", "tutor_demo"))
+    parser.add_argument("--embed-model", default=os.getenv("EMBED_MODEL", "nomic-embed-text"))
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por consulta para medir latencia.")
+    parser.add_argument("--json", action="store_true", help="Imprime el resultado como JSON.")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"Consultas: {report['queries']} (omitidas: {report['skipped']}), k={report['k']}")
+    print(f"{'modo':<8} {'recall@' + str(report['k']):>10} {'MRR':>7} {'p50 ms':>9} {'p95 ms':>9}")
+    for mode in ("dense", "hybrid"):
+        row = report[mode]
+        print(f"{mode:<8} {row['recall@' + str(report['k'])]:>10} {row['mrr']:>7} {row['p50_ms']:>9} {row['p95_ms']:>9}")
+    print(f"Sobrecosto híbrido (p50): {report['overhead_p50_ms']} ms | ganancia de recall: {report['recall_gain']:+}")
+
+
+if __name__ == "__main__":
+    main()
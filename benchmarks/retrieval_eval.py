@@ -0,0 +1,349 @@
+# benchmarks/retrieval_eval.py
+"""
+Evaluación offline de la recuperación del tutor (calidad y latencia).
+
+Reproduce las preguntas de --questions (por defecto benchmarks/questions.json)
+a través de la parte de recuperación de TutorAgent.answer_question
+(embed_question + retrieve_chunks, incluida la búsqueda híbrida) y reporta
+por configuración (chunking, k, filtro):
+
+- recall@k y MRR (relevancia por marcadores, ver retrieval_metrics.py) de
+  la búsqueda del tutor y, al lado, de la búsqueda solo densa: un recall
+  híbrido alto puede venir entero de BM25 aunque la densa no devuelva nada;
+- latencia p50/p95/p99 de la búsqueda y QPS con --concurrency hilos;
+- p50 del embedding de la pregunta (común a todas las configuraciones).
+
+Backends:
+- memory (por defecto): ingesta los documentos de las materias en un
+  QdrantClient(":memory:") por cada --chunking "tamaño:solape", con su
+  índice léxico en un directorio temporal. Con --embedder hashing no hace
+  falta ningún servicio (embeddings por hashing de términos, útiles para
+  comparar latencias y detectar regresiones, no la calidad del modelo real).
+- qdrant: usa la colección existente (--qdrant-url, --collection) tal como
+  está fragmentada.
+
+Con --retrieval-backends qdrant,local se mide además la búsqueda densa con el
+índice en proceso de local_index.py (construido desde la misma colección).
+
+Filtros: "subject" busca solo en la materia de la pregunta; "all" en todas
+las materias de la colección (la relevancia se juzga siempre en la materia
+de la pregunta).
+
+La caché de recuperación (retrieval_cache.py) se desactiva salvo con
+--with-cache, ya que las repeticiones serían aciertos.
+
+Los resultados se guardan como JSON (--output). Con --baseline se comparan
+con una corrida anterior y el proceso termina con código 1 si recall o MRR
+caen más de --max-recall-drop o el p95 crece más de --max-latency-increase.
+
+    python benchmarks/retrieval_eval.py --embedder hashing --text-only
+    python benchmarks/retrieval_eval.py --embedder hashing --text-only --retrieval-backends qdrant,local
+    python benchmarks/retrieval_eval.py --k 1,3,5,10 --chunking 500:50,1000:100
+    python benchmarks/retrieval_eval.py --backend qdrant --baseline benchmarks/results/anterior.json
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.embeddings import Embeddings  # noqa: E402
+from langchain_ollama import OllamaEmbeddings  # noqa: E402
+from langchain_qdrant import Qdrant  # noqa: E402
+from qdrant_client import QdrantClient  # noqa: E402
+
+import agents_rag  # noqa: E402
+import ingest_pipeline  # noqa: E402
+import lexical_index  # noqa: E402
+import local_index  # noqa: E402
+from agents_rag import EMBED_MODEL, TutorAgent  # noqa: E402
+from embedding_cache import with_embedding_cache  # noqa: E402
+from embedding_stage import OllamaBatchEmbedder  # noqa: E402
+from hybrid_search import HYBRID_ENABLED  # noqa: E402
+from retrieval_clients import RetrievalClients, register_retrieval_clients  # noqa: E402
+from retrieval_metrics import DEFAULT_QUESTIONS, load_questions, percentile, relevant_ids, score_ranking  # noqa: E402
+from subject_sharding import ShardRouter  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+HASHING_DIM = 384
+
+
+class HashingEmbeddings(Embeddings):
+    """Embeddings deterministas por hashing de términos (sin servicios externos)."""
+
+    def __init__(self, dim: int = HASHING_DIM):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for term in lexical_index.tokenize(text):
+            digest = hashlib.md5(term.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    def embed_batch(self, texts):
+        return self.embed_documents(texts)
+
+
+def parse_chunking(spec):
+    configs = []
+    for item in spec.split(","):
+        size, _, overlap = item.strip().partition(":")
+        configs.append((int(size), int(overlap or 0)))
+    return configs
+
+
+def build_memory_collections(args):
+    """
+    Una colección en memoria (y su índice léxico) por configuración de
+    chunking. Devuelve [(etiqueta, settings, documentos)], con documentos
+    [(point_id, texto, subject_id)] para calcular la relevancia.
+    """
+    files = [(d, f) for d, f in ingest_pipeline.list_source_files() if not (args.text_only and f.endswith(".pdf"))]
+    docs = [doc for file_docs in ingest_pipeline.load_files(files, args.workers).values() for doc in file_docs]
+    lexical_index.LEXICAL_INDEX_DIR = local_index.LOCAL_INDEX_DIR = tempfile.mkdtemp(prefix="retrieval_eval_")
+    collections = []
+    for size, overlap in parse_chunking(args.chunking):
+        chunks = list({ingest_pipeline.point_id(c): c for c in ingest_pipeline.chunk_documents(docs, size, overlap)}.values())
+        collection = f"eval_{size}_{overlap}"
+        client = QdrantClient(":memory:")
+        if args.embedder == "hashing":
+            doc_embedder = query_embedder = HashingEmbeddings()
+        else:
+            doc_embedder = with_embedding_cache(OllamaBatchEmbedder(args.embed_model), args.embed_model)
+            query_embedder = with_embedding_cache(OllamaEmbeddings(model=args.embed_model), args.embed_model)
+        ingest_pipeline.embed_and_store(chunks, client, doc_embedder, collection=collection)
+        stored = ShardRouter(client, collection).collections()
+        lexical_index.build_from_qdrant(client, stored).save(lexical_index.index_path(collection))
+        if "local" in args.retrieval_backends:
+            local_index.build_from_qdrant(client, stored).save(*local_index.index_paths(collection))
+        vectorstore = Qdrant(collection_name=collection, client=client, embeddings=query_embedder)
+        # retrieve_chunks pide los clientes por (url, colección, EMBED_MODEL)
+        register_retrieval_clients(":memory:", collection, EMBED_MODEL, RetrievalClients(query_embedder, client, vectorstore))
+        settings = {"qdrant_url": ":memory:", "qdrant_collection": collection}
+        documents = [(ingest_pipeline.point_id(c), c.page_content, c.metadata.get("subject_id")) for c in chunks]
+        collections.append((f"{size}:{overlap}", settings, documents))
+    return collections
+
+
+def qdrant_collection(args):
+    client = QdrantClient(url=args.qdrant_url)
+    stored = ShardRouter(client, args.collection).collections()
+    index = lexical_index.build_from_qdrant(client, stored)
+    if "local" in args.retrieval_backends:
+        local_index.LOCAL_INDEX_DIR = tempfile.mkdtemp(prefix="retrieval_eval_")
+        local_index.build_from_qdrant(client, stored).save(*local_index.index_paths(args.collection))
+    settings = {"qdrant_url": args.qdrant_url, "qdrant_collection": args.collection}
+    return [("collection", settings, list(zip(index.ids, index.texts, index.subjects)))]
+
+
+def evaluate(agent, label, settings, documents, questions, args):
+    all_subjects = sorted({s for _, _, s in documents if s is not None})
+    prepared, embed_ms = [], []
+    for item in questions:
+        subject_ids = [item["subject_id"]]
+        relevant = relevant_ids(documents, subject_ids, item["relevant"])
+        if not relevant:
+            print(f"[WARN] [{label}] Sin chunks relevantes para: {item['query']}")
+            continue
+        start = time.perf_counter()
+        vector = agent.embed_question(item["query"], settings)
+        embed_ms.append((time.perf_counter() - start) * 1000)
+        prepared.append((item, relevant, vector))
+
+    rows = []
+    for k in args.k:
+        for filter_mode in args.filters:
+            def search(entry):
+                item, _, vector = entry
+                subject_ids = [item["subject_id"]] if filter_mode == "subject" else all_subjects
+                start = time.perf_counter()
+                docs = agent.retrieve_chunks(item["query"], subject_ids, settings, query_vector=vector, k=k)
+                return docs, (time.perf_counter() - start) * 1000
+
+            workload = [entry for entry in prepared for _ in range(args.repeat)]
+            wall = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                outcomes = list(pool.map(search, workload))
+            wall = time.perf_counter() - wall
+
+            latencies = [ms for _, ms in outcomes]
+            recalls, rrs = [], []
+            # Una puntuación por pregunta (la primera repetición)
+            for entry, (docs, _) in zip(workload[::args.repeat], outcomes[::args.repeat]):
+                recall, rr = score_ranking(docs, entry[1], k)
+                recalls.append(recall)
+                rrs.append(rr)
+            # La misma búsqueda sin la lista léxica, una vez por pregunta
+            dense_recalls, dense_rrs, dense_empty = [], [], 0
+            for entry in prepared:
+                item, relevant, vector = entry
+                subject_ids = [item["subject_id"]] if filter_mode == "subject" else all_subjects
+                docs = agent.retrieve_chunks(item["query"], subject_ids, settings, query_vector=vector, k=k,
+                                             lexical_weight=0.0)
+                dense_empty += not docs
+                recall, rr = score_ranking(docs, relevant, k)
+                dense_recalls.append(recall)
+                dense_rrs.append(rr)
+            rows.append({
+                "retrieval_backend": settings.get("retrieval_backend", "qdrant"),
+                "chunking": label,
+                "chunks": len(documents),
+                "k": k,
+                "filter": filter_mode,
+                "queries": len(prepared),
+                "skipped": len(questions) - len(prepared),
+                "recall": round(statistics.fmean(recalls), 4) if recalls else 0.0,
+                "mrr": round(statistics.fmean(rrs), 4) if rrs else 0.0,
+                "dense_recall": round(statistics.fmean(dense_recalls), 4) if dense_recalls else 0.0,
+                "dense_mrr": round(statistics.fmean(dense_rrs), 4) if dense_rrs else 0.0,
+                "dense_empty": dense_empty,
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p95_ms": round(percentile(latencies, 95), 3),
+                "p99_ms": round(percentile(latencies, 99), 3),
+                "qps": round(len(workload) / wall, 1) if wall > 0 else 0.0,
+            })
+    return rows, embed_ms
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, max_recall_drop, max_latency_increase):
+    """Imprime las diferencias con la corrida base; devuelve la lista de regresiones."""
+    def row_key(r):
+        return r.get("retrieval_backend", "qdrant"), r["chunking"], r["k"], r["filter"]
+
+    previous = {row_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    print(f"\nComparación con {baseline.get('created_at')} ({baseline.get('git_commit')}):")
+    for row in report["results"]:
+        key = row_key(row)
+        old = previous.get(key)
+        if old is None:
+            continue
+        d_recall, d_mrr = row["recall"] - old["recall"], row["mrr"] - old["mrr"]
+        p95_ratio = row["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+        print(f"  {key[0]:<7} {key[1]:<11} k={key[2]:<3} {key[3]:<8} recall {d_recall:+.3f}  MRR {d_mrr:+.3f}  p95 {p95_ratio:+.0%}")
+        if d_recall < -max_recall_drop or d_mrr < -max_recall_drop:
+            regressions.append(f"{key}: recall {d_recall:+.3f}, MRR {d_mrr:+.3f}")
+        if "dense_recall" in old and row["dense_recall"] - old["dense_recall"] < -max_recall_drop:
+            regressions.append(f"{key}: recall densa {old['dense_recall']} -> {row['dense_recall']}")
+        if p95_ratio > max_latency_increase:
+            regressions.append(f"{key}: p95 {old['p95_ms']} -> {row['p95_ms']} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k, MRR, latencia y QPS de la recuperación del tutor.")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS, help="JSON con preguntas, subject_id y marcadores de relevancia.")
+    parser.add_argument("--backend", choices=("memory", "qdrant"), default="memory")
+    parser.add_argument("--qdrant-url", default=os.getenv("QDRANT_URL", "http://localhost:6333"))
+    parser.add_argument("--collection", default=os.getenv("QDRANT_COLLECTION", "tutor_demo"))
+    parser.add_argument("--embedder", choices=("ollama", "hashing"), default="ollama", help="Embeddings del backend memory.")
+    parser.add_argument("--embed-model", default=EMBED_MODEL)
+    parser.add_argument("--chunking", default=f"{ingest_pipeline.CHUNK_SIZE}:{ingest_pipeline.CHUNK_OVERLAP}",
+                        help='Configuraciones "tamaño:solape" separadas por coma (backend memory).')
+    parser.add_argument("--text-only", action="store_true", help="Omite los PDF (backend memory).")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos para cargar los documentos (backend memory).")
+    parser.add_argument("--k", type=lambda v: [int(x) for x in v.split(",")], default=[1, 3, 5, 10])
+    parser.add_argument("--filters", type=lambda v: v.split(","), default=["subject", "all"])
+    parser.add_argument("--retrieval-backends", type=lambda v: v.split(","), default=["qdrant"],
+                        help="Búsqueda densa a medir: qdrant, local (local_index.py) o ambas separadas por coma.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por pregunta para medir latencia.")
+    parser.add_argument("--concurrency", type=int, default=1, help="Búsquedas simultáneas al medir QPS.")
+    parser.add_argument("--with-cache", action="store_true",
+                        help="Mide con retrieval_cache.py activa (por defecto se desactiva: las repeticiones serían aciertos).")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto benchmarks/results/retrieval_<fecha>.json).")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para detectar regresiones.")
+    parser.add_argument("--max-recall-drop", type=float, default=0.02)
+    parser.add_argument("--max-latency-increase", type=float, default=0.25)
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    agents_rag.RETRIEVAL_CACHE_ENABLED = agents_rag.RETRIEVAL_CACHE_ENABLED and args.with_cache
+    collections = build_memory_collections(args) if args.backend == "memory" else qdrant_collection(args)
+    agent = TutorAgent(
+        name="TutorRAG",
+        role="Agente tutor inteligente",
+        goal="Responder preguntas del estudiante usando RAG y personalización.",
+        backstory="Orquesta la recuperación de información y la generación de respuestas educativas personalizadas."
+    )
+
+    created_at = datetime.now(timezone.utc)
+    report = {
+        "created_at": created_at.isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "backend": args.backend,
+        "embedder": args.embedder if args.backend == "memory" else "ollama",
+        "embed_model": args.embed_model,
+        "hybrid": HYBRID_ENABLED,
+        "retrieval_cache": agents_rag.RETRIEVAL_CACHE_ENABLED,
+        "questions": len(questions),
+        "repeat": args.repeat,
+        "concurrency": args.concurrency,
+        "results": [],
+    }
+    embed_ms = []
+    for label, settings, documents in collections:
+        for backend in args.retrieval_backends:
+            rows, embed = evaluate(agent, label, dict(settings, retrieval_backend=backend), documents, questions, args)
+            report["results"].extend(rows)
+            embed_ms.extend(embed)
+    report["embed_p50_ms"] = round(percentile(embed_ms, 50), 3)
+
+    print(f"{'backend':<7} {'chunking':<11} {'k':>3} {'filtro':<8} {'recall':>7} {'MRR':>7} {'densa':>7} {'MRR d.':>7} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'QPS':>8}")
+    for r in report["results"]:
+        print(f"{r['retrieval_backend']:<7} {r['chunking']:<11} {r['k']:>3} {r['filter']:<8} {r['recall']:>7} {r['mrr']:>7} "
+              f"{r['dense_recall']:>7} {r['dense_mrr']:>7} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['qps']:>8}")
+    print(f"Embedding de la pregunta p50: {report['embed_p50_ms']} ms")
+    # Una búsqueda densa sin resultados es un fallo de la recuperación, no ruido
+    empty = [r for r in report["results"] if r["dense_empty"]]
+    for r in empty:
+        print(f"[ERROR] Búsqueda densa sin resultados en {r['dense_empty']}/{r['queries']} preguntas: "
+              f"{r['retrieval_backend']} {r['chunking']} k={r['k']} {r['filter']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval_{created_at:%Y%m%dT%H%M%SZ}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_recall_drop, args.max_latency_increase)
+        if regressions:
+            print("\nRegresiones:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("Sin regresiones.")
+    if empty:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# benchmarks/retrieval_metrics.py
+"""
+Métricas compartidas por los benchmarks de recuperación.
+
+Un chunk es relevante para una consulta si contiene todos sus marcadores
+(comparados sin acentos, mayúsculas ni stopwords; "a|b" acepta cualquiera
+de las alternativas). El conjunto relevante se calcula sobre todos los chunks
+de la colección, de modo que recall@k es exacto.
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexical_index import tokenize  # noqa: E402
+
+DEFAULT_QUESTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions.json")
+
+
+def load_questions(path=DEFAULT_QUESTIONS):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _normalize(text):
+    return " ".join(tokenize(text)) if text else ""
+
+
+def is_relevant(text, markers):
+    normalized = _normalize(text)
+    return all(any(_normalize(alt) in normalized for alt in marker.split("|")) for marker in markers)
+
+
+def relevant_ids(documents, subject_ids, markers):
+    """documents: [(point_id, texto, subject_id)] -> ids relevantes de las materias indicadas."""
+    return {
+        str(point_id) for point_id, text, subject_id in documents
+        if subject_id in subject_ids and is_relevant(text, markers)
+    }
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def score_ranking(docs, relevant, k):
+    """(recall@k, reciprocal rank) de una lista de Documents con metadata['_id']."""
+    ids = [str(doc.metadata.get("_id")) for doc in docs[:k]]
+    found = sum(1 for i in ids if i in relevant)
+    recall = found / min(k, len(relevant)) if relevant else 0.0
+    rr = next((1.0 / rank for rank, i in enumerate(ids, 1) if i in relevant), 0.0)
+    return recall, rr
@@ -0,0 +1,173 @@
+# benchmarks/subject_scaling.py
+"""
+Latencia de la búsqueda filtrada por materia a medida que crece el número de
+materias, según la disposición de la colección (subject_sharding.py):
+
+- no-index: una colección sin índice de payload (HNSW filtrado sobre todo);
+- payload-index: una colección con índice entero sobre subject_id;
+- collections: una colección por materia;
+- shard_keys: una colección con un shard key por materia.
+
+Para cada valor de --subjects se generan --points-per-subject vectores
+sintéticos por materia (agrupados alrededor de un centro por materia, como
+los embeddings de un mismo temario) y se lanzan --queries búsquedas con
+filtro de --subjects-per-query materias. Se reporta p50/p95 y recall@k
+frente a la búsqueda exacta. Las disposiciones particionadas usan el mismo
+enrutamiento que el tutor (ShardedVectorStore). Qdrant usa HNSW solo en
+segmentos que superan su indexing_threshold: con pocas materias o pocos
+puntos por materia, las colecciones por materia se recorren por fuerza
+bruta, que es justamente lo que se quiere medir.
+
+Requiere Qdrant (el modo local de qdrant-client busca siempre por fuerza
+bruta). Ejemplo:
+
+    python benchmarks/subject_scaling.py --subjects 2,8,32 --points-per-subject 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qdrant_client import QdrantClient  # noqa: E402
+from qdrant_client.models import PointStruct  # noqa: E402
+
+from collection_config import CollectionConfig, search_params  # noqa: E402
+from retrieval_metrics import percentile  # noqa: E402
+from subject_sharding import ShardRouter, subject_filter  # noqa: E402
+
+LAYOUTS = {
+    "no-index": ("none", "none"),
+    "payload-index": ("none", "integer"),
+    "collections": ("collections", "none"),
+    "shard_keys": ("shard_keys", "integer"),
+}
+
+
+def synthetic_points(subjects, per_subject, dim, rng):
+    points = []
+    for subject_id in range(1, subjects + 1):
+        center = rng.normal(size=dim)
+        vectors = center + rng.normal(scale=1.5, size=(per_subject, dim))
+        for vector in vectors.astype(np.float32):
+            points.append(PointStruct(id=str(uuid.uuid4()), vector=vector.tolist(),
+                                      payload={"subject_id": subject_id, "page_content": "", "metadata": {}}))
+    return points
+
+
+def wait_green(client, collection, timeout=600):
+    """Espera a que Qdrant termine de optimizar; las colecciones pequeñas no llegan a tener HNSW."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get_collection(collection).status
+        if str(getattr(status, "value", status)) == "green":
+            return
+        time.sleep(1)
+    print(f"[WARN] {collection} sigue optimizando tras {timeout}s.")
+
+
+def build_layout(client, name, layout, points, dim):
+    mode, subject_index = LAYOUTS[layout]
+    router = ShardRouter(client, name, mode, CollectionConfig(subject_index=subject_index))
+    router.drop()
+    for start in range(0, len(points), 256):
+        router.upsert(points[start:start + 256], dim)
+    for collection in router.collections():
+        wait_green(client, collection)
+    return router
+
+
+def search_layout(client, router, vector, subject_ids, k, params):
+    if router.mode == "none":
+        points = client.query_points(collection_name=router.collection, query=vector,
+                                     query_filter=subject_filter(subject_ids), limit=k, search_params=params).points
+        return [str(p.id) for p in points]
+    docs = router.vectorstore(None).similarity_search_by_vector(vector, k=k, filter=subject_filter(subject_ids),
+                                                                search_params=params)
+    return [doc.metadata["_id"] for doc in docs]
+
+
+def run(args):
+    client = QdrantClient(url=args.qdrant_url, timeout=120)
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+    params = search_params()
+    exact = search_params(exact=True)
+    report = {"points_per_subject": args.points_per_subject, "dim": args.dim, "k": args.k,
+              "subjects_per_query": args.subjects_per_query, "results": []}
+    for subjects in args.subjects:
+        points = synthetic_points(subjects, args.points_per_subject, args.dim, rng)
+        queries = []
+        for _ in range(args.queries):
+            subject_ids = random.sample(range(1, subjects + 1), min(args.subjects_per_query, subjects))
+            queries.append((rng.normal(size=args.dim).astype(np.float32).tolist(), subject_ids))
+        truth = None
+        for layout in args.layouts:
+            name = f"bench_scale_{layout.replace('-', '_')}"
+            try:
+                router = build_layout(client, name, layout, points, args.dim)
+            except Exception as e:
+                print(f"[WARN] {layout} no disponible en este Qdrant: {e}")
+                continue
+            if truth is None:
+                truth = [search_layout(client, router, v, s, args.k, exact) for v, s in queries]
+            ms, recalls = [], []
+            for (vector, subject_ids), expected in zip(queries, truth):
+                found = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    found = search_layout(client, router, vector, subject_ids, args.k, params)
+                    ms.append((time.perf_counter() - start) * 1000)
+                if expected:
+                    recalls.append(len(set(found) & set(expected)) / len(expected))
+            report["results"].append({
+                "subjects": subjects, "layout": layout, "points": len(points),
+                f"recall@{args.k}": round(statistics.fmean(recalls), 4) if recalls else 0.0,
+                "p50_ms": round(percentile(ms, 50), 2), "p95_ms": round(percentile(ms, 95), 2),
+            })
+            if not args.keep:
+                router.drop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de la búsqueda filtrada por materia según el número de materias.")
+    parser.add_argument("--qdrant-url", default=os.getenv("QDRANT_URL", "http://localhost:6333"))
+    parser.add_argument("--subjects", type=lambda v: [int(x) for x in v.split(",")], default=[2, 8, 32])
+    parser.add_argument("--points-per-subject", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--layouts", type=lambda v: v.split(","), default=list(LAYOUTS),
+                        help=f"Disposiciones separadas por coma: {', '.join(LAYOUTS)}.")
+    parser.add_argument("--subjects-per-query", type=int, default=1, help="Materias en el filtro de cada búsqueda.")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por búsqueda para medir latencia.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="No borra las colecciones bench_scale_* al terminar.")
+    parser.add_argument("--json", action="store_true", help="Imprime el resultado como JSON.")
+    args = parser.parse_args()
+    unknown = [layout for layout in args.layouts if layout not in LAYOUTS]
+    if unknown:
+        parser.error(f"disposiciones desconocidas: {', '.join(unknown)}")
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    recall = f"recall@{args.k}"
+    print(f"{args.points_per_subject} puntos por materia (dim {args.dim}), {args.subjects_per_query} materia(s) por búsqueda")
+    print(f"{'materias':>8} {'puntos':>8} {'disposición':<14} {recall:>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for r in report["results"]:
+        print(f"{r['subjects']:>8} {r['points']:>8} {r['layout']:<14} {r[recall]:>10} {r['p50_ms']:>8} {r['p95_ms']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# collection_config.py
+"""
+Aprovisionamiento de la colección de Qdrant y parámetros de búsqueda.
+
+Con todo el material de planes_estudio la colección crece y los vectores
+float32 con HNSW por defecto consumen memoria y latencia. Al crear la
+colección (ingest_pipeline.py) se aplican:
+
+- QDRANT_QUANTIZATION: none | scalar (int8, 4x menos memoria) | product
+  (QDRANT_PQ_COMPRESSION, x4..x64); los vectores cuantizados quedan en RAM
+  si QDRANT_QUANTIZATION_ALWAYS_RAM=1.
+- QDRANT_ON_DISK=1: vectores originales en disco (mmap); con cuantización en
+  RAM solo se leen para el rescoring.
+- QDRANT_HNSW_M y QDRANT_HNSW_EF_CONSTRUCT: grafo HNSW.
+- QDRANT_SUBJECT_INDEX: índice de payload sobre subject_id, que usan todos
+  los filtros del tutor ("integer", solo coincidencia exacta; "none" para
+  no crearlo y comparar). Sin él, Qdrant recorre el HNSW de toda la
+  colección descartando puntos de otras materias.
+
+En la búsqueda: QDRANT_SEARCH_EF (hnsw_ef; 0 = el de Qdrant),
+QDRANT_RESCORE (recalcular con los vectores originales los candidatos de la
+búsqueda cuantizada) y QDRANT_OVERSAMPLING (candidatos extra para el
+rescoring).
+"""
+
+import os
+from typing import NamedTuple, Optional
+
+from qdrant_client.models import (
+    CompressionRatio,
+    Disabled,
+    Distance,
+    HnswConfigDiff,
+    IntegerIndexParams,
+    IntegerIndexType,
+    ProductQuantization,
+    ProductQuantizationConfig,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    ShardingMethod,
+    VectorParams,
+    VectorParamsDiff,
+)
+
+from app_logging import get_logger
+
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none")
+QDRANT_PQ_COMPRESSION = os.getenv("QDRANT_PQ_COMPRESSION", "x16")
+QDRANT_QUANTIZATION_ALWAYS_RAM = os.getenv("QDRANT_QUANTIZATION_ALWAYS_RAM", "1") == "1"
+QDRANT_ON_DISK = os.getenv("QDRANT_ON_DISK", "0") == "1"
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100"))
+QDRANT_SEARCH_EF = int(os.getenv("QDRANT_SEARCH_EF", "0"))
+QDRANT_RESCORE = os.getenv("QDRANT_RESCORE", "1") == "1"
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "1.0"))
+QDRANT_SUBJECT_INDEX = os.getenv("QDRANT_SUBJECT_INDEX", "integer")
+
+SUBJECT_FIELD = "subject_id"
+
+logger = get_logger(__name__)
+
+
+class CollectionConfig(NamedTuple):
+    quantization: str = QDRANT_QUANTIZATION
+    pq_compression: str = QDRANT_PQ_COMPRESSION
+    always_ram: bool = QDRANT_QUANTIZATION_ALWAYS_RAM
+    on_disk: bool = QDRANT_ON_DISK
+    hnsw_m: int = QDRANT_HNSW_M
+    hnsw_ef_construct: int = QDRANT_HNSW_EF_CONSTRUCT
+    subject_index: str = QDRANT_SUBJECT_INDEX
+
+
+def quantization_config(config: CollectionConfig):
+    """Configuración de cuantización de Qdrant, o None sin cuantizar."""
+    if config.quantization == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99,
+                                                                  always_ram=config.always_ram))
+    if config.quantization == "product":
+        return ProductQuantization(product=ProductQuantizationConfig(compression=CompressionRatio(config.pq_compression),
+                                                                     always_ram=config.always_ram))
+    if config.quantization not in ("none", ""):
+        raise ValueError(f"QDRANT_QUANTIZATION desconocida: {config.quantization!r} (none, scalar o product)")
+    return None
+
+
+def hnsw_config(config: CollectionConfig) -> HnswConfigDiff:
+    return HnswConfigDiff(m=config.hnsw_m, ef_construct=config.hnsw_ef_construct)
+
+
+def ensure_subject_index(client, collection: str, kind: str = QDRANT_SUBJECT_INDEX) -> None:
+    """Índice de payload sobre subject_id (idempotente)."""
+    if kind == "none":
+        return
+    if kind != "integer":
+        raise ValueError(f"QDRANT_SUBJECT_INDEX desconocido: {kind!r} (integer o none)")
+    schema = client.get_collection(collection).payload_schema or {}
+    if SUBJECT_FIELD not in schema:
+        # Los filtros solo usan match value/any: sin índice de rangos
+        client.create_payload_index(collection_name=collection, field_name=SUBJECT_FIELD,
+                                    field_schema=IntegerIndexParams(type=IntegerIndexType.INTEGER, lookup=True, range=False))
+        logger.info("Índice de payload creado", extra={'fields': {'collection': collection, 'field': SUBJECT_FIELD}})
+
+
+def provision_collection(client, collection: str, vector_size: int, config: Optional[CollectionConfig] = None,
+                         reconfigure: bool = False, custom_sharding: bool = False) -> bool:
+    """
+    Crea la colección (distancia coseno, como langchain) con la configuración
+    indicada si no existe; si existe y reconfigure=True le aplica la
+    configuración de vectores, HNSW y cuantización (Qdrant reconstruye los
+    índices en segundo plano). En ambos casos asegura el índice de subject_id.
+    Con custom_sharding la colección se crea con shard keys (ver
+    subject_sharding.py). Devuelve True si la colección se creó.
+    """
+    config = config or CollectionConfig()
+    created = False
+    if not client.collection_exists(collection):
+        client.create_collection(
+            collection_name=collection,
+            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE, on_disk=config.on_disk),
+            hnsw_config=hnsw_config(config),
+            quantization_config=quantization_config(config),
+            sharding_method=ShardingMethod.CUSTOM if custom_sharding else None,
+        )
+        created = True
+    elif reconfigure:
+        client.update_collection(
+            collection_name=collection,
+            vectors_config={"": VectorParamsDiff(on_disk=config.on_disk)},
+            hnsw_config=hnsw_config(config),
+            quantization_config=quantization_config(config) or Disabled.DISABLED,
+        )
+    ensure_subject_index(client, collection, config.subject_index)
+    return created
+
+
+def search_params(ef: int = QDRANT_SEARCH_EF, rescore: bool = QDRANT_RESCORE,
+                  oversampling: float = QDRANT_OVERSAMPLING, exact: bool = False) -> Optional[SearchParams]:
+    """
+    Parámetros de búsqueda de Qdrant; None si todos son los de por defecto.
+    Las opciones de cuantización se ignoran en colecciones sin cuantizar.
+    """
+    if not ef and rescore and oversampling == 1.0 and not exact:
+        return None
+    return SearchParams(
+        hnsw_ef=ef or None,
+        exact=exact,
+        quantization=QuantizationSearchParams(rescore=rescore, oversampling=oversampling),
+    )
@@ -0,0 +1,222 @@
+# conversation_memory.py
+"""
+Memoria de conversación del lado del servidor con resumen incremental.
+
+Las conversaciones se guardan en PostgreSQL (conversation_store.py) y este
+módulo es su frente LRU en proceso: cada conversación (de un usuario y una
+materia) se carga de la base al primer uso, y las escrituras van primero a
+la base (turnos solo-inserción) y luego a memoria. Así la API recibe solo el
+id de la conversación y se puede retomar desde otro dispositivo o proceso.
+
+El prompt lleva solo el resumen y los últimos MEMORY_RECENT_TURNS turnos
+literales, en lugar de reenviar todo el historial en cada petición.
+
+Cuando quedan turnos fuera de la ventana literal que el resumen aún no cubre,
+se agenda su incorporación en un pool de fondo: la petición actual no espera
+al LLM que resume. Mientras se resume, esos turnos siguen disponibles como
+pendientes y se incluyen en el prompt. Si el resumen falla, se reintenta con
+el turno siguiente. El resumen y el último turno que cubre se persisten.
+
+Las conversaciones salen de memoria tras MEMORY_TTL segundos sin uso o por
+LRU al superar MEMORY_MAX_CONVERSATIONS (siguen en la base). La retención en
+la base (conversation_store.purge) se aplica en segundo plano como mucho cada
+CONVERSATION_PURGE_INTERVAL segundos.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional
+
+import conversation_store
+from app_logging import get_logger
+
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "1"))
+MEMORY_MAX_CONVERSATIONS = int(os.getenv("MEMORY_MAX_CONVERSATIONS", "10000"))
+MEMORY_TTL = float(os.getenv("MEMORY_TTL", str(6 * 3600)))
+MEMORY_SUMMARY_WORKERS = int(os.getenv("MEMORY_SUMMARY_WORKERS", "2"))
+CONVERSATION_PURGE_INTERVAL = float(os.getenv("CONVERSATION_PURGE_INTERVAL", "3600"))
+
+logger = get_logger(__name__)
+
+# summarize(resumen_previo, turnos_nuevos) -> resumen actualizado
+Summarizer = Callable[[str, List[dict]], str]
+
+
+class MemoryContext(NamedTuple):
+    summary: str
+    # Turnos que el prompt debe llevar literales: pendientes de resumir + recientes
+    turns: List[dict]
+
+
+class _Conversation:
+    __slots__ = ("id", "user_id", "subject_id", "turns", "summary", "refreshing", "last_used", "lock")
+
+    def __init__(self, stored: conversation_store.StoredConversation):
+        self.id = stored.id
+        self.user_id = stored.user_id
+        self.subject_id = stored.subject_id
+        # Solo los turnos que el resumen todavía no cubre ({'id', 'user', 'tutor'})
+        self.turns: List[dict] = list(stored.pending_turns)
+        self.summary = stored.summary
+        self.refreshing = False
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class ConversationMemory:
+    def __init__(self, recent_turns: int = MEMORY_RECENT_TURNS, max_conversations: int = MEMORY_MAX_CONVERSATIONS,
+                 ttl: float = MEMORY_TTL, workers: int = MEMORY_SUMMARY_WORKERS, store=conversation_store,
+                 purge_interval: float = CONVERSATION_PURGE_INTERVAL):
+        self.recent_turns = recent_turns
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.store = store
+        self.purge_interval = purge_interval
+        self._conversations: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="conversation-summary")
+        self._last_purge = time.monotonic()
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.loads = 0
+
+    def _get(self, conversation_id: str) -> Optional[_Conversation]:
+        now = time.monotonic()
+        with self._lock:
+            conv = self._conversations.get(conversation_id)
+            if conv is not None and now - conv.last_used > self.ttl:
+                del self._conversations[conversation_id]
+                conv = None
+            if conv is not None:
+                self._conversations.move_to_end(conversation_id)
+                conv.last_used = now
+                return conv
+        # Fallo del LRU: se carga de la base fuera del lock global
+        stored = self.store.load_conversation(conversation_id)
+        if stored is None:
+            return None
+        with self._lock:
+            self.loads += 1
+            # Otro hilo pudo cargarla mientras tanto: gana la que ya está
+            conv = self._conversations.get(conversation_id)
+            if conv is None:
+                conv = self._conversations[conversation_id] = _Conversation(stored)
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+            self._conversations.move_to_end(conversation_id)
+            conv.last_used = now
+            return conv
+
+    def resolve(self, user_id: int, subject_id: Optional[int], conversation_id: Optional[str] = None,
+                new: bool = False) -> Optional[str]:
+        """
+        Id de la conversación a usar. Con `conversation_id` verifica que sea del
+        usuario y la materia (None si no); sin él retoma la más reciente del
+        usuario en la materia o, con `new` o si no hay ninguna, crea una.
+        """
+        if conversation_id:
+            conv = self._get(str(conversation_id))
+            if conv is None or conv.user_id != user_id or conv.subject_id != subject_id:
+                return None
+            return conv.id
+        if not new:
+            latest = self.store.latest_conversation(user_id, subject_id)
+            if latest is not None:
+                # Queda cargada en el LRU para el prompt que sigue
+                self._get(latest)
+                return latest
+        return self.store.create_conversation(user_id, subject_id)
+
+    def context(self, conversation_id: str) -> MemoryContext:
+        """Resumen y turnos literales que debe llevar el próximo prompt."""
+        conv = self._get(conversation_id)
+        if conv is None:
+            return MemoryContext("", [])
+        with conv.lock:
+            return MemoryContext(conv.summary, list(conv.turns))
+
+    def transcript(self, conversation_id: str, limit: int = 50) -> List[dict]:
+        """Últimos turnos completos de la conversación (para mostrarla al retomarla)."""
+        return self.store.list_turns(conversation_id, limit)
+
+    def append(self, conversation_id: str, user: str, tutor: str, summarize: Optional[Summarizer] = None) -> None:
+        """Persiste un turno y, si corresponde, agenda la actualización del resumen en segundo plano."""
+        turn_id = self.store.append_turn(conversation_id, user, tutor)
+        conv = self._get(conversation_id)
+        if conv is not None:
+            with conv.lock:
+                # La carga desde la base pudo traer ya este turno
+                if not conv.turns or conv.turns[-1]['id'] < turn_id:
+                    conv.turns.append({'id': turn_id, 'user': user, 'tutor': tutor})
+            if summarize is not None:
+                self._schedule(conv, summarize)
+        self._maybe_purge()
+
+    def _schedule(self, conv: _Conversation, summarize: Summarizer) -> None:
+        with conv.lock:
+            if conv.refreshing or len(conv.turns) <= self.recent_turns:
+                return
+            conv.refreshing = True
+        self._executor.submit(self._refresh, conv, summarize)
+
+    def _refresh(self, conv: _Conversation, summarize: Summarizer) -> None:
+        with conv.lock:
+            previous = conv.summary
+            pending = conv.turns[:len(conv.turns) - self.recent_turns]
+        try:
+            summary = summarize(previous, pending)
+            if not summary:
+                raise ValueError("resumen vacío")
+            self.store.save_summary(conv.id, summary, pending[-1]['id'])
+        except Exception as e:
+            logger.warning("No se pudo resumir la conversación: %s", e, extra={'fields': {'turns': len(pending)}})
+            with self._lock:
+                self.refresh_failures += 1
+            with conv.lock:
+                conv.refreshing = False
+            return
+        with conv.lock:
+            conv.summary = summary
+            # Los turnos resumidos dejan de ir literales (los nuevos se agregaron al final)
+            del conv.turns[:len(pending)]
+            conv.refreshing = False
+        with self._lock:
+            self.refreshes += 1
+        # Llegaron más turnos mientras se resumía
+        self._schedule(conv, summarize)
+
+    def _maybe_purge(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_purge < self.purge_interval:
+                return
+            self._last_purge = now
+        self._executor.submit(self._purge)
+
+    def _purge(self) -> None:
+        try:
+            deleted = self.store.purge()
+        except Exception as e:
+            logger.warning("No se pudo aplicar la retención de conversaciones: %s", e)
+            return
+        if deleted:
+            logger.info("Retención de conversaciones aplicada", extra={'fields': {'deleted_rows': deleted}})
+
+    def forget(self, conversation_id: str) -> None:
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'conversations': len(self._conversations),
+                'loads': self.loads,
+                'refreshes': self.refreshes,
+                'refresh_failures': self.refresh_failures,
+            }
+
+
+conversation_memory = ConversationMemory()
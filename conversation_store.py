@@ -0,0 +1,162 @@
+# conversation_store.py
+"""
+Persistencia de conversaciones del tutor en PostgreSQL.
+
+Tablas (ver db_schema.py):
+- conversations: una fila por conversación (usuario, materia, resumen y
+  hasta qué turno cubre ese resumen).
+- conversation_turns: turnos en modo solo-inserción (id creciente).
+
+La retención es acotada: purge() borra las conversaciones sin actividad en
+CONVERSATION_RETENTION_DAYS días y deja como máximo CONVERSATION_MAX_TURNS
+turnos por conversación. conversation_memory.py es el frente LRU en proceso
+que usa el tutor; este módulo solo habla con la base de datos.
+"""
+
+import os
+import uuid
+from typing import List, NamedTuple, Optional
+
+from db import get_conn
+
+CONVERSATION_RETENTION_DAYS = int(os.getenv("CONVERSATION_RETENTION_DAYS", "30"))
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "200"))
+
+
+class StoredConversation(NamedTuple):
+    id: str
+    user_id: int
+    subject_id: Optional[int]
+    summary: str
+    summarized_turn_id: int
+    # Turnos que el resumen aún no cubre: [{'id', 'user', 'tutor'}, ...]
+    pending_turns: List[dict]
+
+
+def create_conversation(user_id: int, subject_id: Optional[int]) -> str:
+    conversation_id = str(uuid.uuid4())
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO conversations (id, user_id, subject_id) VALUES (%s, %s, %s)",
+                (conversation_id, user_id, subject_id),
+            )
+        conn.commit()
+    return conversation_id
+
+
+def latest_conversation(user_id: int, subject_id: Optional[int]) -> Optional[str]:
+    """Conversación más reciente del usuario en la materia (subject_id None = todas)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id FROM conversations
+                WHERE user_id = %s AND subject_id IS NOT DISTINCT FROM %s
+                ORDER BY updated_at DESC
+                LIMIT 1
+                """,
+                (user_id, subject_id),
+            )
+            row = cur.fetchone()
+    return str(row[0]) if row else None
+
+
+def load_conversation(conversation_id: str) -> Optional[StoredConversation]:
+    try:
+        uuid.UUID(str(conversation_id))
+    except ValueError:
+        return None
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT user_id, subject_id, summary, summarized_turn_id FROM conversations WHERE id = %s",
+                (conversation_id,),
+            )
+            row = cur.fetchone()
+            if not row:
+                return None
+            cur.execute(
+                """
+                SELECT id, user_message, tutor_message FROM conversation_turns
+                WHERE conversation_id = %s AND id > %s
+                ORDER BY id
+                """,
+                (conversation_id, row[3]),
+            )
+            turns = [{'id': t[0], 'user': t[1], 'tutor': t[2]} for t in cur.fetchall()]
+    return StoredConversation(str(conversation_id), row[0], row[1], row[2] or "", row[3], turns)
+
+
+def append_turn(conversation_id: str, user_message: str, tutor_message: str) -> int:
+    """Inserta un turno y devuelve su id."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO conversation_turns (conversation_id, user_message, tutor_message)
+                VALUES (%s, %s, %s)
+                RETURNING id
+                """,
+                (conversation_id, user_message, tutor_message),
+            )
+            turn_id = cur.fetchone()[0]
+            cur.execute("UPDATE conversations SET updated_at = NOW() WHERE id = %s", (conversation_id,))
+        conn.commit()
+    return turn_id
+
+
+def save_summary(conversation_id: str, summary: str, summarized_turn_id: int) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE conversations SET summary = %s, summarized_turn_id = %s
+                WHERE id = %s AND summarized_turn_id < %s
+                """,
+                (summary, summarized_turn_id, conversation_id, summarized_turn_id),
+            )
+        conn.commit()
+
+
+def list_turns(conversation_id: str, limit: int = 50) -> List[dict]:
+    """Últimos `limit` turnos en orden cronológico (para reanudar la conversación en la UI)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT user_message, tutor_message FROM (
+                    SELECT id, user_message, tutor_message FROM conversation_turns
+                    WHERE conversation_id = %s
+                    ORDER BY id DESC
+                    LIMIT %s
+                ) t ORDER BY id
+                """,
+                (conversation_id, limit),
+            )
+            return [{'user': row[0], 'tutor': row[1]} for row in cur.fetchall()]
+
+
+def purge(retention_days: int = CONVERSATION_RETENTION_DAYS, max_turns: int = CONVERSATION_MAX_TURNS) -> int:
+    """Aplica la retención; devuelve cuántas filas se borraron."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM conversations WHERE updated_at < NOW() - make_interval(days => %s)",
+                (retention_days,),
+            )
+            deleted = cur.rowcount
+            cur.execute(
+                """
+                DELETE FROM conversation_turns t
+                USING (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY conversation_id ORDER BY id DESC) AS rn
+                    FROM conversation_turns
+                ) r
+                WHERE t.id = r.id AND r.rn > %s
+                """,
+                (max_turns,),
+            )
+            deleted += cur.rowcount
+        conn.commit()
+    return deleted
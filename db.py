@@ -0,0 +1,202 @@
+# db.py
+"""
+Capa compartida de acceso a PostgreSQL.
+
+Todos los módulos (agentes, Flask, Streamlit, scripts de esquema/poblado)
+obtienen conexiones de un único pool thread-safe por proceso en lugar de
+abrir una conexión nueva por consulta.
+
+Configuración por variables de entorno:
+- PG_HOST, PG_PORT, PG_DB, PG_USER, PG_PASSWORD: credenciales
+- PG_POOL_MIN / PG_POOL_MAX: tamaño mínimo y máximo del pool
+- PG_POOL_TIMEOUT: segundos máximos de espera por una conexión libre
+- PG_POOL_HEALTHCHECK: 1 para validar con SELECT 1 cada conexión entregada
+"""
+
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+
+PG_HOST = os.getenv("PG_HOST", "localhost")
+PG_PORT = os.getenv("PG_PORT", "5432")
+PG_DB = os.getenv("PG_DB", "tutor_db")
+PG_USER = os.getenv("PG_USER", "tutor_user")
+PG_PASSWORD = os.getenv("PG_PASSWORD", "tutor_pass")
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "30"))
+PG_POOL_HEALTHCHECK = os.getenv("PG_POOL_HEALTHCHECK", "1") == "1"
+
+
+def connection_kwargs() -> dict:
+    """Parámetros de conexión (útil para conexiones dedicadas fuera del pool)."""
+    return {
+        'host': PG_HOST,
+        'port': PG_PORT,
+        'dbname': PG_DB,
+        'user': PG_USER,
+        'password': PG_PASSWORD,
+    }
+
+
+class PoolTimeout(Exception):
+    """No se obtuvo una conexión libre dentro de PG_POOL_TIMEOUT."""
+
+
+class ConnectionPool:
+    """
+    Envoltura de ThreadedConnectionPool que espera (en lugar de fallar)
+    cuando se alcanza el máximo, valida conexiones al entregarlas y
+    lleva estadísticas de uso.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, healthcheck: bool = True, **conn_kwargs):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **conn_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._stats_lock = threading.Lock()
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.healthcheck = healthcheck
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.discarded = 0
+        self.in_use = 0
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if not self.healthcheck:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout: float = PG_POOL_TIMEOUT):
+        if not self._slots.acquire(blocking=False):
+            start = time.perf_counter()
+            acquired = self._slots.acquire(timeout=timeout)
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.waits += 1
+                self.wait_time += waited
+            if not acquired:
+                raise PoolTimeout(f"Sin conexiones libres tras {timeout}s (max={self.maxconn})")
+        try:
+            conn = self._pool.getconn()
+            while not self._is_healthy(conn):
+                self._pool.putconn(conn, close=True)
+                with self._stats_lock:
+                    self.discarded += 1
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._stats_lock:
+            self.checkouts += 1
+            self.in_use += 1
+        return conn
+
+    def putconn(self, conn) -> None:
+        broken = bool(conn.closed)
+        if not broken and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        try:
+            self._pool.putconn(conn, close=broken)
+        finally:
+            with self._stats_lock:
+                self.in_use -= 1
+                if broken:
+                    self.discarded += 1
+            self._slots.release()
+
+    def closeall(self) -> None:
+        self._pool.closeall()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                'min': self.minconn,
+                'max': self.maxconn,
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time_ms': round(self.wait_time * 1000, 2),
+                'discarded': self.discarded,
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Pool del proceso actual; se crea perezosamente y se recrea tras un fork."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = ConnectionPool(
+                PG_POOL_MIN,
+                PG_POOL_MAX,
+                healthcheck=PG_POOL_HEALTHCHECK,
+                **connection_kwargs(),
+            )
+            _pool_pid = pid
+    return _pool
+
+
+@contextmanager
+def get_conn():
+    """
+    Presta una conexión del pool. Si el bloque lanza una excepción se hace
+    rollback; el commit queda a cargo del llamador.
+    """
+    p = get_pool()
+    conn = p.getconn()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        p.putconn(conn)
+
+
+def pool_stats() -> dict:
+    """Estadísticas del pool: checkouts, esperas y tiempo total de espera."""
+    if _pool is None or _pool_pid != os.getpid():
+        return {'min': PG_POOL_MIN, 'max': PG_POOL_MAX, 'in_use': 0, 'checkouts': 0,
+                'waits': 0, 'wait_time_ms': 0.0, 'discarded': 0}
+    return _pool.stats()
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+atexit.register(close_pool)
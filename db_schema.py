@@ -4,14 +4,7 @@ Definición de la estructura de la base de datos para estudiantes y materias.
 Utiliza PostgreSQL (en contenedor Docker) para robustez y escalabilidad.
 """
 
-import psycopg2
-import os
-
-PG_HOST = os.getenv("PG_HOST", "localhost")
-PG_PORT = os.getenv("PG_PORT", "5432")
-PG_DB = os.getenv("PG_DB", "tutor_db")
-PG_USER = os.getenv("PG_USER", "tutor_user")
-PG_PASSWORD = os.getenv("PG_PASSWORD", "tutor_pass")
+from db import get_conn
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS students (
@@ -50,9 +43,26 @@ CREATE TABLE IF NOT EXISTS app_settings (
     qdrant_url TEXT DEFAULT 'http://localhost:6333',
     qdrant_collection TEXT DEFAULT 'tutor_demo',
     logging_enabled BOOLEAN DEFAULT TRUE,
+    -- Incremented by ingest_pipeline.py on every write to the collection
+    collection_version INTEGER DEFAULT 0,
+    -- Dense search backend: 'qdrant' or 'local' (local_index.py on-disk matrix)
+    retrieval_backend TEXT DEFAULT 'qdrant',
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Notify workers (LISTEN app_settings_changed) whenever settings change
+CREATE OR REPLACE FUNCTION notify_app_settings_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('app_settings_changed', NEW.id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS app_settings_changed ON app_settings;
+CREATE TRIGGER app_settings_changed
+    AFTER INSERT OR UPDATE ON app_settings
+    FOR EACH ROW EXECUTE FUNCTION notify_app_settings_changed();
+
 -- Observability: metrics per chat call
 CREATE TABLE IF NOT EXISTS chat_metrics (
     id SERIAL PRIMARY KEY,
@@ -64,24 +74,68 @@ CREATE TABLE IF NOT EXISTS chat_metrics (
     completion_tokens INTEGER,
     total_tokens INTEGER,
     latency_ms INTEGER,
+    ttft_ms INTEGER,
+    cache_hit BOOLEAN DEFAULT FALSE,
+    embed_ms INTEGER,
+    retrieval_ms INTEGER,
+    subject_context_ms INTEGER,
+    prompt_ms INTEGER,
+    tokenize_ms INTEGER,
+    queue_ms INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Server-side chat conversations (conversation_store.py); subject_id NULL = all subjects
+CREATE TABLE IF NOT EXISTS conversations (
+    id UUID PRIMARY KEY,
+    user_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+    subject_id INTEGER REFERENCES subjects(id) ON DELETE CASCADE,
+    summary TEXT DEFAULT '',
+    -- Last turn already folded into summary
+    summarized_turn_id BIGINT DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS conversations_user_subject_idx
+    ON conversations (user_id, subject_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS conversations_updated_idx ON conversations (updated_at);
+
+-- Append-only turns
+CREATE TABLE IF NOT EXISTS conversation_turns (
+    id BIGSERIAL PRIMARY KEY,
+    conversation_id UUID NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    user_message TEXT NOT NULL,
+    tutor_message TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS conversation_turns_conversation_idx
+    ON conversation_turns (conversation_id, id);
 """
 
 def init_db():
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        port=PG_PORT,
-        dbname=PG_DB,
-        user=PG_USER,
-        password=PG_PASSWORD
-    )
+    with get_conn() as conn:
+        _apply_schema(conn)
+
+
+def _apply_schema(conn):
     cur = conn.cursor()
     cur.execute(SCHEMA)
     # --- Lightweight migrations for existing installations ---
     # Ensure new column exists even if table was created before
     cur.execute("ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS openai_base_url TEXT;")
     cur.execute("ALTER TABLE app_settings ALTER COLUMN openai_base_url SET DEFAULT 'https://api.openai.com';")
+    # Time-to-first-token for streamed responses
+    cur.execute("ALTER TABLE chat_metrics ADD COLUMN IF NOT EXISTS ttft_ms INTEGER;")
+    # Semantic answer cache: collection version token and per-call hit flag
+    cur.execute("ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS collection_version INTEGER DEFAULT 0;")
+    cur.execute("ALTER TABLE chat_metrics ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN DEFAULT FALSE;")
+    # Per-stage latency breakdown (tracing.py)
+    for column in ('embed_ms', 'retrieval_ms', 'subject_context_ms', 'prompt_ms', 'tokenize_ms'):
+        cur.execute(f"ALTER TABLE chat_metrics ADD COLUMN IF NOT EXISTS {column} INTEGER;")
+    # Wait for an LLM slot (llm_dispatch.py)
+    cur.execute("ALTER TABLE chat_metrics ADD COLUMN IF NOT EXISTS queue_ms INTEGER;")
+    # Selectable dense retrieval backend (local_index.py)
+    cur.execute("ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS retrieval_backend TEXT DEFAULT 'qdrant';")
     # Ensure single default row in app_settings
     cur.execute("SELECT COUNT(*) FROM app_settings;")
     count = cur.fetchone()[0]
@@ -98,8 +152,7 @@ def init_db():
         cur.execute("UPDATE app_settings SET openai_base_url = COALESCE(openai_base_url, 'https://api.openai.com') WHERE id=1;")
     conn.commit()
     cur.close()
-    conn.close()
 
 if __name__ == "__main__":
     init_db()
-    print("Base de datos PostgreSQL inicializada con las tablas: students, subjects, enrollments.")
+    print("Base de datos PostgreSQL inicializada con las tablas: students, subjects, enrollments, conversations.")
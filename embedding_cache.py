@@ -0,0 +1,238 @@
+# embedding_cache.py
+"""
+Caché persistente de embeddings en disco (SQLite).
+
+Cada vector se guarda como blob float32 con clave (modelo, sha256 del texto),
+de modo que reingestar o cambiar el chunking no vuelve a embeber textos ya
+vistos, y las preguntas repetidas del tutor no pagan una llamada a Ollama.
+La tabla se limita a EMBED_CACHE_MAX_ENTRIES filas desalojando las de uso
+más antiguo. La misma base la comparten ingest_pipeline.py y el tutor.
+
+Una ruta relativa en EMBED_CACHE_PATH se resuelve contra el directorio del
+proyecto, no contra el directorio de trabajo. La conexión se abre al primer
+uso y se reabre tras un fork. Los aciertos no escriben en cada consulta:
+las marcas de last_used se acumulan en memoria y se vuelcan en lote cada
+EMBED_CACHE_TOUCH_BATCH claves o EMBED_CACHE_TOUCH_INTERVAL segundos.
+"""
+
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Callable, List, Optional, Sequence
+
+from langchain_core.embeddings import Embeddings
+
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1") == "1"
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBED_CACHE_PATH = os.path.join(PROJECT_DIR, os.getenv("EMBED_CACHE_PATH", "embedding_cache.sqlite"))
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+# Volcado de last_used: cada tantas claves tocadas o cada tantos segundos
+EMBED_CACHE_TOUCH_BATCH = int(os.getenv("EMBED_CACHE_TOUCH_BATCH", "512"))
+EMBED_CACHE_TOUCH_INTERVAL = float(os.getenv("EMBED_CACHE_TOUCH_INTERVAL", "30"))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = EMBED_CACHE_PATH, max_entries: int = EMBED_CACHE_MAX_ENTRIES,
+                 touch_batch: int = EMBED_CACHE_TOUCH_BATCH, touch_interval: float = EMBED_CACHE_TOUCH_INTERVAL):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._size = 0
+        # (modelo, hash) con aciertos aún no volcados a last_used
+        self._touched = set()
+        self._last_flush = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.touch_flushes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """Conexión del proceso actual (con el lock tomado); se abre perezosamente y tras un fork."""
+        pid = os.getpid()
+        if self._conn is not None and self._pid == pid:
+            return self._conn
+        # La conexión y las marcas heredadas del padre no se usan en el hijo
+        self._touched = set()
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        conn.commit()
+        self._size = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._conn, self._pid = conn, pid
+        self._last_flush = time.monotonic()
+        return conn
+
+    def _flush_touches(self, conn: sqlite3.Connection) -> None:
+        """Vuelca las marcas de last_used pendientes (sin commit; con el lock tomado)."""
+        if self._touched:
+            now = time.time()
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(now, model, h) for model, h in self._touched],
+            )
+            self._touched = set()
+            self.touch_flushes += 1
+        self._last_flush = time.monotonic()
+
+    def flush(self) -> None:
+        """Escribe ya las marcas de last_used pendientes."""
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid() or not self._touched:
+                return
+            self._flush_touches(self._conn)
+            self._conn.commit()
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Vectores cacheados en el orden de `texts` (None donde no hay entrada)."""
+        hashes = [text_hash(t) for t in texts]
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                found.update(rows)
+            self._touched.update((model, h) for h in found)
+            if self._touched and (len(self._touched) >= self.touch_batch
+                                  or time.monotonic() - self._last_flush >= self.touch_interval):
+                self._flush_touches(conn)
+                conn.commit()
+            result = []
+            for h in hashes:
+                blob = found.get(h)
+                if blob is None:
+                    self.misses += 1
+                    result.append(None)
+                else:
+                    self.hits += 1
+                    result.append(array("f", blob).tolist())
+        return result
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        now = time.time()
+        rows = [
+            (model, text_hash(t), len(v), array("f", v).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            conn = self._connection()
+            # Las marcas pendientes viajan en el mismo commit que la escritura
+            self._flush_touches(conn)
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._size += conn.total_changes - before
+            if self._size > self.max_entries:
+                self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # Desaloja hasta el 90% del máximo para no repetir la limpieza en cada escritura
+        excess = self._size - int(self.max_entries * 0.9)
+        conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self.evictions += excess
+        self._size = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_or_compute(self, model: str, texts: Sequence[str], compute: Callable) -> List[List[float]]:
+        """Devuelve los vectores de `texts` calculando con compute(textos) solo los que faltan."""
+        cached = self.get_many(model, texts)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if missing:
+            # Textos repetidos dentro del lote se calculan una sola vez
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            computed = dict(zip(unique, compute(unique)))
+            self.put_many(model, unique, [computed[t] for t in unique])
+            for i in missing:
+                cached[i] = computed[texts[i]]
+        return cached
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._connection()
+            total = self.hits + self.misses
+            return {
+                'entries': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'evictions': self.evictions,
+                'pending_touches': len(self._touched),
+                'touch_flushes': self.touch_flushes,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envoltura de unos embeddings (langchain u OllamaBatchEmbedder) que consulta
+    la caché antes de delegar. Expone también embed_batch para la etapa de
+    embeddings de la ingesta.
+    """
+
+    def __init__(self, inner, model: str, cache: "EmbeddingCache"):
+        self.inner = inner
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.cache.get_or_compute(self.model, texts, self.inner.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.cache.get_or_compute(self.model, [text], lambda t: [self.inner.embed_query(t[0])])[0]
+
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        return self.embed_documents(list(texts))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Caché compartida del proceso, o None si EMBED_CACHE_ENABLED=0."""
+    global _cache
+    if not EMBED_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+                atexit.register(_cache.flush)
+    return _cache
+
+
+def with_embedding_cache(embeddings, model: str):
+    """Envuelve `embeddings` con la caché persistente si está habilitada."""
+    cache = get_embedding_cache()
+    return CachedEmbeddings(embeddings, model, cache) if cache is not None else embeddings
@@ -0,0 +1,125 @@
+# embedding_stage.py
+"""
+Etapa de embeddings por lotes para la ingesta.
+
+Divide los textos en lotes de EMBED_BATCH_SIZE y los envía al endpoint
+/api/embed de Ollama con un máximo de EMBED_CONCURRENCY peticiones
+simultáneas, reintentando con backoff exponencial los errores transitorios.
+Los lotes embebidos se entregan en orden a una función de escritura (upsert
+en Qdrant) que corre en su propio hilo, de modo que la escritura del lote N
+se solapa con el cálculo de embeddings del lote N+1. El número de lotes en
+vuelo está acotado (backpressure) para no acumular vectores en memoria.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Sequence
+
+import requests
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "4"))
+EMBED_RETRY_BACKOFF = float(os.getenv("EMBED_RETRY_BACKOFF", "0.5"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "120"))
+
+
+class OllamaBatchEmbedder:
+    """Cliente de /api/embed con reintentos; una sesión HTTP por hilo."""
+
+    def __init__(self, model: str, base_url: str = OLLAMA_URL, max_retries: int = EMBED_MAX_RETRIES,
+                 backoff: float = EMBED_RETRY_BACKOFF, timeout: float = EMBED_TIMEOUT):
+        self.model = model
+        self.url = f"{base_url.rstrip('/')}/api/embed"
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        payload = {"model": self.model, "input": list(texts)}
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = self._session().post(self.url, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                # Solo 429 y 5xx son transitorios; el resto de errores se propaga
+                if resp.status_code != 429 and resp.status_code < 500:
+                    resp.raise_for_status()
+                    embeddings = resp.json().get("embeddings") or []
+                    if len(embeddings) != len(texts):
+                        raise ValueError(f"Ollama devolvió {len(embeddings)} embeddings para {len(texts)} textos")
+                    return embeddings
+                error = requests.HTTPError(f"{resp.status_code} {resp.reason}", response=resp)
+            if attempt == self.max_retries:
+                raise error
+            delay = self.backoff * (2 ** attempt) * (1 + random.random())
+            print(f"[WARN] Error de embeddings ({error}); reintento {attempt + 1}/{self.max_retries} en {delay:.1f}s")
+            time.sleep(delay)
+
+    def embed_documents(self, texts: Sequence[str]) -> List[List[float]]:
+        return self.embed_batch(texts) if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_batch([text])[0]
+
+
+def run_embedding_pipeline(items: Sequence, text_of: Callable, embedder: OllamaBatchEmbedder,
+                           write: Callable, batch_size: int = EMBED_BATCH_SIZE,
+                           concurrency: int = EMBED_CONCURRENCY) -> dict:
+    """
+    Embebe `items` por lotes y llama a write(batch_items, vectors) en orden.
+    Devuelve estadísticas: items, lotes, segundos y chunks por segundo.
+    """
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    if not batches:
+        return {'items': 0, 'batches': 0, 'seconds': 0.0, 'chunks_per_second': 0.0}
+
+    start = time.perf_counter()
+    max_in_flight = concurrency * 2
+    embedded = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as embed_pool, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="upsert") as write_pool:
+        in_flight = deque()
+        pending_write = None
+
+        def hand_off():
+            nonlocal pending_write, embedded
+            batch, future = in_flight.popleft()
+            vectors = future.result()
+            # Un solo lote escribiéndose a la vez: espera al anterior antes de encolar
+            if pending_write is not None:
+                pending_write.result()
+            pending_write = write_pool.submit(write, batch, vectors)
+            embedded += len(batch)
+            elapsed = time.perf_counter() - start
+            print(f"  [INFO] Embeddings: {embedded}/{len(items)} chunks ({embedded / elapsed:.1f} chunks/s)")
+
+        for batch in batches:
+            in_flight.append((batch, embed_pool.submit(embedder.embed_batch, [text_of(it) for it in batch])))
+            if len(in_flight) >= max_in_flight:
+                hand_off()
+        while in_flight:
+            hand_off()
+        if pending_write is not None:
+            pending_write.result()
+
+    seconds = time.perf_counter() - start
+    return {
+        'items': len(items),
+        'batches': len(batches),
+        'seconds': round(seconds, 2),
+        'chunks_per_second': round(len(items) / seconds, 1) if seconds else 0.0,
+    }
@@ -0,0 +1,111 @@
+# hybrid_search.py
+"""
+Recuperación híbrida: búsqueda densa (Qdrant) + léxica (BM25, lexical_index.py)
+fusionadas con reciprocal rank fusion (RRF).
+
+Cada lista aporta weight / (HYBRID_RRF_K + posición) a cada documento; la
+densa pesa 1 y la léxica HYBRID_LEXICAL_WEIGHT, ajustable por materia con
+HYBRID_SUBJECT_WEIGHTS="subject_id=peso,..." (p. ej. más peso léxico en
+Derecho, donde se citan números de artículo). Con peso 0, sin índice o con
+HYBRID_ENABLED=0 la búsqueda es solo densa, como antes.
+
+Ambas búsquedas traen HYBRID_CANDIDATES candidatos y la fusión devuelve los
+k mejores. Los documentos se identifican por el id del punto en Qdrant, que
+es el mismo en el índice léxico.
+"""
+
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from app_logging import get_logger
+from lexical_index import LexicalHit, get_lexical_index
+from tracing import span
+
+HYBRID_ENABLED = os.getenv("HYBRID_ENABLED", "1") == "1"
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+HYBRID_SUBJECT_WEIGHTS = os.getenv("HYBRID_SUBJECT_WEIGHTS", "")
+
+logger = get_logger(__name__)
+
+
+def _parse_weights(spec: str) -> Dict[int, float]:
+    weights = {}
+    for item in spec.split(','):
+        subject, sep, weight = item.strip().partition('=')
+        try:
+            if sep:
+                weights[int(subject)] = float(weight)
+        except ValueError:
+            continue
+    return weights
+
+
+_SUBJECT_WEIGHTS = _parse_weights(HYBRID_SUBJECT_WEIGHTS)
+
+
+def lexical_weight(subject_ids: Sequence[int]) -> float:
+    """Peso de la lista léxica en la fusión (promedio de las materias consultadas)."""
+    if not subject_ids:
+        return HYBRID_LEXICAL_WEIGHT
+    return sum(_SUBJECT_WEIGHTS.get(s, HYBRID_LEXICAL_WEIGHT) for s in subject_ids) / len(subject_ids)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Tuple[Sequence[str], float]], k: int = HYBRID_RRF_K) -> List[Tuple[str, float]]:
+    """rankings: [(ids en orden de relevancia, peso), ...] -> [(id, puntaje)] de mayor a menor."""
+    scores: Dict[str, float] = {}
+    for ids, weight in rankings:
+        for rank, doc_id in enumerate(ids, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _doc_key(doc: Document) -> str:
+    # langchain_qdrant expone el id del punto en metadata['_id']
+    return str(doc.metadata.get('_id') or doc.page_content)
+
+
+def fuse(dense: Sequence[Document], lexical: Sequence[LexicalHit], weight: float, k: int) -> List[Document]:
+    """Fusiona ambas listas con RRF y devuelve los k mejores documentos."""
+    docs: Dict[str, Document] = {}
+    for doc in dense:
+        docs.setdefault(_doc_key(doc), doc)
+    for hit in lexical:
+        docs.setdefault(hit.point_id, Document(page_content=hit.page_content, metadata={**hit.metadata, '_id': hit.point_id}))
+    fused = reciprocal_rank_fusion([
+        ([_doc_key(doc) for doc in dense], 1.0),
+        ([hit.point_id for hit in lexical], weight),
+    ])
+    return [docs[doc_id] for doc_id, _ in fused[:k]]
+
+
+def hybrid_search(vectorstore, question: str, subject_ids: Sequence[int], filter, collection: str,
+                  k: int = 5, query_vector=None, weight: Optional[float] = None, search_params=None) -> List[Document]:
+    """
+    Búsqueda del tutor: densa en `vectorstore` (con `query_vector` si ya se
+    calculó) y, si aplica, léxica en el índice de `collection`, fusionadas.
+    `filter` es el filtro nativo de subject_sharding.subject_filter.
+    `search_params` (hnsw_ef, rescoring; ver collection_config.py) se pasa a
+    la búsqueda densa.
+    """
+    weight = lexical_weight(subject_ids) if weight is None else weight
+    index = None
+    if HYBRID_ENABLED and weight > 0:
+        try:
+            index = get_lexical_index(collection)
+        except Exception as e:
+            logger.warning("No se pudo cargar el índice léxico: %s", e)
+    candidates = max(k, HYBRID_CANDIDATES) if index is not None else k
+    extra = {'search_params': search_params} if search_params is not None else {}
+    if query_vector is not None:
+        dense = vectorstore.similarity_search_by_vector(query_vector, k=candidates, filter=filter, **extra)
+    else:
+        dense = vectorstore.similarity_search(question, k=candidates, filter=filter, **extra)
+    if index is None:
+        return list(dense[:k])
+    with span('lexical'):
+        lexical = index.search(question, subject_ids, candidates)
+        return fuse(dense, lexical, weight, k)
@@ -1,16 +1,37 @@
-
-
+import argparse
+import hashlib
+import json
 import os
-from langchain_community.document_loaders import TextLoader, PDFPlumberLoader
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pdfplumber
+from langchain_core.documents import Document
+from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_community.vectorstores import Qdrant
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct
+from collection_config import provision_collection
+from db import get_conn
+from embedding_cache import get_embedding_cache, with_embedding_cache
+from embedding_stage import EMBED_BATCH_SIZE, EMBED_CONCURRENCY, OllamaBatchEmbedder, run_embedding_pipeline
+from lexical_index import build_from_qdrant, index_path
+from local_index import LocalVectorIndex, build_from_qdrant as build_local_from_qdrant, index_paths as local_index_paths
+from subject_sharding import ShardRouter
 
 # Configuración general
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
 QDRANT_URL = "http://localhost:6333"  # Cambia si tu instancia está en otra dirección
 QDRANT_COLLECTION = "tutor_demo"
+EMBED_MODEL = "nomic-embed-text"  # Cambia el modelo si usas otro
+
+# Carga paralela: procesos del pool y páginas de PDF por tarea
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "20"))
+
+# Manifiesto de la ingesta incremental: ruta -> mtime, sha256 e ids de puntos
+MANIFEST_PATH = os.getenv("INGEST_MANIFEST", "ingest_manifest.json")
 
 # Relación carpeta <-> metadata de materia (ajusta según tu base de datos real)
 SUBJECTS = {
@@ -18,59 +39,464 @@ SUBJECTS = {
     "Derecho": {"subject_id": 2, "subject_name": "Derecho Internacional Público", "language": "es"}
 }
 
-def load_documents():
-    docs = []
-    print("[INFO] Iniciando carga de documentos...")
+def list_source_files():
+    """Archivos soportados de cada carpeta de materia: [(data_dir, fpath), ...]."""
+    files = []
     for data_dir in SUBJECTS.keys():
         print(f"[INFO] Procesando carpeta: {data_dir}")
-        for fname in os.listdir(data_dir):
+        for fname in sorted(os.listdir(data_dir)):
             fpath = os.path.join(data_dir, fname)
             print(f"  [INFO] Archivo encontrado: {fname}")
-            if fname.endswith(".md") or fname.endswith(".txt"):
-                print(f"    [INFO] Cargando como texto: {fpath}")
-                loaded = TextLoader(fpath).load()
-            elif fname.endswith(".pdf"):
-                print(f"    [INFO] Cargando como PDF: {fpath}")
-                loaded = PDFPlumberLoader(fpath).load()
-            else:
+            if not (fname.endswith(".md") or fname.endswith(".txt") or fname.endswith(".pdf")):
                 print(f"    [WARN] Tipo de archivo no soportado: {fname}")
                 continue
-            # Agregar metadata de materia a cada documento
-            for doc in loaded:
-                doc.metadata.update(SUBJECTS[data_dir])
-            docs.extend(loaded)
+            files.append((data_dir, fpath))
+    return files
+
+
+def _pdf_page_count(fpath):
+    with pdfplumber.open(fpath) as pdf:
+        return len(pdf.pages)
+
+
+def plan_load_tasks(files, pages_per_task=PDF_PAGES_PER_TASK):
+    """
+    Divide la carga en tareas por archivo y, en PDFs grandes, por rango de
+    páginas: [(file_idx, data_dir, fpath, first_page, last_page), ...].
+    Para archivos de texto el rango es (None, None).
+    """
+    tasks = []
+    for file_idx, (data_dir, fpath) in enumerate(files):
+        if fpath.endswith(".pdf"):
+            total = _pdf_page_count(fpath)
+            for first in range(0, max(total, 1), pages_per_task):
+                tasks.append((file_idx, data_dir, fpath, first, min(first + pages_per_task, total)))
+        else:
+            tasks.append((file_idx, data_dir, fpath, None, None))
+    return tasks
+
+
+def _load_task(task):
+    """
+    Trabajo del pool de procesos: extrae el texto de un archivo o de un rango
+    de páginas de un PDF. Devuelve datos simples (serializables) y la duración.
+    """
+    file_idx, data_dir, fpath, first, last = task
+    start = time.perf_counter()
+    if first is None:
+        loaded = [(doc.page_content, doc.metadata) for doc in TextLoader(fpath).load()]
+    else:
+        loaded = []
+        with pdfplumber.open(fpath) as pdf:
+            # Misma metadata que PDFPlumberLoader
+            pdf_meta = {k: v for k, v in pdf.metadata.items() if type(v) in (str, int)}
+            total = len(pdf.pages)
+            for page_no in range(first, last):
+                page = pdf.pages[page_no]
+                metadata = {"source": fpath, "file_path": fpath, "page": page_no, "total_pages": total, **pdf_meta}
+                loaded.append((page.extract_text() or "", metadata))
+                page.close()
+    # Agregar metadata de materia a cada documento
+    for _, metadata in loaded:
+        metadata.update(SUBJECTS[data_dir])
+    return task, loaded, time.perf_counter() - start
+
+
+def load_files(files, workers=INGEST_WORKERS):
+    """
+    Carga los archivos en paralelo con un pool de procesos (workers > 1) y
+    devuelve {fpath: [Document, ...]} respetando el orden de archivos y páginas.
+    Informa el progreso por tarea y el tiempo acumulado por archivo.
+    """
+    if not files:
+        return {}
+    tasks = plan_load_tasks(files)
+    results = {}
+    file_seconds = {}
+    start = time.perf_counter()
+    print(f"[INFO] Cargando {len(files)} archivos en {len(tasks)} tareas con {workers} procesos...")
+
+    def collect(task, loaded, elapsed, done):
+        _, _, fpath, first, last = task
+        results[task] = loaded
+        file_seconds[fpath] = file_seconds.get(fpath, 0.0) + elapsed
+        pages = f" págs. {first + 1}-{last}" if first is not None else ""
+        print(f"  [INFO] [{done}/{len(tasks)}] {fpath}{pages} ({elapsed:.2f}s)")
+
+    if workers <= 1 or len(tasks) == 1:
+        for done, task in enumerate(tasks, 1):
+            collect(*_load_task(task), done)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_load_task, task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                collect(*future.result(), done)
+
+    docs_by_file = {fpath: [] for _, fpath in files}
+    for task in sorted(results, key=lambda t: (t[0], t[3] or 0)):
+        docs_by_file[task[2]].extend(Document(page_content=text, metadata=meta) for text, meta in results[task])
+    for _, fpath in files:
+        print(f"  [INFO] {fpath}: {len(docs_by_file[fpath])} documentos, {file_seconds[fpath]:.2f}s de CPU")
+    print(f"[INFO] Carga completada en {time.perf_counter() - start:.2f}s")
+    return docs_by_file
+
+
+def load_documents(workers=INGEST_WORKERS):
+    print("[INFO] Iniciando carga de documentos...")
+    docs_by_file = load_files(list_source_files(), workers)
+    docs = [doc for file_docs in docs_by_file.values() for doc in file_docs]
     print(f"[INFO] Total de documentos cargados: {len(docs)}")
     return docs
 
 
-def chunk_documents(docs):
+def chunk_documents(docs, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
     print("[INFO] Iniciando fragmentación de documentos (chunking)...")
     splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
     )
     chunks = splitter.split_documents(docs)
     print(f"[INFO] Total de chunks generados: {len(chunks)}")
     return chunks
 
 
-def embed_and_store(chunks):
+def file_sha256(fpath):
+    h = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_hash(chunk):
+    """Hash del contenido del chunk y de su origen (archivo y página)."""
+    key = f"{chunk.metadata.get('source')}|{chunk.metadata.get('page', '')}|{chunk.page_content}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def point_id(chunk):
+    """Id determinista del punto en Qdrant (UUID derivado del hash del chunk)."""
+    return str(uuid.UUID(chunk_hash(chunk)[:32]))
+
+
+def load_manifest():
+    """Manifiesto de la colección actual, o None si no existe o es de otra colección."""
+    if not os.path.exists(MANIFEST_PATH):
+        print(f"[INFO] No hay manifiesto de ingesta ({MANIFEST_PATH}).")
+        return None
+    with open(MANIFEST_PATH, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("collection") != QDRANT_COLLECTION:
+        print(f"[INFO] El manifiesto corresponde a otra colección ({manifest.get('collection')}).")
+        return None
+    return manifest
+
+
+def save_manifest(manifest):
+    tmp = MANIFEST_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def embed_and_store(chunks, client=None, embedder=None, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY,
+                    collection=QDRANT_COLLECTION, on_stored=None):
+    """
+    Calcula embeddings por lotes concurrentes y hace upsert en Qdrant con ids
+    deterministas; el upsert de un lote se solapa con el embedding del
+    siguiente (ver embedding_stage.py). El payload conserva el formato de
+    langchain (page_content, metadata) y replica subject_id en la raíz para
+    los filtros del tutor. La colección se crea con la configuración de
+    collection_config.py y, con QDRANT_SHARDING, cada punto va al shard de su
+    materia (subject_sharding.py). on_stored(chunks, vectors), si se indica,
+    se llama con cada lote ya escrito en Qdrant.
+    """
+    if not chunks:
+        return []
     print("[INFO] Generando embeddings y almacenando en Qdrant...")
-    embeddings = OllamaEmbeddings(model="nomic-embed-text")  # Cambia el modelo si usas otro
-    db = Qdrant.from_documents(
-        chunks,
-        embeddings,
-        url=QDRANT_URL,
-        collection_name=QDRANT_COLLECTION
-    )
-    print(f"[INFO] Stored {len(chunks)} chunks in Qdrant con metadata de materia.")
+    client = client or QdrantClient(url=QDRANT_URL)
+    # Los textos ya embebidos (mismo modelo y contenido) salen de la caché en disco
+    embedder = embedder or with_embedding_cache(OllamaBatchEmbedder(EMBED_MODEL), EMBED_MODEL)
+    router = ShardRouter(client, collection)
+    ids = []
+
+    def upsert(batch, vectors):
+        points = [
+            PointStruct(
+                id=point_id(chunk),
+                vector=vector,
+                payload={
+                    "page_content": chunk.page_content,
+                    "metadata": chunk.metadata,
+                    "subject_id": chunk.metadata.get("subject_id"),
+                    "chunk_hash": chunk_hash(chunk),
+                },
+            )
+            for chunk, vector in zip(batch, vectors)
+        ]
+        router.upsert(points, len(vectors[0]))
+        ids.extend(p.id for p in points)
+        if on_stored is not None:
+            on_stored(batch, vectors)
+
+    stats = run_embedding_pipeline(chunks, lambda c: c.page_content, embedder, upsert, batch_size, concurrency)
+    print(f"[INFO] Stored {len(chunks)} chunks in Qdrant con metadata de materia "
+          f"({stats['seconds']}s, {stats['chunks_per_second']} chunks/s).")
+    cache = get_embedding_cache()
+    if cache is not None:
+        cache_stats = cache.stats()
+        print(f"[INFO] Caché de embeddings: {cache_stats['hits']} aciertos, {cache_stats['misses']} fallos, "
+              f"{cache_stats['entries']} entradas, {cache_stats['evictions']} desalojadas.")
+    return ids
+
+
+def delete_points(client, ids):
+    ShardRouter(client, QDRANT_COLLECTION).delete(ids)
+
+
+def incremental_ingest(full=False, workers=INGEST_WORKERS, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY):
+    """
+    Ingesta incremental guiada por el manifiesto: solo se vuelven a cargar los
+    archivos cuyo mtime cambió y cuyo contenido (sha256) es distinto; de ellos
+    solo se embeben los chunks nuevos y se borran los puntos que ya no existen.
+    Los archivos eliminados pierden sus puntos. Con full=True se recrea la
+    colección (o sus colecciones por materia) y se parte de un manifiesto vacío.
+    Sin un manifiesto válido no se sabe qué puntos hay en la colección (p. ej.
+    los de ids aleatorios de una ingesta anterior), así que también se recrea:
+    de lo contrario cada chunk quedaría duplicado. Devuelve True si la
+    colección cambió.
+
+    El manifiesto en disco nunca lista puntos que no existen: tras recrear la
+    colección se guarda vacío, y cada archivo se registra en cuanto terminan
+    de escribirse todos sus chunks (y de borrarse los que ya no tiene). Si la
+    ingesta se interrumpe, la siguiente retoma los archivos sin registrar.
+
+    Al terminar se escribe el índice vectorial local con los vectores recién
+    calculados y las filas vigentes del índice anterior (write_local_index).
+    """
+    client = QdrantClient(url=QDRANT_URL)
+    manifest = None if full else load_manifest()
+    recreated = False
+    # Tras recrear la colección el índice local anterior no sirve
+    reuse_local = manifest is not None
+    if manifest is None:
+        router = ShardRouter(client, QDRANT_COLLECTION)
+        recreated = bool(router.collections())
+        if recreated and not full:
+            print("[WARN] La colección existe sin manifiesto válido; se recrea como con --full.")
+        router.drop()
+        manifest = {"collection": QDRANT_COLLECTION, "files": {}}
+        save_manifest(manifest)
+    previous = dict(manifest["files"])
+    files = manifest["files"]
+
+    pending = []
+    seen = set()
+    for data_dir, fpath in list_source_files():
+        seen.add(fpath)
+        mtime = os.path.getmtime(fpath)
+        entry = previous.get(fpath)
+        if entry and entry["mtime"] == mtime:
+            continue
+        sha = file_sha256(fpath)
+        if entry and entry["sha256"] == sha:
+            files[fpath] = dict(entry, mtime=mtime)
+            continue
+        print(f"    [INFO] Archivo nuevo o modificado: {fpath}")
+        pending.append((data_dir, fpath, mtime, sha))
+
+    docs_by_file = load_files([(data_dir, fpath) for data_dir, fpath, _, _ in pending], workers)
+    new_chunks = []
+    # Por archivo: entrada nueva del manifiesto, puntos a borrar y chunks aún sin escribir
+    entries, stale, remaining, owner = {}, {}, {}, {}
+    # Filas del índice vectorial local para los chunks embebidos en esta ejecución
+    local_rows = []
+    for data_dir, fpath, mtime, sha in pending:
+        entry = previous.get(fpath)
+        chunks = chunk_documents(docs_by_file[fpath])
+        unique = {point_id(c): c for c in chunks}
+        old_ids = set(entry["point_ids"]) if entry else set()
+        file_new = [c for pid, c in unique.items() if pid not in old_ids]
+        stale[fpath] = sorted(old_ids - set(unique))
+        print(f"    [INFO] {fpath}: {len(file_new)} chunks nuevos, {len(unique) - len(file_new)} sin cambios, {len(stale[fpath])} eliminados.")
+        new_chunks.extend(file_new)
+        owner.update((point_id(c), fpath) for c in file_new)
+        remaining[fpath] = len(file_new)
+        entries[fpath] = {"subject": data_dir, "mtime": mtime, "sha256": sha, "point_ids": list(unique)}
+
+    def finish(fpath):
+        delete_points(client, stale[fpath])
+        files[fpath] = entries[fpath]
+        save_manifest(manifest)
+
+    def stored(batch, vectors):
+        local_rows.extend((point_id(c), v, c.page_content, c.metadata, c.metadata.get("subject_id"))
+                          for c, v in zip(batch, vectors))
+        for chunk in batch:
+            fpath = owner[point_id(chunk)]
+            remaining[fpath] -= 1
+            if not remaining[fpath]:
+                finish(fpath)
+
+    # Los archivos sin chunks nuevos solo borran puntos
+    for fpath in [f for f, n in remaining.items() if not n]:
+        finish(fpath)
+    # Un solo pipeline para todos los chunks nuevos: lotes llenos y máximo solapamiento
+    embed_and_store(new_chunks, client, batch_size=batch_size, concurrency=concurrency, on_stored=stored)
+    changed = bool(new_chunks or any(stale.values())) or recreated
+
+    for fpath in sorted(set(previous) - seen):
+        print(f"    [INFO] Archivo eliminado: {fpath}")
+        delete_points(client, previous[fpath]["point_ids"])
+        del files[fpath]
+        save_manifest(manifest)
+        changed = True
+
+    save_manifest(manifest)
+    point_ids = {pid for entry in files.values() for pid in entry["point_ids"]}
+    if changed or not os.path.exists(local_index_paths(QDRANT_COLLECTION)[1]):
+        write_local_index(local_rows, point_ids, client, reuse=reuse_local)
+    return changed
+
+
+def write_local_index(rows, point_ids, client=None, reuse=True):
+    """
+    Escribe el índice vectorial local (local_index.py) sin leer de Qdrant: las
+    filas `rows` de los chunks recién embebidos más, con reuse, las del índice
+    anterior cuyos puntos siguen en `point_ids`. Si así no se cubren todos los
+    puntos (no había índice previo o una ingesta interrumpida dejó chunks sin
+    fila), se recurre a rebuild_local_index. Devuelve True si se escribió.
+    """
+    vectors_path, meta_path = local_index_paths(QDRANT_COLLECTION)
+    fresh = {row[0] for row in rows}
+    kept = []
+    if reuse and os.path.exists(meta_path):
+        try:
+            previous = LocalVectorIndex.load(vectors_path, meta_path, mmap=False)
+            kept = [row for row in previous.rows() if row[0] in point_ids and row[0] not in fresh]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] No se pudo leer el índice vectorial local anterior: {e}")
+    covered = fresh.union(row[0] for row in kept)
+    if not point_ids <= covered:
+        print(f"[INFO] {len(point_ids - covered)} chunks sin vector en el índice local; se reconstruye desde Qdrant.")
+        return rebuild_local_index(client)
+    start = time.perf_counter()
+    index = LocalVectorIndex.build(row for row in kept + list(rows) if row[0] in point_ids)
+    index.save(vectors_path, meta_path)
+    print(f"[INFO] Índice vectorial local: {len(index)} chunks ({len(fresh)} nuevos) de dimensión {index.dim}, "
+          f"{len(index.partitions)} materias en {vectors_path} ({time.perf_counter() - start:.2f}s).")
+    return True
+
+
+def provision_existing_collection(client=None):
+    """
+    Reconfigura la colección existente según collection_config.py sin
+    reingestar (Qdrant reconstruye HNSW y cuantización en segundo plano).
+    """
+    client = client or QdrantClient(url=QDRANT_URL)
+    collections = ShardRouter(client, QDRANT_COLLECTION).collections()
+    if not collections:
+        print("[WARN] La colección no existe; se creará con esta configuración en la próxima ingesta.")
+        return
+    for collection in collections:
+        size = client.get_collection(collection).config.params.vectors.size
+        provision_collection(client, collection, size, reconfigure=True)
+        print(f"[INFO] Configuración aplicada a {collection}.")
+
+
+def rebuild_lexical_index(client=None):
+    """
+    Reconstruye el índice BM25 de la colección (lexical_index.py) a partir de
+    los payloads ya guardados en Qdrant, de modo que refleja exactamente los
+    mismos puntos (ids) que la búsqueda densa. Los procesos del tutor lo
+    recargan al detectar el archivo nuevo. Devuelve True si se reconstruyó.
+    """
+    client = client or QdrantClient(url=QDRANT_URL)
+    collections = ShardRouter(client, QDRANT_COLLECTION).collections()
+    if not collections:
+        print("[WARN] La colección no existe; no se construye el índice léxico.")
+        return False
+    start = time.perf_counter()
+    index = build_from_qdrant(client, collections)
+    path = index_path(QDRANT_COLLECTION)
+    index.save(path)
+    print(f"[INFO] Índice léxico: {len(index)} chunks, {len(index.postings)} términos en {path} "
+          f"({time.perf_counter() - start:.2f}s).")
+    return True
+
+
+def rebuild_local_index(client=None):
+    """
+    Reconstruye el índice vectorial local (local_index.py) con los vectores y
+    payloads de la colección, para el backend retrieval_backend='local'. Los
+    procesos del tutor lo recargan al detectar el archivo nuevo. Devuelve True
+    si se reconstruyó.
+    """
+    client = client or QdrantClient(url=QDRANT_URL)
+    collections = ShardRouter(client, QDRANT_COLLECTION).collections()
+    if not collections:
+        print("[WARN] La colección no existe; no se construye el índice vectorial local.")
+        return False
+    start = time.perf_counter()
+    index = build_local_from_qdrant(client, collections)
+    vectors_path, meta_path = local_index_paths(QDRANT_COLLECTION)
+    index.save(vectors_path, meta_path)
+    print(f"[INFO] Índice vectorial local: {len(index)} chunks de dimensión {index.dim}, "
+          f"{len(index.partitions)} materias en {vectors_path} ({time.perf_counter() - start:.2f}s).")
+    return True
+
+
+def bump_collection_version():
+    """
+    Incrementa app_settings.collection_version para que los procesos del tutor
+    descarten las cachés ligadas al contenido anterior de la colección.
+    """
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE app_settings SET collection_version = COALESCE(collection_version, 0) + 1 WHERE id=1;")
+            conn.commit()
+        print("[INFO] Versión de la colección incrementada (cachés invalidadas).")
+    except Exception as e:
+        print("[WARN] No se pudo incrementar la versión de la colección:", e)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Ingesta de documentos de las materias en Qdrant.")
+    parser.add_argument("--full", action="store_true", help="Recrea la colección y reingesta todos los archivos.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Procesos para cargar y extraer documentos.")
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE, help="Textos por petición a /api/embed.")
+    parser.add_argument("--embed-concurrency", type=int, default=EMBED_CONCURRENCY, help="Peticiones de embeddings simultáneas.")
+    parser.add_argument("--rebuild-lexical", action="store_true", help="Solo reconstruye el índice léxico (BM25) de la colección.")
+    parser.add_argument("--rebuild-local", action="store_true", help="Solo reconstruye el índice vectorial local de la colección.")
+    parser.add_argument("--provision", action="store_true",
+                        help="Solo aplica a la colección existente la cuantización, HNSW y vectores en disco de QDRANT_*.")
+    args = parser.parse_args()
+
+    if args.provision:
+        provision_existing_collection()
+        return
+
+    if args.rebuild_lexical or args.rebuild_local:
+        rebuilt = False
+        if args.rebuild_lexical:
+            rebuilt |= rebuild_lexical_index()
+        if args.rebuild_local:
+            rebuilt |= rebuild_local_index()
+        # La caché de recuperación guarda resultados de los índices anteriores
+        if rebuilt:
+            bump_collection_version()
+        return
+
     print("[INFO] === PIPELINE DE INGESTIÓN INICIADO ===")
-    docs = load_documents()
-    chunks = chunk_documents(docs)
-    embed_and_store(chunks)
+    # incremental_ingest también escribe el índice vectorial local
+    if incremental_ingest(full=args.full, workers=args.workers, batch_size=args.embed_batch_size, concurrency=args.embed_concurrency):
+        rebuild_lexical_index()
+        bump_collection_version()
+    else:
+        print("[INFO] Sin cambios en los documentos; la colección no se modificó.")
+        if not os.path.exists(index_path(QDRANT_COLLECTION)) and rebuild_lexical_index():
+            bump_collection_version()
     print("[INFO] === PIPELINE DE INGESTIÓN FINALIZADO ===")
 
 
@@ -0,0 +1,189 @@
+# lexical_index.py
+"""
+Índice léxico (BM25) de la colección para la recuperación híbrida.
+
+La búsqueda densa falla con términos exactos: números de artículo
+("artículo 31 Convención de Viena"), siglas y nombres propios ("Simplex").
+Este índice invertido local los cubre. Lo construye ingest_pipeline.py a
+partir de los puntos de la colección (mismo id, texto y metadata que en
+Qdrant) y lo guarda en LEXICAL_INDEX_DIR/<colección>.json.gz; cada proceso
+del tutor lo carga una vez y lo recarga cuando el archivo cambia.
+
+El tokenizador pasa a minúsculas, quita acentos y stopwords, y conserva los
+números, de modo que "Artículo 31" y "articulo 31" coinciden.
+"""
+
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from app_logging import get_logger
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "lexical_index")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+logger = get_logger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a al algo como con cual cuales de del desde donde el ella ellos en entre es esa ese eso esta este esto
+fue ha han hay la las le les lo los mas me mi muy no nos o para pero por que quien se sea ser si sin
+sobre son su sus tambien te tiene tu un una uno unos y ya
+an and are as at be by for from in is it of on or that the this to was were with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+    # Los números de un dígito cuentan ("artículo 3"); las letras sueltas no
+    return [t for t in _TOKEN_RE.findall(text) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+class LexicalHit(NamedTuple):
+    point_id: str
+    score: float
+    page_content: str
+    metadata: dict
+
+
+class LexicalIndex:
+    """Índice invertido en memoria: término -> [(documento, frecuencia), ...]."""
+
+    def __init__(self, ids: List[str], texts: List[str], metadatas: List[dict], subjects: List[Optional[int]],
+                 lengths: List[int], postings: Dict[str, List[Tuple[int, int]]]):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.subjects = subjects
+        self.lengths = lengths
+        self.postings = postings
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[str, str, dict, Optional[int]]]) -> "LexicalIndex":
+        """documents: (point_id, texto, metadata, subject_id)."""
+        ids, texts, metadatas, subjects, lengths = [], [], [], [], []
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for point_id, text, metadata, subject_id in documents:
+            doc = len(ids)
+            terms = Counter(tokenize(text))
+            for term, tf in terms.items():
+                postings[term].append((doc, tf))
+            ids.append(str(point_id))
+            texts.append(text)
+            metadatas.append(metadata or {})
+            subjects.append(subject_id)
+            lengths.append(sum(terms.values()))
+        return cls(ids, texts, metadatas, subjects, lengths, dict(postings))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, subject_ids: Optional[Sequence[int]] = None, k: int = 20) -> List[LexicalHit]:
+        """Los `k` documentos con mejor puntaje BM25, filtrando por materia."""
+        if not self.ids:
+            return []
+        allowed = set(subject_ids) if subject_ids else None
+        n = len(self.ids)
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc, tf in posting:
+                if allowed is not None and self.subjects[doc] not in allowed:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / self.avg_length)
+                scores[doc] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [LexicalHit(self.ids[doc], score, self.texts[doc], self.metadatas[doc]) for doc, score in top]
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        data = {
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "subjects": self.subjects,
+            "lengths": self.lengths,
+            "postings": self.postings,
+        }
+        tmp = path + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        postings = {term: [tuple(p) for p in plist] for term, plist in data["postings"].items()}
+        return cls(data["ids"], data["texts"], data["metadatas"], data["subjects"], data["lengths"], postings)
+
+
+def index_path(collection: str) -> str:
+    return os.path.join(LEXICAL_INDEX_DIR, f"{collection}.json.gz")
+
+
+def build_from_qdrant(client, collections: Union[str, Sequence[str]], batch_size: int = 1000) -> LexicalIndex:
+    """
+    Construye el índice recorriendo los payloads (sin vectores) de la colección
+    o de las colecciones por materia (subject_sharding.py).
+    """
+    def documents():
+        for collection in ([collections] if isinstance(collections, str) else collections):
+            offset = None
+            while True:
+                points, offset = client.scroll(
+                    collection_name=collection,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=False,
+                )
+                for point in points:
+                    payload = point.payload or {}
+                    yield str(point.id), payload.get("page_content", ""), payload.get("metadata") or {}, payload.get("subject_id")
+                if offset is None:
+                    break
+    return LexicalIndex.build(documents())
+
+
+# Índices cargados por proceso: colección -> (mtime, tamaño, índice)
+_loaded: Dict[str, Tuple[float, int, LexicalIndex]] = {}
+_missing_warned = set()
+_lock = threading.Lock()
+
+
+def get_lexical_index(collection: str) -> Optional[LexicalIndex]:
+    """Índice de la colección (se recarga si la ingesta reescribió el archivo), o None si no existe."""
+    path = index_path(collection)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        if collection not in _missing_warned:
+            _missing_warned.add(collection)
+            logger.warning("Sin índice léxico para %s (%s); se usa solo la búsqueda densa. "
+                           "Ejecuta ingest_pipeline.py --rebuild-lexical", collection, path)
+        return None
+    cached = _loaded.get(collection)
+    if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    with _lock:
+        cached = _loaded.get(collection)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        index = LexicalIndex.load(path)
+        _loaded[collection] = (stat.st_mtime, stat.st_size, index)
+        _missing_warned.discard(collection)
+        logger.info("Índice léxico cargado", extra={'fields': {'collection': collection, 'documents': len(index)}})
+        return index
@@ -0,0 +1,350 @@
+# llm_dispatch.py
+"""
+Despacho de las llamadas al LLM: concurrencia acotada, cola justa por
+usuario y descarte de carga.
+
+Con una clase entera preguntando a la vez, todas las peticiones llegaban a
+/api/generate de Ollama al mismo tiempo; Ollama las encola sin orden y las
+últimas terminaban en el timeout de 120 s. El TutorAgent pide aquí un turno
+antes de cada llamada al LLM:
+
+- cada carril (backend/modelo) admite LLM_CONCURRENCY llamadas simultáneas;
+  LLM_CONCURRENCY_OVERRIDES ajusta carriles concretos
+  ("ollama/gemma3:4b=2,openai=16");
+- el resto espera en una cola por prioridad (el chat antes que los resúmenes
+  de conversación) y, dentro de cada prioridad, por turnos entre usuarios:
+  un estudiante con varias preguntas encoladas no retrasa a los demás;
+- si la cola del carril ya tiene LLM_QUEUE_MAX llamadas o la espera estimada
+  supera LLM_QUEUE_TIMEOUT, la llamada se rechaza en el acto con
+  LLMOverloaded (429 + Retry-After en /api/chat); también si pasa
+  LLM_QUEUE_TIMEOUT segundos sin turno. La espera estimada solo descarta
+  cuando el carril ya midió LLM_SHED_MIN_SAMPLES llamadas y hay alguien en
+  cola: la primera llamada que no tiene turno siempre puede esperar.
+
+La espera se registra como etapa llm_queue (tracing.py y columna queue_ms de
+chat_metrics). Los límites son por proceso: con varios workers, reparte la
+capacidad del servidor (OLLAMA_NUM_PARALLEL) entre ellos.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+from app_logging import get_logger
+from tracing import observe
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_CONCURRENCY_OVERRIDES = os.getenv("LLM_CONCURRENCY_OVERRIDES", "")
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Llamadas medidas por carril antes de descartar por espera estimada. La
+# estimación es (en cola + 1) * duración / LLM_CONCURRENCY: con la duración
+# supuesta de arranque (DEFAULT_SERVICE_SECONDS) y un carril de 1 turno, tres
+# llamadas en cola ya "superarían" 30 s aunque el modelo responda en 2 s; por
+# eso, hasta tener muestras reales, solo rigen LLM_QUEUE_MAX y el timeout.
+# Si una llamada típica dura más que LLM_QUEUE_TIMEOUT * LLM_CONCURRENCY, la
+# estimación rechaza todo salvo la primera llamada en cola: sube el timeout.
+LLM_SHED_MIN_SAMPLES = int(os.getenv("LLM_SHED_MIN_SAMPLES", "5"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Duración supuesta de una llamada hasta medir la primera (segundos); solo
+# sirve para Retry-After, no para descartar (ver LLM_SHED_MIN_SAMPLES)
+DEFAULT_SERVICE_SECONDS = 10.0
+SERVICE_EWMA_ALPHA = 0.2
+
+logger = get_logger(__name__)
+
+
+class LLMOverloaded(Exception):
+    """El carril del LLM está saturado; retry_after son los segundos sugeridos para reintentar."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_overrides(spec: str) -> Dict[str, int]:
+    """'ollama/gemma3:4b=2,openai=16' -> {'ollama/gemma3:4b': 2, 'openai': 16}."""
+    limits = {}
+    for item in spec.split(","):
+        key, sep, value = item.strip().rpartition("=")
+        if sep and key.strip():
+            limits[key.strip()] = int(value)
+    return limits
+
+
+class _Waiter:
+    """Llamada encolada; se despierta con un Event (hilos) o un Future (asyncio)."""
+
+    __slots__ = ("user", "priority", "enqueued_at", "granted", "event", "loop", "future")
+
+    def __init__(self, user, priority: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.user = user
+        self.priority = priority
+        self.enqueued_at = time.perf_counter()
+        self.granted = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self) -> None:
+        if self.event is not None:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            # Event loop cerrado: nadie espera ya este turno
+            pass
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _Lane:
+    """Estado de un backend/modelo: turnos en uso y cola por prioridad y usuario."""
+
+    def __init__(self, backend: str, model: str, limit: int):
+        self.backend = backend
+        self.model = model
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        # prioridad -> usuario -> llamadas en orden de llegada; el orden de los
+        # usuarios es el de sus turnos
+        self.queues: Dict[int, "OrderedDict[object, deque]"] = {}
+        self.service_seconds = DEFAULT_SERVICE_SECONDS
+        # Llamadas terminadas que alimentaron service_seconds
+        self.samples = 0
+        self.admitted = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.shed = 0
+        self.timeouts = 0
+
+    def estimated_wait(self) -> float:
+        """Segundos que esperaría una llamada nueva con la cola actual."""
+        return (self.waiting + 1) * self.service_seconds / self.limit
+
+    def push(self, waiter: _Waiter) -> None:
+        users = self.queues.setdefault(waiter.priority, OrderedDict())
+        users.setdefault(waiter.user, deque()).append(waiter)
+        self.waiting += 1
+
+    def pop(self) -> Optional[_Waiter]:
+        for priority in sorted(self.queues):
+            users = self.queues[priority]
+            if not users:
+                continue
+            user, waiters = users.popitem(last=False)
+            waiter = waiters.popleft()
+            if waiters:
+                # El usuario vuelve al final: le toca después de los demás
+                users[user] = waiters
+            self.waiting -= 1
+            return waiter
+        return None
+
+    def remove(self, waiter: _Waiter) -> bool:
+        users = self.queues.get(waiter.priority, {})
+        waiters = users.get(waiter.user)
+        if not waiters or waiter not in waiters:
+            return False
+        waiters.remove(waiter)
+        if not waiters:
+            del users[waiter.user]
+        self.waiting -= 1
+        return True
+
+
+class LLMSlot:
+    """Turno concedido en un carril; release() (o salir del with) lo devuelve."""
+
+    def __init__(self, dispatcher: "LLMDispatcher", lane: _Lane, waited: float):
+        self._dispatcher = dispatcher
+        self._lane = lane
+        self._started = time.perf_counter()
+        self._released = False
+        self.waited = waited
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._dispatcher._release(self._lane, time.perf_counter() - self._started)
+
+    def __enter__(self) -> "LLMSlot":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class LLMDispatcher:
+    def __init__(self, concurrency: int = LLM_CONCURRENCY, overrides: Optional[Dict[str, int]] = None,
+                 queue_max: int = LLM_QUEUE_MAX, queue_timeout: float = LLM_QUEUE_TIMEOUT,
+                 shed_min_samples: int = LLM_SHED_MIN_SAMPLES):
+        self.concurrency = concurrency
+        self.overrides = parse_overrides(LLM_CONCURRENCY_OVERRIDES) if overrides is None else overrides
+        self.queue_max = queue_max
+        self.queue_timeout = queue_timeout
+        self.shed_min_samples = shed_min_samples
+        self._lanes: Dict[Tuple[str, str], _Lane] = {}
+        self._lock = threading.Lock()
+
+    def limit(self, backend: str, model: str) -> int:
+        return max(1, self.overrides.get(f"{backend}/{model}", self.overrides.get(backend, self.concurrency)))
+
+    def _lane(self, backend: str, model: str) -> _Lane:
+        lane = self._lanes.get((backend, model))
+        if lane is None:
+            lane = self._lanes[(backend, model)] = _Lane(backend, model, self.limit(backend, model))
+        return lane
+
+    def _overloaded(self, lane: _Lane, reason: str) -> LLMOverloaded:
+        # Se sugiere volver cuando la cola actual haya avanzado, sin pasar de LLM_QUEUE_TIMEOUT
+        retry_after = max(1, math.ceil(min(lane.estimated_wait(), self.queue_timeout)))
+        logger.warning("LLM saturado: llamada rechazada", extra={'fields': {
+            'backend': lane.backend, 'model': lane.model, 'reason': reason, 'active': lane.active,
+            'waiting': lane.waiting, 'retry_after': retry_after}})
+        return LLMOverloaded(f"LLM {lane.backend}/{lane.model} saturado ({reason})", retry_after)
+
+    def _admit(self, backend: str, model: str, user, priority: int, loop=None):
+        """(carril, None) con turno inmediato o (carril, waiter) encolado; LLMOverloaded si no cabe."""
+        with self._lock:
+            lane = self._lane(backend, model)
+            if lane.active < lane.limit and not lane.waiting:
+                lane.active += 1
+                lane.admitted += 1
+                return lane, None
+            queue_full = lane.waiting >= self.queue_max
+            # La estimación solo cuenta con muestras reales y con alguien ya en cola
+            too_slow = (lane.waiting > 0 and lane.samples >= self.shed_min_samples
+                        and lane.estimated_wait() > self.queue_timeout)
+            if queue_full or too_slow:
+                lane.shed += 1
+                error = self._overloaded(lane, "cola llena" if queue_full else "espera estimada")
+            else:
+                waiter = _Waiter(user, priority, loop)
+                lane.push(waiter)
+                return lane, waiter
+        raise error
+
+    def _withdraw(self, lane: _Lane, waiter: _Waiter) -> bool:
+        """Saca de la cola una llamada que dejó de esperar; False si el turno ya le había llegado."""
+        with self._lock:
+            return lane.remove(waiter)
+
+    def _timed_out(self, lane: _Lane) -> LLMOverloaded:
+        with self._lock:
+            lane.timeouts += 1
+            return self._overloaded(lane, "tiempo de espera agotado")
+
+    def _granted(self, lane: _Lane, waiter: Optional[_Waiter]) -> LLMSlot:
+        waited = time.perf_counter() - waiter.enqueued_at if waiter is not None else 0.0
+        if waiter is not None:
+            with self._lock:
+                lane.waits += 1
+                lane.wait_time += waited
+                lane.max_wait = max(lane.max_wait, waited)
+        observe('llm_queue', waited)
+        return LLMSlot(self, lane, waited)
+
+    def _release(self, lane: _Lane, held: Optional[float]) -> None:
+        with self._lock:
+            if held is not None:
+                # La primera medición reemplaza la duración supuesta
+                alpha = SERVICE_EWMA_ALPHA if lane.samples else 1.0
+                lane.service_seconds += alpha * (held - lane.service_seconds)
+                lane.samples += 1
+            waiter = lane.pop()
+            if waiter is None:
+                lane.active -= 1
+                return
+            # El turno pasa directamente a la siguiente llamada
+            waiter.granted = True
+            lane.admitted += 1
+            waiter.wake()
+
+    def acquire(self, backend: str, model: str, user=None, priority: int = PRIORITY_INTERACTIVE,
+                timeout: Optional[float] = None) -> LLMSlot:
+        """Espera (bloqueando el hilo) un turno en el carril; lanza LLMOverloaded si hay que descartar."""
+        timeout = self.queue_timeout if timeout is None else timeout
+        lane, waiter = self._admit(backend, model, user, priority)
+        if waiter is not None:
+            waiter.event.wait(timeout)
+            if self._withdraw(lane, waiter):
+                raise self._timed_out(lane)
+        return self._granted(lane, waiter)
+
+    async def acquire_async(self, backend: str, model: str, user=None, priority: int = PRIORITY_INTERACTIVE,
+                            timeout: Optional[float] = None) -> LLMSlot:
+        """Variante asíncrona de acquire: espera el turno sin ocupar un hilo."""
+        timeout = self.queue_timeout if timeout is None else timeout
+        lane, waiter = self._admit(backend, model, user, priority, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # El cliente se fue: si el turno ya había llegado se devuelve
+                if not self._withdraw(lane, waiter):
+                    self._release(lane, None)
+                raise
+            if self._withdraw(lane, waiter):
+                raise self._timed_out(lane)
+        return self._granted(lane, waiter)
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [
+                {
+                    'backend': lane.backend,
+                    'model': lane.model,
+                    'limit': lane.limit,
+                    'active': lane.active,
+                    'waiting': lane.waiting,
+                    'admitted': lane.admitted,
+                    'waits': lane.waits,
+                    'avg_wait_ms': round(lane.wait_time / lane.waits * 1000, 1) if lane.waits else 0.0,
+                    'max_wait_ms': round(lane.max_wait * 1000, 1),
+                    'shed': lane.shed,
+                    'timeouts': lane.timeouts,
+                    'service_ms': int(lane.service_seconds * 1000),
+                    'samples': lane.samples,
+                }
+                for _, lane in sorted(self._lanes.items())
+            ]
+
+    def render_prometheus(self) -> str:
+        """Estado de los carriles en formato de texto de Prometheus (la espera está en la etapa llm_queue)."""
+        lanes = self.stats()
+        lines = []
+        for metric, kind, help_text, field in (
+            ("tutor_llm_concurrency_limit", "gauge", "Llamadas simultáneas admitidas por carril del LLM.", "limit"),
+            ("tutor_llm_active", "gauge", "Llamadas al LLM en curso por carril.", "active"),
+            ("tutor_llm_queue_depth", "gauge", "Llamadas al LLM esperando turno por carril.", "waiting"),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            for lane in lanes:
+                lines.append(f'{metric}{{backend="{lane["backend"]}",model="{lane["model"]}"}} {lane[field]}')
+        lines += [
+            "# HELP tutor_llm_rejected_total Llamadas al LLM rechazadas por saturación (429).",
+            "# TYPE tutor_llm_rejected_total counter",
+        ]
+        for lane in lanes:
+            labels = f'backend="{lane["backend"]}",model="{lane["model"]}"'
+            lines.append(f'tutor_llm_rejected_total{{{labels},reason="admission"}} {lane["shed"]}')
+            lines.append(f'tutor_llm_rejected_total{{{labels},reason="timeout"}} {lane["timeouts"]}')
+        return "\n".join(lines) + "\n"
+
+
+llm_dispatcher = LLMDispatcher()
@@ -0,0 +1,245 @@
+# local_index.py
+"""
+Índice vectorial local (en proceso) como alternativa a Qdrant.
+
+Para despliegues pequeños y CI, donde la colección tiene unos pocos miles de
+chunks, basta una matriz float32 de embeddings normalizados en disco,
+mapeada en memoria con NumPy: la búsqueda es un producto matriz-vector y un
+top-k con argpartition, sin salto de red. Se selecciona con
+app_settings.retrieval_backend = 'local'.
+
+Lo escribe ingest_pipeline.py con los mismos ids, payloads y vectores que
+suben a Qdrant, a partir de los chunks recién embebidos y de las filas del
+índice anterior que siguen vigentes (sin leer de Qdrant); --rebuild-local lo
+reconstruye recorriendo la colección. Se guarda en LOCAL_INDEX_DIR:
+
+- <colección>.npy: matriz (chunks x dimensión) con las filas ordenadas por
+  subject_id, de modo que cada materia es un bloque contiguo;
+- <colección>.local.json.gz: ids, textos, metadata y los rangos de cada
+  materia (con otro nombre que el índice léxico, por si comparten directorio).
+
+El JSON se escribe después de la matriz; cada proceso del tutor recarga el
+índice cuando ese archivo cambia.
+"""
+
+import gzip
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app_logging import get_logger
+from subject_sharding import subject_ids_from_filter
+
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "local_index")
+
+logger = get_logger(__name__)
+
+
+class LocalHit(NamedTuple):
+    point_id: str
+    score: float
+    page_content: str
+    metadata: dict
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class LocalVectorIndex:
+    """Matriz de embeddings normalizados particionada por materia."""
+
+    def __init__(self, vectors: np.ndarray, ids: List[str], texts: List[str], metadatas: List[dict],
+                 partitions: Dict[Optional[int], Tuple[int, int]]):
+        self.vectors = vectors
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.partitions = partitions
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[str, Sequence[float], str, dict, Optional[int]]]) -> "LocalVectorIndex":
+        """documents: (point_id, vector, texto, metadata, subject_id)."""
+        # Ordenadas por materia (las sin materia al final) para tener bloques contiguos
+        rows = sorted(documents, key=lambda d: (d[4] is None, d[4] if d[4] is not None else 0, str(d[0])))
+        if not rows:
+            return cls(np.zeros((0, 0), dtype=np.float32), [], [], [], {})
+        vectors = _normalize_rows(np.asarray([r[1] for r in rows], dtype=np.float32))
+        partitions: Dict[Optional[int], Tuple[int, int]] = {}
+        for i, row in enumerate(rows):
+            start, _ = partitions.get(row[4], (i, i))
+            partitions[row[4]] = (start, i + 1)
+        return cls(vectors, [str(r[0]) for r in rows], [r[2] for r in rows], [r[3] or {} for r in rows], partitions)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def rows(self) -> Iterable[Tuple[str, np.ndarray, str, dict, Optional[int]]]:
+        """Filas en el formato de build: (point_id, vector, texto, metadata, subject_id)."""
+        for subject, (start, end) in self.partitions.items():
+            for i in range(start, end):
+                yield self.ids[i], self.vectors[i], self.texts[i], self.metadatas[i], subject
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+
+    def search(self, query_vector: Sequence[float], subject_ids: Optional[Sequence[int]] = None, k: int = 5) -> List[LocalHit]:
+        """Los `k` chunks más similares (coseno) dentro de las materias indicadas."""
+        if not self.ids or k <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+        if subject_ids:
+            ranges = [self.partitions[s] for s in dict.fromkeys(subject_ids) if s in self.partitions]
+        else:
+            ranges = [(0, len(self.ids))]
+        if not ranges:
+            return []
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            scores = self.vectors[start:end] @ query
+            rows = None
+        else:
+            scores = np.concatenate([self.vectors[start:end] @ query for start, end in ranges])
+            rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        hits = []
+        for i in top:
+            row = int(rows[i]) if rows is not None else ranges[0][0] + int(i)
+            hits.append(LocalHit(self.ids[row], float(scores[i]), self.texts[row], self.metadatas[row]))
+        return hits
+
+    def save(self, vectors_path: str, meta_path: str) -> None:
+        os.makedirs(os.path.dirname(vectors_path) or ".", exist_ok=True)
+        tmp = vectors_path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        os.replace(tmp, vectors_path)
+        data = {
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "partitions": [[subject, start, end] for subject, (start, end) in self.partitions.items()],
+        }
+        tmp = meta_path + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, meta_path)
+
+    @classmethod
+    def load(cls, vectors_path: str, meta_path: str, mmap: bool = True) -> "LocalVectorIndex":
+        """Con mmap=False la matriz se lee a memoria (p. ej. para reescribir el archivo)."""
+        with gzip.open(meta_path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        vectors = np.load(vectors_path, mmap_mode="r" if mmap else None)
+        if vectors.shape[0] != len(data["ids"]):
+            raise ValueError(f"{vectors_path} tiene {vectors.shape[0]} filas y {meta_path} {len(data['ids'])} ids")
+        partitions = {subject: (start, end) for subject, start, end in data["partitions"]}
+        return cls(vectors, data["ids"], data["texts"], data["metadatas"], partitions)
+
+
+class LocalVectorStore:
+    """
+    Adaptador con la interfaz de búsqueda del vectorstore de langchain que usa
+    hybrid_search.py; entiende el filtro por subject_id que arma el tutor.
+    """
+
+    def __init__(self, index: LocalVectorIndex, collection: str, embeddings=None):
+        self.index = index
+        self.collection = collection
+        self.embeddings = embeddings
+
+    def similarity_search_by_vector(self, embedding: Sequence[float], k: int = 4, filter=None,
+                                    **kwargs) -> List[Document]:
+        hits = self.index.search(embedding, subject_ids_from_filter(filter), k)
+        return [
+            Document(page_content=hit.page_content,
+                     metadata={**hit.metadata, '_id': hit.point_id, '_collection_name': self.collection})
+            for hit in hits
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, filter=None, **kwargs) -> List[Document]:
+        if self.embeddings is None:
+            raise ValueError("LocalVectorStore sin embeddings: usa similarity_search_by_vector")
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k, filter=filter)
+
+
+def index_paths(collection: str) -> Tuple[str, str]:
+    base = os.path.join(LOCAL_INDEX_DIR, collection)
+    return base + ".npy", base + ".local.json.gz"
+
+
+def build_from_qdrant(client, collections: Union[str, Sequence[str]], batch_size: int = 1000) -> LocalVectorIndex:
+    """
+    Construye el índice recorriendo los puntos, con sus vectores, de la
+    colección o de las colecciones por materia (subject_sharding.py).
+    """
+    def documents():
+        for collection in ([collections] if isinstance(collections, str) else collections):
+            offset = None
+            while True:
+                points, offset = client.scroll(
+                    collection_name=collection,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=True,
+                )
+                for point in points:
+                    payload = point.payload or {}
+                    yield (str(point.id), point.vector, payload.get("page_content", ""),
+                           payload.get("metadata") or {}, payload.get("subject_id"))
+                if offset is None:
+                    break
+    return LocalVectorIndex.build(documents())
+
+
+# Índices cargados por proceso: colección -> (mtime, tamaño, índice)
+_loaded: Dict[str, Tuple[float, int, LocalVectorIndex]] = {}
+_missing_warned = set()
+_lock = threading.Lock()
+
+
+def get_local_index(collection: str) -> Optional[LocalVectorIndex]:
+    """Índice de la colección (se recarga si la ingesta lo reescribió), o None si no existe."""
+    vectors_path, meta_path = index_paths(collection)
+    try:
+        stat = os.stat(meta_path)
+    except OSError:
+        if collection not in _missing_warned:
+            _missing_warned.add(collection)
+            logger.warning("Sin índice vectorial local para %s (%s); se usa Qdrant. "
+                           "Ejecuta ingest_pipeline.py --rebuild-local", collection, meta_path)
+        return None
+    cached = _loaded.get(collection)
+    if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    with _lock:
+        cached = _loaded.get(collection)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        try:
+            index = LocalVectorIndex.load(vectors_path, meta_path)
+        except (OSError, ValueError) as e:
+            # Reescritura en curso: se sigue con la versión anterior si la hay
+            logger.warning("No se pudo cargar el índice vectorial local de %s: %s", collection, e)
+            return cached[2] if cached is not None else None
+        _loaded[collection] = (stat.st_mtime, stat.st_size, index)
+        _missing_warned.discard(collection)
+        logger.info("Índice vectorial local cargado",
+                    extra={'fields': {'collection': collection, 'documents': len(index), 'dim': index.dim}})
+        return index
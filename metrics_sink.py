@@ -0,0 +1,157 @@
+# metrics_sink.py
+"""
+Escritor asíncrono y por lotes de chat_metrics.
+
+El camino de la petición solo encola la fila (put_nowait en una cola
+acotada). Un hilo de fondo la vuelca con un INSERT multi-fila
+(execute_values) cuando se juntan METRICS_BATCH_SIZE filas o pasan
+METRICS_FLUSH_INTERVAL segundos, y drena lo pendiente al apagar el proceso.
+Si la cola está llena la fila se descarta y se contabiliza en `dropped`.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+from psycopg2.extras import execute_values
+
+from app_logging import get_logger
+from db import get_conn
+
+METRICS_QUEUE_SIZE = int(os.getenv("METRICS_QUEUE_SIZE", "10000"))
+METRICS_BATCH_SIZE = int(os.getenv("METRICS_BATCH_SIZE", "100"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "2.0"))
+
+logger = get_logger(__name__)
+
+METRIC_COLUMNS = (
+    'user_id',
+    'subject_id',
+    'backend',
+    'model',
+    'prompt_tokens',
+    'completion_tokens',
+    'total_tokens',
+    'latency_ms',
+    'ttft_ms',
+    'cache_hit',
+    'embed_ms',
+    'retrieval_ms',
+    'subject_context_ms',
+    'prompt_ms',
+    'tokenize_ms',
+    'queue_ms',
+)
+
+# Etapa de tracing.py -> columna de chat_metrics con su duración en ms
+STAGE_COLUMNS = {
+    'embed': 'embed_ms',
+    'retrieval': 'retrieval_ms',
+    'subject_context': 'subject_context_ms',
+    'prompt': 'prompt_ms',
+    'tokenize': 'tokenize_ms',
+    'llm_queue': 'queue_ms',
+}
+
+
+class MetricsSink:
+    def __init__(self, maxsize: int = METRICS_QUEUE_SIZE, batch_size: int = METRICS_BATCH_SIZE,
+                 flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def record(self, **values) -> bool:
+        """Encola una fila de métricas sin bloquear. Devuelve False si se descartó."""
+        self._ensure_worker()
+        row = tuple(values.get(col) for col in METRIC_COLUMNS)
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _ensure_worker(self) -> None:
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="chat-metrics-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self._flush(batch)
+            if self._stop.is_set() and self._queue.empty():
+                return
+
+    def _flush(self, batch) -> None:
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    execute_values(
+                        cur,
+                        f"INSERT INTO chat_metrics ({', '.join(METRIC_COLUMNS)}) VALUES %s",
+                        batch,
+                        page_size=self.batch_size,
+                    )
+                conn.commit()
+            with self._lock:
+                self.written += len(batch)
+                self.flushes += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            logger.warning("No se pudo registrar lote de métricas: %s", e, extra={'fields': {'rows': len(batch)}})
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """Detiene el hilo tras drenar la cola (como máximo `timeout` segundos)."""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'flushes': self.flushes,
+            }
+
+
+metrics_sink = MetricsSink()
+atexit.register(metrics_sink.shutdown)
@@ -1,22 +1,15 @@
 """
 Script para poblar la base de datos PostgreSQL con datos ficticios de estudiantes, materias y matrículas.
 """
-import psycopg2
-
-PG_HOST = "localhost"
-PG_PORT = 5432
-PG_DB = "tutor_db"
-PG_USER = "tutor_user"
-PG_PASSWORD = "tutor_pass"
+from db import get_conn
 
 def populate_db():
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        port=PG_PORT,
-        dbname=PG_DB,
-        user=PG_USER,
-        password=PG_PASSWORD
-    )
+    with get_conn() as conn:
+        _insert_demo_data(conn)
+    print("Base de datos poblada con datos ficticios.")
+
+
+def _insert_demo_data(conn):
     cur = conn.cursor()
 
     # Poblar tabla students
@@ -150,8 +143,6 @@ def populate_db():
 
     conn.commit()
     cur.close()
-    conn.close()
-    print("Base de datos poblada con datos ficticios.")
 
 if __name__ == "__main__":
     populate_db()
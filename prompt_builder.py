@@ -0,0 +1,262 @@
+# prompt_builder.py
+"""
+Armado del prompt del tutor con presupuesto de tokens.
+
+Cada modelo tiene un presupuesto de tokens de prompt (PROMPT_TOKEN_BUDGET,
+con excepciones por modelo en PROMPT_TOKEN_BUDGETS="modelo=tokens,...").
+Las instrucciones fijas y la pregunta siempre entran; el resto se reparte
+por prioridad entre secciones:
+
+    chunks recuperados > historial > contexto de la materia > perfil
+
+Primero cada sección recibe como máximo su cuota (PROMPT_SECTION_SHARES) y
+luego el sobrante se redistribuye en orden de prioridad. Los chunks entran
+enteros por orden de relevancia (el último puede recortarse), el historial
+entra de la interacción más reciente a la más antigua, y el contexto de la
+materia y el perfil se recortan por tokens.
+
+Antes de repartir, los chunks se deduplican: el splitter de la ingesta los
+solapa (CHUNK_OVERLAP), así que se descartan los repetidos o contenidos en
+otro y se recorta el solape entre fragmentos contiguos.
+"""
+
+import os
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from token_accounting import count_static_tokens, count_tokens, truncate_tokens
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+PROMPT_TOKEN_BUDGETS = os.getenv("PROMPT_TOKEN_BUDGETS", "")
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "5"))
+# Solape mínimo (caracteres) entre chunks para considerarlo duplicado parcial
+MIN_CHUNK_OVERLAP = 20
+# Por debajo de esto no vale la pena incluir un chunk recortado
+MIN_PARTIAL_CHUNK_TOKENS = 40
+
+# Orden de prioridad y cuota máxima de la primera pasada (fracción del presupuesto libre)
+PROMPT_SECTION_SHARES = {
+    'chunks': 0.55,
+    'history': 0.25,
+    'subject_context': 0.12,
+    'profile': 0.08,
+}
+
+TEMPLATE = """{history}Contexto de la materia:
+{subject_context}
+
+Material de referencia (fragmentos relevantes):
+{chunks}
+
+Pregunta del estudiante:
+{question}
+
+Perfil del estudiante:
+{profile}
+"""
+
+
+class PromptPlan(NamedTuple):
+    prompt: str
+    budget: int
+    # Tokens usados por sección (system, template, question, chunks, history, subject_context, profile, total)
+    section_tokens: Dict[str, int]
+    chunks_used: int
+    chunks_deduped: int
+    turns_used: int
+
+
+def _parse_budgets(spec: str) -> Dict[str, int]:
+    budgets = {}
+    for item in spec.split(','):
+        model, sep, tokens = item.strip().rpartition('=')
+        if sep and model and tokens.strip().isdigit():
+            budgets[model.strip()] = int(tokens)
+    return budgets
+
+
+_MODEL_BUDGETS = _parse_budgets(PROMPT_TOKEN_BUDGETS)
+
+
+def token_budget(model: Optional[str]) -> int:
+    """Presupuesto de tokens de prompt para `model`."""
+    return _MODEL_BUDGETS.get(model or "", PROMPT_TOKEN_BUDGET)
+
+
+def _overlap(a: str, b: str) -> int:
+    """Longitud del sufijo más largo de `a` que es prefijo de `b` (0 si < MIN_CHUNK_OVERLAP)."""
+    probe = b[:MIN_CHUNK_OVERLAP]
+    if len(probe) < MIN_CHUNK_OVERLAP:
+        return 0
+    start = a.find(probe, max(0, len(a) - len(b)))
+    while start != -1:
+        if b.startswith(a[start:]):
+            return len(a) - start
+        start = a.find(probe, start + 1)
+    return 0
+
+
+def dedupe_chunks(texts: Sequence[str]) -> List[str]:
+    """
+    Conserva el orden de relevancia quitando chunks repetidos o contenidos en
+    otro ya elegido, y recorta el solape con los ya elegidos.
+    """
+    kept: List[str] = []
+    for text in texts:
+        text = text.strip()
+        if not text or any(text in k for k in kept):
+            continue
+        # Un chunk más largo que contiene a otros ya elegidos ocupa el lugar del primero
+        contained = [i for i, k in enumerate(kept) if k in text]
+        if contained:
+            position = contained[0]
+            kept = [k for i, k in enumerate(kept) if i not in contained]
+            kept.insert(position, text)
+            continue
+        for k in kept:
+            cut = _overlap(k, text)
+            if cut:
+                text = text[cut:].lstrip()
+            cut = _overlap(text, k)
+            if cut:
+                text = text[:len(text) - cut].rstrip()
+        if text:
+            kept.append(text)
+    return kept
+
+
+def _history_turn(msg: dict) -> str:
+    return f"Tú: {msg.get('user', '')}\nTutor: {msg.get('tutor', '')}\n"
+
+
+def _pack_chunks(chunks: Sequence[str], budget: int):
+    packed, used = [], 0
+    for text in chunks:
+        # El separador "\n---\n" cuesta ~2 tokens
+        tokens = count_tokens(text) + (2 if packed else 0)
+        if used + tokens <= budget:
+            packed.append(text)
+            used += tokens
+            continue
+        separator = 2 if packed else 0
+        remaining = budget - used - separator
+        if remaining >= MIN_PARTIAL_CHUNK_TOKENS:
+            packed.append(truncate_tokens(text, remaining))
+            used += separator + remaining
+        break
+    return "\n---\n".join(packed), len(packed), used
+
+
+def _summary_block(summary: str) -> str:
+    return f"Resumen de lo conversado: {summary}\n" if summary else ""
+
+
+def _pack_history(chat_history: Sequence[dict], budget: int, summary: str = ""):
+    header = "Historial de la conversación:\n"
+    header_tokens = count_tokens(header) + 1
+    if (not chat_history and not summary) or budget <= header_tokens:
+        return "", 0, 0
+    used = header_tokens
+    # El resumen (memoria del servidor) va primero; si no cabe todo, cede al
+    # menos la mitad del espacio a los turnos literales
+    summary_text = ""
+    if summary:
+        remaining = budget - used
+        turns_need = count_tokens("".join(_history_turn(m) for m in chat_history))
+        space = remaining - min(turns_need, remaining // 2)
+        # Se cuenta igual que en `needs` de build_prompt: el bloque completo
+        full_block = _summary_block(summary)
+        block_tokens = count_tokens(full_block)
+        if block_tokens <= space:
+            summary_text = full_block
+        else:
+            # Solo se recorta si de verdad no cabe, descontando una vez el encabezado
+            limit = space - (block_tokens - count_tokens(summary))
+            while limit > 0:
+                summary_text = _summary_block(truncate_tokens(summary, limit))
+                excess = count_tokens(summary_text) - space
+                if excess <= 0:
+                    break
+                summary_text, limit = "", limit - excess
+        used += count_tokens(summary_text)
+    turns = []
+    for msg in reversed(list(chat_history)[-HISTORY_MAX_TURNS:]):
+        turn = _history_turn(msg)
+        tokens = count_tokens(turn)
+        if used + tokens > budget:
+            if not turns and budget > used:
+                # Al menos la última interacción, recortada
+                turns.append(truncate_tokens(turn, budget - used).rstrip() + "\n")
+                used = budget
+            break
+        turns.append(turn)
+        used += tokens
+    return f"{header}{summary_text}{''.join(reversed(turns))}\n", len(turns), used
+
+
+def build_prompt(system_prompt: str, question: str, chunks: Sequence[str], subject_context: str,
+                 chat_history: Optional[Sequence[dict]], student_profile, budget: int,
+                 summary: str = "") -> PromptPlan:
+    """
+    Arma el prompt dentro de `budget` tokens y devuelve el plan con el uso por
+    sección. `summary` es el resumen de la conversación (conversation_memory.py),
+    que forma parte de la sección de historial junto con los turnos literales.
+    """
+    profile_text = str(student_profile) if student_profile else 'No disponible'
+    unique_chunks = dedupe_chunks(chunks)
+
+    fixed = {
+        'system': count_static_tokens(system_prompt),
+        'template': count_static_tokens(TEMPLATE.format(history="", subject_context="", chunks="", question="", profile="")),
+    }
+    # La pregunta nunca se descarta, pero no puede acaparar el presupuesto
+    question = truncate_tokens(question, max(1, budget // 4))
+    fixed['question'] = count_tokens(question)
+    available = max(0, budget - sum(fixed.values()))
+
+    history_turns = list(chat_history or [])[-HISTORY_MAX_TURNS:]
+    needs = {
+        'chunks': sum(count_tokens(c) + 2 for c in unique_chunks),
+        'history': (
+            count_tokens("".join(_history_turn(m) for m in history_turns))
+            + count_tokens(_summary_block(summary))
+            + count_tokens("Historial de la conversación:\n") + 1
+        ) if history_turns or summary else 0,
+        'subject_context': count_tokens(subject_context or ""),
+        'profile': count_tokens(profile_text),
+    }
+    # Primera pasada: cuota por sección; segunda: el sobrante por prioridad
+    alloc = {name: min(needs[name], int(available * share)) for name, share in PROMPT_SECTION_SHARES.items()}
+    leftover = available - sum(alloc.values())
+    for name in PROMPT_SECTION_SHARES:
+        extra = min(leftover, needs[name] - alloc[name])
+        alloc[name] += extra
+        leftover -= extra
+
+    chunks_text, chunks_used, chunks_tokens = _pack_chunks(unique_chunks, alloc['chunks'])
+    history_text, turns_used, history_tokens = _pack_history(history_turns, alloc['history'], summary)
+    subject_text = truncate_tokens(subject_context or "", alloc['subject_context'])
+    profile_out = truncate_tokens(profile_text, alloc['profile']) or 'No disponible'
+
+    prompt = system_prompt + TEMPLATE.format(
+        history=history_text,
+        subject_context=subject_text,
+        chunks=chunks_text,
+        question=question,
+        profile=profile_out,
+    )
+    section_tokens = {
+        **fixed,
+        'chunks': chunks_tokens,
+        'history': history_tokens,
+        'subject_context': count_tokens(subject_text),
+        'profile': count_tokens(profile_out),
+    }
+    section_tokens['total'] = sum(section_tokens.values())
+    return PromptPlan(
+        prompt=prompt,
+        budget=budget,
+        section_tokens=section_tokens,
+        chunks_used=chunks_used,
+        chunks_deduped=len(chunks) - len(unique_chunks),
+        turns_used=turns_used,
+    )
@@ -0,0 +1,197 @@
+# retrieval_cache.py
+"""
+Caché de dos niveles delante de la búsqueda en Qdrant.
+
+- Nivel 1: texto normalizado de la pregunta (minúsculas, espacios y signos
+  de apertura/cierre) -> embedding. Evita recalcular el embedding de las
+  preguntas populares repetidas.
+- Nivel 2: (bucket del embedding, colección, subject_ids, k) -> chunks
+  recuperados (id del punto y payload). Evita repetir la búsqueda para la
+  misma pregunta o una reformulación cercana aunque la respuesta final no se
+  reutilice (p. ej. con historial).
+
+El bucket son los signos de las primeras RETRIEVAL_CACHE_BUCKET_BITS
+componentes del embedding normalizado; además del bucket exacto se prueban
+los vecinos que invierten los RETRIEVAL_CACHE_PROBES bits menos seguros
+(componentes cercanas a 0). Los candidatos de esos buckets se puntúan con
+un solo producto matriz-vector (NumPy) y el mejor solo se usa si su
+similitud coseno con la consulta alcanza RETRIEVAL_CACHE_THRESHOLD.
+
+Ambos niveles tienen límite LRU y se vacían cuando cambia
+app_settings.collection_version (ingest_pipeline.py la incrementa al
+escribir en la colección).
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from itertools import combinations
+from typing import Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "1") == "1"
+RETRIEVAL_CACHE_QUESTIONS = int(os.getenv("RETRIEVAL_CACHE_QUESTIONS", "5000"))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "2000"))
+RETRIEVAL_CACHE_THRESHOLD = float(os.getenv("RETRIEVAL_CACHE_THRESHOLD", "0.97"))
+RETRIEVAL_CACHE_BUCKET_BITS = int(os.getenv("RETRIEVAL_CACHE_BUCKET_BITS", "16"))
+RETRIEVAL_CACHE_PROBES = int(os.getenv("RETRIEVAL_CACHE_PROBES", "2"))
+
+_EDGE_PUNCTUATION = "¿?¡!.,;: \t\n\"'"
+_SPACES = re.compile(r"\s+")
+
+ResultKey = Tuple[Hashable, str, frozenset, int]
+
+
+def normalize_question(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _SPACES.sub(" ", text).strip(_EDGE_PUNCTUATION)
+
+
+def _unit(vector: Sequence[float]) -> np.ndarray:
+    query = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(query))
+    return query / norm if norm else query
+
+
+class _Result:
+    __slots__ = ("key", "vector", "documents")
+
+    def __init__(self, key: ResultKey, vector: np.ndarray, documents: list):
+        self.key = key
+        self.vector = vector
+        self.documents = documents
+
+
+class RetrievalCache:
+    def __init__(self, max_questions: int = RETRIEVAL_CACHE_QUESTIONS, max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES,
+                 threshold: float = RETRIEVAL_CACHE_THRESHOLD, bucket_bits: int = RETRIEVAL_CACHE_BUCKET_BITS,
+                 probes: int = RETRIEVAL_CACHE_PROBES):
+        self.max_questions = max_questions
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.bucket_bits = bucket_bits
+        self.probes = probes
+        self._embeddings: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._results: "OrderedDict[int, _Result]" = OrderedDict()
+        self._keys: Dict[ResultKey, Set[int]] = {}
+        self._next_id = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, version) -> None:
+        if version != self._version:
+            self._embeddings.clear()
+            self._results.clear()
+            self._keys.clear()
+            self._version = version
+
+    # --- Nivel 1: pregunta -> embedding ---
+
+    def get_embedding(self, model: str, question: str, version=None) -> Optional[List[float]]:
+        key = (model, normalize_question(question))
+        with self._lock:
+            self._check_version(version)
+            vector = self._embeddings.get(key)
+            if vector is None:
+                self.embedding_misses += 1
+                return None
+            self._embeddings.move_to_end(key)
+            self.embedding_hits += 1
+            return vector
+
+    def put_embedding(self, model: str, question: str, vector: Sequence[float], version=None) -> None:
+        key = (model, normalize_question(question))
+        with self._lock:
+            self._check_version(version)
+            self._embeddings[key] = list(vector)
+            self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self.max_questions:
+                self._embeddings.popitem(last=False)
+
+    # --- Nivel 2: (bucket, colección, materias, k) -> chunks ---
+
+    def _buckets(self, vector: np.ndarray) -> List[int]:
+        head = vector[:self.bucket_bits]
+        bucket = sum(1 << int(i) for i in np.flatnonzero(head >= 0))
+        # Multi-probe: también los buckets con los bits menos seguros invertidos
+        uncertain = np.argsort(np.abs(head), kind="stable")[:self.probes].tolist()
+        buckets = [bucket]
+        for n in range(1, len(uncertain) + 1):
+            for bits in combinations(uncertain, n):
+                flipped = bucket
+                for i in bits:
+                    flipped ^= 1 << i
+                buckets.append(flipped)
+        return buckets
+
+    def get_results(self, vector: Sequence[float], collection: str, subject_ids: Sequence[int], k: int,
+                    version=None) -> Optional[list]:
+        """Chunks de una búsqueda previa equivalente, o None."""
+        query = _unit(vector)
+        scope = (collection, frozenset(subject_ids), k)
+        with self._lock:
+            self._check_version(version)
+            # Candidatos de todos los buckets probados (con la misma dimensión que la consulta)
+            candidates = [entry_id for bucket in self._buckets(query)
+                          for entry_id in self._keys.get((bucket,) + scope, ())
+                          if self._results[entry_id].vector.shape == query.shape]
+            best_id = None
+            if candidates:
+                scores = np.stack([self._results[entry_id].vector for entry_id in candidates]) @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    best_id = candidates[best]
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(best_id)
+            self.hits += 1
+            return list(self._results[best_id].documents)
+
+    def put_results(self, vector: Sequence[float], collection: str, subject_ids: Sequence[int], k: int,
+                    documents: Sequence, version=None) -> None:
+        query = _unit(vector)
+        key = (self._buckets(query)[0], collection, frozenset(subject_ids), k)
+        with self._lock:
+            self._check_version(version)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._results[entry_id] = _Result(key, query, list(documents))
+            self._keys.setdefault(key, set()).add(entry_id)
+            while len(self._results) > self.max_entries:
+                old_id, old = self._results.popitem(last=False)
+                ids = self._keys.get(old.key)
+                if ids is not None:
+                    ids.discard(old_id)
+                    if not ids:
+                        del self._keys[old.key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._embeddings.clear()
+            self._results.clear()
+            self._keys.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            embedding_total = self.embedding_hits + self.embedding_misses
+            total = self.hits + self.misses
+            return {
+                'questions': len(self._embeddings),
+                'embedding_hits': self.embedding_hits,
+                'embedding_hit_rate': round(self.embedding_hits / embedding_total, 3) if embedding_total else 0.0,
+                'entries': len(self._results),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+retrieval_cache = RetrievalCache()
@@ -0,0 +1,132 @@
+# retrieval_clients.py
+"""
+Registro por proceso de clientes de recuperación para el Tutor RAG.
+
+Mantiene instancias de larga vida de OllamaEmbeddings, QdrantClient y el
+vectorstore de langchain, indexadas por (qdrant_url, colección, modelo de
+embeddings). Cuando app_settings cambia (nueva URL o colección), la entrada
+anterior se retira y su cliente se cierra en cuanto deja de estar en uso.
+"""
+
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Dict, NamedTuple, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import Qdrant
+from langchain_ollama import OllamaEmbeddings
+from qdrant_client import QdrantClient
+
+from app_logging import get_logger
+from embedding_cache import with_embedding_cache
+
+
+logger = get_logger(__name__)
+
+RegistryKey = Tuple[str, str, str]
+
+
+class RetrievalClients(NamedTuple):
+    embeddings: Embeddings
+    client: QdrantClient
+    vectorstore: Qdrant
+
+
+class _Entry:
+    def __init__(self, clients: RetrievalClients):
+        self.clients = clients
+        self.leases = 0
+        self.retired = False
+
+
+_registry: Dict[RegistryKey, _Entry] = {}
+_lock = threading.Lock()
+
+
+def _build(key: RegistryKey) -> RetrievalClients:
+    qdrant_url, collection, embed_model = key
+    # Los embeddings de las preguntas pasan por la caché persistente (embedding_cache.py)
+    embeddings = with_embedding_cache(OllamaEmbeddings(model=embed_model), embed_model)
+    client = QdrantClient(url=qdrant_url)
+    vectorstore = Qdrant(
+        collection_name=collection,
+        client=client,
+        embeddings=embeddings,
+    )
+    return RetrievalClients(embeddings, client, vectorstore)
+
+
+def _close(entry: _Entry) -> None:
+    close = getattr(entry.clients.client, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        logger.warning("No se pudo cerrar el cliente Qdrant: %s", e)
+
+
+@contextmanager
+def lease_retrieval_clients(qdrant_url: str, collection: str, embed_model: str):
+    """
+    Entrega los clientes asociados a la clave, creándolos si no existen.
+    Las entradas con otra clave se consideran obsoletas (cambio de settings):
+    se retiran del registro y se cierran al liberarse su último préstamo.
+    """
+    key = (qdrant_url, collection, embed_model)
+    to_close = []
+    with _lock:
+        entry = _registry.get(key)
+        if entry is None:
+            for old_key in [k for k in _registry if k != key]:
+                old = _registry.pop(old_key)
+                old.retired = True
+                if old.leases == 0:
+                    to_close.append(old)
+            entry = _Entry(_build(key))
+            _registry[key] = entry
+        entry.leases += 1
+    for old in to_close:
+        _close(old)
+    try:
+        yield entry.clients
+    finally:
+        with _lock:
+            entry.leases -= 1
+            release = entry.retired and entry.leases == 0
+        if release:
+            _close(entry)
+
+
+def register_retrieval_clients(qdrant_url: str, collection: str, embed_model: str, clients: RetrievalClients) -> None:
+    """
+    Registra clientes ya construidos para la clave, en lugar de crearlos desde
+    la URL (p. ej. un QdrantClient(":memory:") en benchmarks sin servicios).
+    """
+    key = (qdrant_url, collection, embed_model)
+    with _lock:
+        old = _registry.get(key)
+        _registry[key] = _Entry(clients)
+        if old is not None:
+            old.retired = True
+            release = old.leases == 0
+        else:
+            release = False
+    if release:
+        _close(old)
+
+
+def close_all() -> None:
+    """Cierra todos los clientes registrados (apagado del proceso)."""
+    with _lock:
+        entries = list(_registry.values())
+        _registry.clear()
+        for entry in entries:
+            entry.retired = True
+    for entry in entries:
+        if entry.leases == 0:
+            _close(entry)
+
+
+atexit.register(close_all)
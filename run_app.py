@@ -1,5 +1,5 @@
 """
-Script de arranque para solo Flask (UI y chat nativo).
+Script de arranque para Flask (UI y chat nativo); con --asgi usa uvicorn y asgi_app.py.
 Conservado para compatibilidad local.
 """
 import subprocess
@@ -11,7 +11,17 @@ def run_flask():
     subprocess.run([sys.executable, "auth_app.py"])  # Arranca Flask en :5000
 
 
+def run_asgi():
+    # Chat asíncrono (asgi_app.py) + Flask montado para el resto de rutas
+    subprocess.run([sys.executable, "-m", "uvicorn", "asgi_app:app", "--port", "5000"])
+
+
 if __name__ == "__main__":
-    print("🚀 Iniciando Tutor Educativo (Flask UI)...")
-    print("📱 Flask: http://localhost:5000")
-    run_flask()
+    if "--asgi" in sys.argv:
+        print("🚀 Iniciando Tutor Educativo (ASGI, chat asíncrono)...")
+        print("📱 Uvicorn: http://localhost:5000")
+        run_asgi()
+    else:
+        print("🚀 Iniciando Tutor Educativo (Flask UI)...")
+        print("📱 Flask: http://localhost:5000")
+        run_flask()
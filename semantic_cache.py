@@ -0,0 +1,234 @@
+# semantic_cache.py
+"""
+Caché semántica de respuestas delante de la llamada al LLM.
+
+Una entrada guarda el embedding normalizado de la pregunta y la respuesta
+generada, agrupada por (backend, modelo, conjunto de subject_ids e idioma,
+curso y carrera del estudiante). Las respuestas cacheables se generan con
+ese perfil reducido (cacheable_profile), sin nombre ni email, para que
+puedan servirse a otros estudiantes del grupo. Una pregunta nueva reutiliza
+la respuesta si su similitud coseno con alguna entrada del mismo grupo
+supera SEMANTIC_CACHE_THRESHOLD; los vectores de cada grupo viven en una
+matriz NumPy y se puntúan con un solo producto.
+
+Dentro de una conversación (que se retoma sola) la caché aplica a las
+preguntas autónomas (is_standalone): las que no remiten al intercambio
+previo se responden sin historial, así que su respuesta vale para cualquier
+conversación. Las de seguimiento ("¿y eso por qué?", "dame otro ejemplo")
+no pasan por la caché y se cuentan en stats()['bypassed'].
+
+Expiración por TTL y desalojo LRU al superar SEMANTIC_CACHE_MAX_ENTRIES.
+Toda la caché se vacía cuando cambia app_settings.collection_version, que
+ingest_pipeline.py incrementa al reingestar la colección.
+"""
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from itertools import count
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+# Con historial, 0 desactiva la caché para todas las preguntas (no solo las de seguimiento)
+SEMANTIC_CACHE_STANDALONE = os.getenv("SEMANTIC_CACHE_STANDALONE", "1") == "1"
+# Menos palabras que esto ("¿por qué?", "otro ejemplo") se toma como seguimiento
+SEMANTIC_CACHE_MIN_WORDS = int(os.getenv("SEMANTIC_CACHE_MIN_WORDS", "3"))
+
+# Campos del perfil que cambian el prompt de una respuesta cacheable
+PROFILE_KEY_FIELDS = ('language', 'grade', 'career')
+
+GroupKey = Tuple[str, str, frozenset, tuple]
+
+# Expresiones (sin tildes) que remiten a lo ya conversado
+_FOLLOW_UP = re.compile(
+    r"^(y|pero|entonces|tambien|ademas)\b"
+    r"|\b(eso|esto|esa|ese|esos|esas|este|esta|estos|estas|ello|aquello|anterior|arriba|antes|mismo|misma|dijiste|explicaste"
+    r"|mencionaste|respuesta|otro|otra|otros|otras|mas detalle|no entendi|no entiendo|de nuevo|continua|sigue)\b"
+)
+_WORDS = re.compile(r"\w+")
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", (text or "").casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def is_standalone(question: str) -> bool:
+    """
+    Heurística conservadora: la pregunta se entiende sin el historial (no
+    usa deícticos ni remite a la respuesta anterior y tiene al menos
+    SEMANTIC_CACHE_MIN_WORDS palabras).
+    """
+    words = _WORDS.findall(_fold(question))
+    return len(words) >= SEMANTIC_CACHE_MIN_WORDS and not _FOLLOW_UP.search(" ".join(words))
+
+
+def _unit(vector: Sequence[float]) -> np.ndarray:
+    query = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(query))
+    return query / norm if norm else query
+
+
+class _Entry:
+    __slots__ = ("group", "row", "answer")
+
+    def __init__(self, group: GroupKey, row: int, answer: str):
+        self.group = group
+        self.row = row
+        self.answer = answer
+
+
+class _Group:
+    """Vectores de un grupo en una matriz (fila = entrada) para puntuarlos con un solo producto."""
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.expires = np.empty(capacity, dtype=np.float64)
+        self.ids: List[int] = []
+
+    def add(self, entry_id: int, vector: np.ndarray, expires_at: float) -> int:
+        row = len(self.ids)
+        if row == len(self.vectors):
+            self.vectors = np.concatenate([self.vectors, np.empty_like(self.vectors)])
+            self.expires = np.concatenate([self.expires, np.empty_like(self.expires)])
+        self.vectors[row] = vector
+        self.expires[row] = expires_at
+        self.ids.append(entry_id)
+        return row
+
+    def remove(self, row: int) -> Optional[int]:
+        """Quita la fila moviendo la última a su lugar; devuelve el id de la entrada movida."""
+        last = len(self.ids) - 1
+        moved = None
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.expires[row] = self.expires[last]
+            moved = self.ids[row] = self.ids[last]
+        self.ids.pop()
+        return moved
+
+
+def cacheable_profile(student_profile: Optional[dict]) -> dict:
+    """
+    Campos del perfil con los que se arma el prompt de una respuesta
+    cacheable. Sin nombre, email ni id: la respuesta puede servirse a otros
+    estudiantes con el mismo idioma, curso y carrera.
+    """
+    return {field: (student_profile or {}).get(field) for field in PROFILE_KEY_FIELDS}
+
+
+class SemanticCache:
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._groups: Dict[GroupKey, _Group] = {}
+        self._ids = count()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    @staticmethod
+    def group_key(backend: str, model: str, subject_ids: Iterable[int], student_profile: Optional[dict] = None) -> GroupKey:
+        profile = cacheable_profile(student_profile)
+        return (backend, model, frozenset(subject_ids), tuple(profile[field] for field in PROFILE_KEY_FIELDS))
+
+    def _check_version(self, version) -> None:
+        if version != self._version:
+            self._entries.clear()
+            self._groups.clear()
+            self._version = version
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        group = self._groups.get(entry.group)
+        if group is None:
+            return
+        moved = group.remove(entry.row)
+        if moved is not None:
+            self._entries[moved].row = entry.row
+        if not group.ids:
+            del self._groups[entry.group]
+
+    def lookup(self, vector: Sequence[float], group: GroupKey, version=None) -> Optional[str]:
+        """Respuesta cacheada más similar por encima del umbral, o None."""
+        query = _unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            entries = self._groups.get(group)
+            if entries is not None:
+                n = len(entries.ids)
+                for row in np.flatnonzero(entries.expires[:n] <= now)[::-1]:
+                    self._remove(entries.ids[row])
+            entries = self._groups.get(group)
+            best_id = None
+            if entries is not None and entries.vectors.shape[1] == len(query):
+                scores = entries.vectors[:len(entries.ids)] @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    best_id = entries.ids[best]
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id].answer
+
+    def bypass(self) -> None:
+        """Registra una pregunta de seguimiento que no pasó por la caché."""
+        with self._lock:
+            self.bypassed += 1
+
+    def store(self, vector: Sequence[float], group: GroupKey, answer: str, version=None) -> None:
+        if not answer:
+            return
+        with self._lock:
+            self._check_version(version)
+            query = _unit(vector)
+            entries = self._groups.get(group)
+            if entries is not None and entries.vectors.shape[1] != len(query):
+                # Cambió el modelo de embeddings: el grupo anterior ya no es comparable
+                for entry_id in list(entries.ids):
+                    self._remove(entry_id)
+                entries = None
+            if entries is None:
+                entries = self._groups[group] = _Group(len(query))
+            entry_id = next(self._ids)
+            row = entries.add(entry_id, query, time.monotonic() + self.ttl)
+            self._entries[entry_id] = _Entry(group, row, answer)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'bypassed': self.bypassed,
+                # Aciertos sobre todas las preguntas, incluidas las que no pasaron por la caché
+                'overall_hit_rate': round(self.hits / (total + self.bypassed), 3) if total + self.bypassed else 0.0,
+            }
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,131 @@
+# settings_cache.py
+"""
+Caché en proceso de la fila única de app_settings.
+
+Las lecturas en el camino caliente (cada chat y cada carga del admin) se
+sirven desde memoria durante SETTINGS_CACHE_TTL segundos. Un hilo de fondo
+escucha el canal de PostgreSQL `app_settings_changed` (LISTEN/NOTIFY,
+disparado por el trigger definido en db_schema.py) e invalida la caché de
+inmediato cuando cualquier proceso actualiza la fila.
+"""
+
+import os
+import select
+import threading
+import time
+
+import psycopg2
+
+from app_logging import get_logger
+from db import connection_kwargs, get_conn
+
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "30"))
+SETTINGS_CHANNEL = "app_settings_changed"
+
+logger = get_logger(__name__)
+
+SETTINGS_KEYS = ['llm_backend', 'llm_model', 'ollama_url', 'openai_base_url', 'qdrant_url', 'qdrant_collection', 'logging_enabled', 'collection_version', 'retrieval_backend']
+
+DEFAULT_SETTINGS = {
+    'llm_backend': 'ollama',
+    'llm_model': 'gemma3:4b',
+    'ollama_url': 'http://localhost:11434',
+    'openai_base_url': 'https://api.openai.com',
+    'qdrant_url': 'http://localhost:6333',
+    'qdrant_collection': 'tutor_demo',
+    'logging_enabled': True,
+    'collection_version': 0,
+    'retrieval_backend': 'qdrant',
+}
+
+_lock = threading.Lock()
+_cached = None
+_expires_at = 0.0
+_listener_pid = None
+
+
+def _fetch_settings() -> dict:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {', '.join(SETTINGS_KEYS)} FROM app_settings WHERE id=1;")
+            row = cur.fetchone()
+    if not row:
+        return dict(DEFAULT_SETTINGS)
+    settings = dict(zip(SETTINGS_KEYS, row))
+    # Columnas nulas (instalaciones antiguas) toman el valor por defecto
+    for key, value in DEFAULT_SETTINGS.items():
+        if settings.get(key) is None:
+            settings[key] = value
+    return settings
+
+
+def get_settings() -> dict:
+    """
+    Devuelve una copia de app_settings. Solo consulta la base de datos si la
+    entrada expiró o fue invalidada. Ante un error de conexión se usan los
+    valores por defecto (sin cachearlos).
+    """
+    global _cached, _expires_at
+    _ensure_listener()
+    now = time.monotonic()
+    with _lock:
+        if _cached is not None and now < _expires_at:
+            return dict(_cached)
+    try:
+        settings = _fetch_settings()
+    except Exception as e:
+        logger.warning("No se pudo leer app_settings, usando valores por defecto: %s", e)
+        return dict(DEFAULT_SETTINGS)
+    with _lock:
+        _cached = settings
+        _expires_at = time.monotonic() + SETTINGS_CACHE_TTL
+    return dict(settings)
+
+
+def invalidate_settings() -> None:
+    """Descarta la copia en memoria; la siguiente lectura irá a la base de datos."""
+    global _cached, _expires_at
+    with _lock:
+        _cached = None
+        _expires_at = 0.0
+
+
+def _listen_forever() -> None:
+    backoff = 1.0
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**connection_kwargs())
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {SETTINGS_CHANNEL};")
+            # Lo ocurrido mientras no escuchábamos no se notificó
+            invalidate_settings()
+            backoff = 1.0
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    invalidate_settings()
+        except Exception as e:
+            logger.warning("Listener de app_settings desconectado: %s", e)
+        finally:
+            if conn is not None and not conn.closed:
+                conn.close()
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 60.0)
+
+
+def _ensure_listener() -> None:
+    """Arranca (una vez por proceso) el hilo LISTEN; se rearranca tras un fork."""
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+    threading.Thread(target=_listen_forever, name="app-settings-listener", daemon=True).start()
@@ -0,0 +1,79 @@
+# stage_pipeline.py
+"""
+Ejecución de etapas con dependencias sobre un pool de hilos compartido.
+
+Cada etapa declara las etapas de las que depende; en cuanto sus dependencias
+terminan se lanza en el pool, de modo que las etapas independientes (búsqueda
+en Qdrant, consulta de la materia, historial...) corren en paralelo y el
+tiempo total se acerca al de la etapa más lenta en lugar de a la suma.
+Se registra el tiempo de cada etapa en milisegundos.
+"""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Callable, Dict, NamedTuple, Sequence, Tuple
+
+PROMPT_STAGE_WORKERS = int(os.getenv("PROMPT_STAGE_WORKERS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=PROMPT_STAGE_WORKERS, thread_name_prefix="prompt-stage")
+
+
+class Stage(NamedTuple):
+    name: str
+    fn: Callable
+    # fn recibe como argumentos posicionales los resultados de `deps`, en orden
+    deps: Tuple[str, ...] = ()
+
+
+def _timed(fn: Callable, args: Sequence):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, int((time.perf_counter() - start) * 1000)
+
+
+def run_stages(stages: Sequence[Stage], executor: ThreadPoolExecutor = None) -> Tuple[Dict[str, object], Dict[str, int]]:
+    """
+    Ejecuta las etapas respetando sus dependencias y devuelve
+    (resultados por etapa, milisegundos por etapa). El total de pared se
+    informa en la clave 'total'. La primera excepción de una etapa se propaga;
+    las etapas aún no lanzadas se descartan.
+    """
+    executor = executor or _executor
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [d for d in stage.deps if d not in by_name]
+        if missing:
+            raise ValueError(f"La etapa '{stage.name}' depende de etapas inexistentes: {missing}")
+
+    results: Dict[str, object] = {}
+    timings: Dict[str, int] = {}
+    pending = {stage.name for stage in stages}
+    running = {}
+    start = time.perf_counter()
+
+    def launch_ready():
+        for name in [n for n in pending if all(d in results for d in by_name[n].deps)]:
+            stage = by_name[name]
+            pending.discard(name)
+            # Cada etapa corre con una copia del contexto (traza activa de tracing.py)
+            running[executor.submit(copy_context().run, _timed, stage.fn, [results[d] for d in stage.deps])] = name
+
+    launch_ready()
+    if pending and not running:
+        raise ValueError(f"Dependencias circulares entre etapas: {sorted(pending)}")
+    try:
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], timings[name] = future.result()
+            launch_ready()
+            if pending and not running:
+                raise ValueError(f"Dependencias circulares entre etapas: {sorted(pending)}")
+    finally:
+        for future in running:
+            future.cancel()
+    timings['total'] = int((time.perf_counter() - start) * 1000)
+    return results, timings
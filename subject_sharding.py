@@ -0,0 +1,231 @@
+# subject_sharding.py
+"""
+Particionado de la colección por materia (QDRANT_SHARDING).
+
+Cada pregunta del tutor filtra por subject_id. En lugar de un HNSW filtrado
+sobre la colección completa, los chunks de cada materia pueden vivir en su
+propio índice:
+
+- none (por defecto): una sola colección; el filtro usa el índice de payload
+  de subject_id (collection_config.py).
+- collections: una colección por materia, <colección>__subject_<id>.
+- shard_keys: una colección con sharding personalizado y un shard key por
+  materia (Qdrant >= 1.7).
+
+ShardRouter lo usan la ingesta (upsert, borrado y colecciones a recorrer
+para los índices léxico y local) y el tutor (vectorstore que dirige la
+búsqueda densa a los shards de las materias consultadas y fusiona los
+resultados por puntaje). Ingesta y tutor deben usar el mismo valor.
+"""
+
+import os
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+from qdrant_client.models import FieldCondition, Filter, MatchAny, MatchValue, PointIdsList, PointStruct
+
+from app_logging import get_logger
+from collection_config import (SUBJECT_FIELD, CollectionConfig, provision_collection,
+                               search_params as default_search_params)
+
+QDRANT_SHARDING = os.getenv("QDRANT_SHARDING", "none")
+# Cada cuánto el tutor vuelve a listar las colecciones o shard keys existentes
+SHARD_REFRESH_SECONDS = float(os.getenv("SHARD_REFRESH_SECONDS", "60"))
+SHARDING_MODES = ("none", "collections", "shard_keys")
+
+logger = get_logger(__name__)
+
+
+def subject_filter(subject_ids: Sequence[int]) -> Filter:
+    """
+    Filtro nativo de Qdrant por subject_id en la raíz del payload. Un dict
+    {"must": [...]} no sirve: langchain_qdrant lo traduce a condiciones sobre
+    metadata.must[], que no coinciden con nada, y no usaría el índice de
+    payload de collection_config.py.
+    """
+    match = MatchValue(value=subject_ids[0]) if len(subject_ids) == 1 else MatchAny(any=list(subject_ids))
+    return Filter(must=[FieldCondition(key=SUBJECT_FIELD, match=match)])
+
+
+def subject_ids_from_filter(filter: Optional[Filter]) -> Optional[List[int]]:
+    """subject_ids del filtro que arma el tutor (subject_filter), o None si no filtra por materia."""
+    for condition in (filter.must or []) if filter is not None else []:
+        if getattr(condition, "key", None) == SUBJECT_FIELD:
+            match = condition.match
+            return list(match.any) if isinstance(match, MatchAny) else [match.value]
+    return None
+
+
+def shard_collection(collection: str, subject_id) -> str:
+    suffix = "none" if subject_id is None else subject_id
+    return f"{collection}__subject_{suffix}"
+
+
+class ShardRouter:
+    def __init__(self, client, collection: str, mode: str = QDRANT_SHARDING, config: Optional[CollectionConfig] = None):
+        if mode not in SHARDING_MODES:
+            raise ValueError(f"QDRANT_SHARDING desconocido: {mode!r} ({', '.join(SHARDING_MODES)})")
+        self.client = client
+        self.collection = collection
+        self.mode = mode
+        self.config = config
+        self._provisioned = set()
+        self._keys = set()
+        self._targets = frozenset()
+        self._targets_at = float("-inf")
+
+    def collections(self) -> List[str]:
+        """Colecciones existentes que guardan los chunks de esta colección lógica."""
+        if self.mode == "collections":
+            prefix = shard_collection(self.collection, "")
+            return sorted(c.name for c in self.client.get_collections().collections if c.name.startswith(prefix))
+        return [self.collection] if self.client.collection_exists(self.collection) else []
+
+    def shard_keys(self) -> List:
+        info = self.client.collection_cluster_info(self.collection)
+        return sorted({s.shard_key for s in list(info.local_shards) + list(info.remote_shards) if s.shard_key is not None})
+
+    # --- Ingesta ---
+
+    def _ensure(self, name: str, vector_size: int) -> None:
+        if name in self._provisioned:
+            return
+        config = self.config or CollectionConfig()
+        if self.mode == "collections":
+            # Cada colección tiene una sola materia: el índice de subject_id no aporta
+            config = config._replace(subject_index="none")
+        if provision_collection(self.client, name, vector_size, config, custom_sharding=self.mode == "shard_keys"):
+            logger.info("Colección creada", extra={'fields': {'collection': name, 'sharding': self.mode}})
+        self._provisioned.add(name)
+        if self.mode == "shard_keys":
+            self._keys = set(self.shard_keys())
+
+    def _ensure_shard_key(self, subject_id) -> None:
+        if subject_id not in self._keys:
+            self.client.create_shard_key(self.collection, subject_id)
+            self._keys.add(subject_id)
+
+    def upsert(self, points: Sequence[PointStruct], vector_size: int) -> None:
+        """Escribe los puntos en el shard de su materia (payload subject_id)."""
+        if self.mode == "none":
+            self._ensure(self.collection, vector_size)
+            self.client.upsert(collection_name=self.collection, points=list(points))
+            return
+        by_subject: Dict[object, List[PointStruct]] = {}
+        for point in points:
+            by_subject.setdefault((point.payload or {}).get("subject_id"), []).append(point)
+        for subject_id, group in by_subject.items():
+            if self.mode == "collections":
+                name = shard_collection(self.collection, subject_id)
+                self._ensure(name, vector_size)
+                self.client.upsert(collection_name=name, points=group)
+            else:
+                if subject_id is None:
+                    raise ValueError("QDRANT_SHARDING=shard_keys requiere subject_id en todos los chunks")
+                self._ensure(self.collection, vector_size)
+                self._ensure_shard_key(subject_id)
+                self.client.upsert(collection_name=self.collection, points=group, shard_key_selector=subject_id)
+
+    def delete(self, ids: Sequence[str], batch_size: int = 1000) -> None:
+        """Borra los puntos de todos los shards (los ids no guardan la materia)."""
+        if not ids:
+            return
+        targets = self.collections()
+        keys = self.shard_keys() if self.mode == "shard_keys" and targets else None
+        for name in targets:
+            for start in range(0, len(ids), batch_size):
+                selector = PointIdsList(points=list(ids[start:start + batch_size]))
+                if keys:
+                    self.client.delete(collection_name=name, points_selector=selector, shard_key_selector=keys)
+                else:
+                    self.client.delete(collection_name=name, points_selector=selector)
+
+    def drop(self) -> None:
+        for name in self.collections():
+            self.client.delete_collection(name)
+        self._provisioned.clear()
+        self._keys.clear()
+
+    # --- Búsqueda ---
+
+    def targets(self) -> frozenset:
+        """Colecciones (collections) o shard keys (shard_keys) existentes, con caché de SHARD_REFRESH_SECONDS."""
+        now = time.monotonic()
+        if now - self._targets_at >= SHARD_REFRESH_SECONDS:
+            if self.mode == "collections":
+                self._targets = frozenset(self.collections())
+            elif self.client.collection_exists(self.collection):
+                self._targets = frozenset(self.shard_keys())
+            else:
+                self._targets = frozenset()
+            self._targets_at = now
+        return self._targets
+
+    def vectorstore(self, default_vectorstore, embeddings=None):
+        """Vectorstore del tutor: el de langchain sin particionado, o uno que enruta por materia."""
+        if self.mode == "none":
+            return default_vectorstore
+        return ShardedVectorStore(self, embeddings)
+
+
+class ShardedVectorStore:
+    """
+    Adaptador con la interfaz de búsqueda del vectorstore de langchain que usa
+    hybrid_search.py: cada materia del filtro se busca en su shard y los
+    resultados se fusionan por puntaje (misma métrica coseno en todos).
+    """
+
+    def __init__(self, router: ShardRouter, embeddings=None):
+        self.router = router
+        self.embeddings = embeddings
+
+    def _query(self, name: str, embedding, k: int, params, **kwargs):
+        return self.router.client.query_points(collection_name=name, query=list(embedding), limit=k,
+                                               search_params=params, with_payload=True, **kwargs).points
+
+    def similarity_search_by_vector(self, embedding: Sequence[float], k: int = 4, filter: Optional[Filter] = None,
+                                    search_params=None, **kwargs) -> List[Document]:
+        router = self.router
+        subject_ids = subject_ids_from_filter(filter)
+        params = search_params if search_params is not None else default_search_params()
+        existing = router.targets()
+        scored = []
+        if router.mode == "shard_keys":
+            keys = [s for s in subject_ids if s in existing] if subject_ids else sorted(existing)
+            if keys:
+                scored = [(p.score, router.collection, p)
+                          for p in self._query(router.collection, embedding, k, params, shard_key_selector=keys)]
+        else:
+            names = [shard_collection(router.collection, s) for s in subject_ids] if subject_ids else sorted(existing)
+            for name in names:
+                if name in existing:
+                    scored.extend((p.score, name, p) for p in self._query(name, embedding, k, params))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [
+            Document(page_content=(point.payload or {}).get("page_content", ""),
+                     metadata={**((point.payload or {}).get("metadata") or {}), '_id': str(point.id),
+                               '_collection_name': name})
+            for _, name, point in scored[:k]
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Filter] = None, **kwargs) -> List[Document]:
+        if self.embeddings is None:
+            raise ValueError("ShardedVectorStore sin embeddings: usa similarity_search_by_vector")
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k, filter=filter, **kwargs)
+
+
+# Un router por (cliente, colección) para conservar la caché de shards entre preguntas
+_routers: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def get_router(client, collection: str) -> ShardRouter:
+    with _lock:
+        per_client = _routers.setdefault(client, {})
+        router = per_client.get(collection)
+        if router is None:
+            router = per_client[collection] = ShardRouter(client, collection)
+        return router
@@ -0,0 +1,86 @@
+# tests/test_embedding_cache.py
+import embedding_cache
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 0.5] for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def last_used(cache, text):
+    row = cache._connection().execute(
+        "SELECT last_used FROM embeddings WHERE text_hash = ?", (embedding_cache.text_hash(text),)).fetchone()
+    return row and row[0]
+
+
+def test_only_missing_texts_are_computed_once_and_persisted(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    inner = CountingEmbedder()
+    embeddings = CachedEmbeddings(inner, "m", EmbeddingCache(path))
+    assert embeddings.embed_documents(["ab", "abc", "ab"]) == [[2.0, 0.5], [3.0, 0.5], [2.0, 0.5]]
+    assert embeddings.embed_batch(["abc", "abcd"]) == [[3.0, 0.5], [4.0, 0.5]]
+    assert inner.calls == [["ab", "abc"], ["abcd"]]
+
+    # Otra instancia (otro proceso) sobre el mismo archivo; la clave incluye el modelo
+    cache = EmbeddingCache(path)
+    assert cache.get_many("m", ["abcd", "zz"]) == [[4.0, 0.5], None]
+    assert cache.get_many("otro", ["abcd"]) == [None]
+    assert CachedEmbeddings(inner, "m", cache).embed_query("ab") == [2.0, 0.5]
+    assert len(inner.calls) == 2
+    assert cache.stats()['entries'] == 3
+
+
+def test_hits_are_touched_in_batches(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: now[0])
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), touch_batch=3, touch_interval=3600)
+    cache.put_many("m", ["a", "b", "c"], [[1.0]] * 3)
+    now[0] = 2000.0
+    cache.get_many("m", ["a", "b"])
+    assert (cache.stats()['pending_touches'], cache.stats()['touch_flushes']) == (2, 0)
+    assert last_used(cache, "a") == 1000.0
+    cache.get_many("m", ["c"])
+    assert (cache.stats()['pending_touches'], cache.stats()['touch_flushes']) == (0, 1)
+    assert last_used(cache, "a") == last_used(cache, "c") == 2000.0
+
+    now[0] = 3000.0
+    cache.get_many("m", ["b"])
+    cache.flush()
+    assert last_used(cache, "b") == 3000.0
+
+
+def test_eviction_drops_least_recently_used(tmp_path, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: now[0])
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=10, touch_batch=1000)
+    for i in range(10):
+        now[0] = float(i)
+        cache.put_many("m", [f"t{i}"], [[float(i)]])
+    now[0] = 100.0
+    # El acierto pendiente se vuelca en el mismo commit que la escritura siguiente
+    cache.get_many("m", ["t0"])
+    cache.put_many("m", ["nuevo"], [[1.0]])
+    stats = cache.stats()
+    assert stats['entries'] == 9 and stats['evictions'] == 2
+    assert cache.get_many("m", ["t0", "t1", "t2", "t3", "nuevo"]) == [[0.0], None, None, [3.0], [1.0]]
+
+
+def test_connection_is_lazy_and_reopened_after_fork(tmp_path, monkeypatch):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), touch_batch=1000)
+    assert cache._conn is None and not (tmp_path / "cache.sqlite").exists()
+    cache.put_many("m", ["a"], [[1.0]])
+    cache.get_many("m", ["a"])
+    parent = cache._conn
+    monkeypatch.setattr(embedding_cache.os, "getpid", lambda: -1)
+    # El hijo no reutiliza la conexión ni las marcas pendientes del padre
+    assert cache.stats()['pending_touches'] == 0
+    assert cache._conn is not parent
+    assert cache.get_many("m", ["a"]) == [[1.0]]
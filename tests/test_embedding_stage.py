@@ -0,0 +1,111 @@
+# tests/test_embedding_stage.py
+import random
+import threading
+import time
+
+import pytest
+import requests
+
+import embedding_stage
+from embedding_stage import OllamaBatchEmbedder, run_embedding_pipeline
+
+
+class SlowEmbedder:
+    """Tarda un tiempo aleatorio por lote, así que los lotes terminan desordenados."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = 0
+
+    def embed_batch(self, texts):
+        with self.lock:
+            self.started += 1
+        time.sleep(random.uniform(0, 0.01))
+        return [[float(t), 1.0] for t in texts]
+
+
+def test_batches_are_written_in_order_with_their_vectors():
+    written = []
+    stats = run_embedding_pipeline(list(range(23)), str, SlowEmbedder(), lambda batch, vectors: written.append((batch, vectors)),
+                                   batch_size=5, concurrency=3)
+    assert [batch for batch, _ in written] == [list(range(i, min(i + 5, 23))) for i in range(0, 23, 5)]
+    assert all(vectors == [[float(i), 1.0] for i in batch] for batch, vectors in written)
+    assert (stats['items'], stats['batches']) == (23, 5)
+    assert run_embedding_pipeline([], str, SlowEmbedder(), lambda batch, vectors: None)['batches'] == 0
+
+
+def test_slow_writes_bound_the_batches_in_flight():
+    embedder = SlowEmbedder()
+    written = []
+    backlog = []
+
+    def write(batch, vectors):
+        # Lotes enviados a embeber que aún no terminaron de escribirse
+        backlog.append(embedder.started - len(written))
+        time.sleep(0.005)
+        written.append(batch)
+
+    run_embedding_pipeline(list(range(60)), str, embedder, write, batch_size=2, concurrency=2)
+    assert len(written) == 30
+    # 2 * concurrency en vuelo más el que se está escribiendo
+    assert max(backlog) <= 2 * 2 + 1
+
+
+def test_embedding_errors_propagate():
+    class Failing:
+        def embed_batch(self, texts):
+            raise RuntimeError("Ollama caído")
+
+    with pytest.raises(RuntimeError):
+        run_embedding_pipeline(list(range(10)), str, Failing(), lambda batch, vectors: None, batch_size=2, concurrency=2)
+
+
+class FakeResponse:
+    def __init__(self, status_code, embeddings=None):
+        self.status_code = status_code
+        self.reason = "error"
+        self.embeddings = embeddings
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code), response=self)
+
+    def json(self):
+        return {"embeddings": self.embeddings}
+
+
+def fake_embedder(monkeypatch, responses):
+    monkeypatch.setattr(embedding_stage.time, "sleep", lambda seconds: None)
+    embedder = OllamaBatchEmbedder("m", max_retries=2)
+    calls = []
+
+    class Session:
+        def post(self, url, json, timeout):
+            calls.append(json)
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+    monkeypatch.setattr(embedder, "_session", lambda: Session())
+    return embedder, calls
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    embedder, calls = fake_embedder(monkeypatch, [
+        requests.ConnectionError("sin conexión"), FakeResponse(503), FakeResponse(200, [[0.1], [0.2]]),
+    ])
+    assert embedder.embed_batch(["a", "b"]) == [[0.1], [0.2]]
+    assert len(calls) == 3 and calls[0] == {"model": "m", "input": ["a", "b"]}
+
+
+def test_client_errors_and_exhausted_retries_raise(monkeypatch):
+    embedder, calls = fake_embedder(monkeypatch, [FakeResponse(400)])
+    with pytest.raises(requests.HTTPError):
+        embedder.embed_batch(["a"])
+    assert len(calls) == 1
+
+    embedder, calls = fake_embedder(monkeypatch, [FakeResponse(429)] * 3)
+    with pytest.raises(requests.HTTPError):
+        embedder.embed_batch(["a"])
+    assert len(calls) == 3
@@ -0,0 +1,85 @@
+# tests/test_hybrid_search.py
+import pytest
+from langchain_core.documents import Document
+
+import hybrid_search
+from hybrid_search import _parse_weights, fuse, reciprocal_rank_fusion
+from lexical_index import LexicalHit, LexicalIndex, tokenize
+
+
+@pytest.fixture
+def index():
+    return LexicalIndex.build([
+        ("1", "El artículo 14 garantiza la libertad de expresión.", {"source": "a"}, 1),
+        ("2", "La libertad de prensa y la libertad de expresión en la constitución.", {"source": "b"}, 1),
+        ("3", "Derivadas parciales y gradiente.", {"source": "c"}, 2),
+        ("4", "Artículo 14 del reglamento de cálculo.", {"source": "d"}, 2),
+    ])
+
+
+def doc(point_id, text="texto"):
+    return Document(page_content=text, metadata={'_id': point_id})
+
+
+def test_rrf_rewards_documents_found_by_both_searches():
+    fused = reciprocal_rank_fusion([(["a", "b", "c"], 1.0), (["c", "d"], 1.0)], k=60)
+    assert [doc_id for doc_id, _ in fused][0] == "c"
+    assert dict(fused)["c"] == pytest.approx(1 / 63 + 1 / 61)
+    # Con peso 0 la lista léxica no cambia el orden de la densa
+    fused = reciprocal_rank_fusion([(["a", "b"], 1.0), (["b", "x"], 0.0)], k=60)
+    assert [doc_id for doc_id, _ in fused][:2] == ["a", "b"]
+
+
+def test_fuse_merges_by_point_id_and_keeps_k():
+    dense = [doc("1", "denso"), doc("2")]
+    lexical = [LexicalHit("3", 5.0, "léxico", {"source": "c"}), LexicalHit("1", 4.0, "otro texto", {})]
+    fused = fuse(dense, lexical, 1.0, k=3)
+    # "1" está en ambas listas; el primero léxico supera al segundo denso
+    assert [d.metadata['_id'] for d in fused] == ["1", "3", "2"]
+    assert fused[0].page_content == "denso"
+    assert fused[1].metadata == {"source": "c", '_id': "3"} and fused[1].page_content == "léxico"
+    assert [d.metadata['_id'] for d in fuse(dense, lexical, 0.5, k=2)] == ["1", "2"]
+
+
+def test_subject_weights_are_averaged(monkeypatch):
+    assert _parse_weights("3=2.5, x=1, 4=,5=0") == {3: 2.5, 5: 0.0}
+    monkeypatch.setattr(hybrid_search, "_SUBJECT_WEIGHTS", {3: 2.0, 5: 0.0})
+    monkeypatch.setattr(hybrid_search, "HYBRID_LEXICAL_WEIGHT", 1.0)
+    assert hybrid_search.lexical_weight([3, 5]) == 1.0
+    assert hybrid_search.lexical_weight([3, 7]) == 1.5
+    assert hybrid_search.lexical_weight([]) == 1.0
+
+
+def test_bm25_matches_exact_terms_within_subjects(index, tmp_path):
+    assert tokenize("¿Qué dice el Artículo 3 a los alumnos?") == ["dice", "articulo", "3", "alumnos"]
+    hits = index.search("artículo 14 libertad", [1])
+    assert [h.point_id for h in hits] == ["1", "2"]
+    assert [h.point_id for h in index.search("artículo 14", [2])] == ["4"]
+    assert index.search("inexistente") == []
+    path = str(tmp_path / "lexical.json.gz")
+    index.save(path)
+    assert LexicalIndex.load(path).search("artículo 14 libertad", [1]) == hits
+
+
+class FakeVectorStore:
+    def __init__(self, docs):
+        self.docs = docs
+        self.calls = []
+
+    def similarity_search_by_vector(self, vector, k, filter=None, **kwargs):
+        self.calls.append((k, filter, kwargs))
+        return self.docs[:k]
+
+
+def test_hybrid_search_fuses_only_with_a_lexical_weight(index, monkeypatch):
+    monkeypatch.setattr(hybrid_search, "get_lexical_index", lambda collection: index)
+    monkeypatch.setattr(hybrid_search, "HYBRID_CANDIDATES", 10)
+    store = FakeVectorStore([doc("2"), doc("3")])
+    results = hybrid_search.hybrid_search(store, "artículo 14", [1], "filtro", "tutor", k=2, query_vector=[0.1], weight=1.0)
+    assert [d.metadata['_id'] for d in results] == ["2", "1"]
+    assert store.calls[-1] == (10, "filtro", {})
+
+    results = hybrid_search.hybrid_search(store, "artículo 14", [1], "filtro", "tutor", k=1, query_vector=[0.1],
+                                          weight=0.0, search_params="params")
+    assert [d.metadata['_id'] for d in results] == ["2"]
+    assert store.calls[-1] == (1, "filtro", {'search_params': "params"})
@@ -0,0 +1,123 @@
+# tests/test_ingest_pipeline.py
+import json
+
+import pytest
+from qdrant_client import QdrantClient
+
+import ingest_pipeline
+
+
+class FakeEmbedder:
+    """Vectores deterministas; falla en el lote número `fail_at` (desde 1)."""
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.batches = 0
+
+    def embed_batch(self, texts):
+        self.batches += 1
+        if self.batches == self.fail_at:
+            raise RuntimeError("Ollama caído")
+        return [[float(len(t) % 7 + 1), float(sum(map(ord, t)) % 11 + 1), 1.0] for t in texts]
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "Materia").mkdir()
+    for name in ("a.txt", "b.txt", "c.txt"):
+        (tmp_path / "Materia" / name).write_text(
+            "\n\n".join(f"{name} párrafo {i} " + "texto " * 40 for i in range(4)), encoding="utf-8")
+    client = QdrantClient(":memory:")
+    monkeypatch.setattr(ingest_pipeline, "SUBJECTS", {"Materia": {"subject_id": 1, "subject_name": "M", "language": "es"}})
+    monkeypatch.setattr(ingest_pipeline, "MANIFEST_PATH", str(tmp_path / "manifest.json"))
+    monkeypatch.setattr(ingest_pipeline, "QdrantClient", lambda url=None: client)
+    embedder = {"current": FakeEmbedder()}
+    monkeypatch.setattr(ingest_pipeline, "with_embedding_cache", lambda inner, model: embedder["current"])
+    return tmp_path, client, embedder
+
+
+def stored_ids(client):
+    points, _ = client.scroll(ingest_pipeline.QDRANT_COLLECTION, limit=1000)
+    return {str(p.id) for p in points}
+
+
+def manifest_ids(tmp_path):
+    data = json.loads((tmp_path / "manifest.json").read_text(encoding="utf-8"))
+    return {pid for entry in data["files"].values() for pid in entry["point_ids"]}, data
+
+
+def test_interrupted_run_records_only_finished_files_and_resumes(corpus):
+    tmp_path, client, embedder = corpus
+    embedder["current"] = FakeEmbedder(fail_at=2)
+    with pytest.raises(RuntimeError):
+        ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+    listed, data = manifest_ids(tmp_path)
+    # El manifiesto nunca lista puntos que no están en la colección
+    assert listed <= stored_ids(client)
+    assert len(data["files"]) < 3
+
+    embedder["current"] = FakeEmbedder()
+    assert ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+    listed, data = manifest_ids(tmp_path)
+    assert len(data["files"]) == 3
+    assert listed == stored_ids(client)
+
+
+def test_missing_manifest_is_replaced_by_an_empty_one_before_upserting(corpus):
+    tmp_path, client, embedder = corpus
+    ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+    (tmp_path / "manifest.json").unlink()
+    embedder["current"] = FakeEmbedder(fail_at=1)
+    with pytest.raises(RuntimeError):
+        ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+    listed, data = manifest_ids(tmp_path)
+    assert data["files"] == {} and listed == set()
+    assert not ingest_pipeline.ShardRouter(client, ingest_pipeline.QDRANT_COLLECTION).collections()
+
+
+def test_unchanged_run_is_a_no_op_and_removed_files_lose_their_points(corpus):
+    tmp_path, client, _ = corpus
+    ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+    assert not ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+    (tmp_path / "Materia" / "b.txt").unlink()
+    assert ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+    listed, data = manifest_ids(tmp_path)
+    assert sorted(data["files"]) == ["Materia/a.txt", "Materia/c.txt"]
+    assert listed == stored_ids(client)
+
+
+def local_index():
+    return ingest_pipeline.LocalVectorIndex.load(*ingest_pipeline.local_index_paths(ingest_pipeline.QDRANT_COLLECTION))
+
+
+def test_local_index_is_written_from_the_embedded_chunks(corpus, monkeypatch):
+    tmp_path, client, _ = corpus
+
+    def no_scroll(*args, **kwargs):
+        raise AssertionError("el índice local no debe leerse de Qdrant")
+
+    monkeypatch.setattr(ingest_pipeline, "build_local_from_qdrant", no_scroll)
+    ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+    (tmp_path / "Materia" / "b.txt").write_text("b.txt reescrito " + "otra cosa " * 30, encoding="utf-8")
+    (tmp_path / "Materia" / "c.txt").unlink()
+    assert ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+
+    index = local_index()
+    points, _ = client.scroll(ingest_pipeline.QDRANT_COLLECTION, limit=1000, with_vectors=True)
+    assert set(index.ids) == {str(p.id) for p in points}
+    for p in points:
+        row = index.ids.index(str(p.id))
+        assert index.texts[row] == p.payload["page_content"]
+        assert index.metadatas[row] == p.payload["metadata"]
+        assert index.partitions[1][0] <= row < index.partitions[1][1]
+        assert abs(float(index.vectors[row] @ p.vector) - 1.0) < 1e-5
+
+
+def test_missing_local_index_is_rebuilt_from_qdrant(corpus):
+    tmp_path, client, _ = corpus
+    ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+    for path in ingest_pipeline.local_index_paths(ingest_pipeline.QDRANT_COLLECTION):
+        (tmp_path / path).unlink()
+    assert not ingest_pipeline.incremental_ingest(workers=1, batch_size=4, concurrency=1)
+    assert set(local_index().ids) == stored_ids(client)
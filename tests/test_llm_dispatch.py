@@ -0,0 +1,119 @@
+# tests/test_llm_dispatch.py
+import asyncio
+import threading
+
+import pytest
+
+from llm_dispatch import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, LLMDispatcher, LLMOverloaded
+
+
+def test_cold_lane_queues_instead_of_shedding_on_assumed_duration():
+    # Con la duración supuesta (10 s) y un turno, la estimación ya superaría 5 s
+    dispatcher = LLMDispatcher(concurrency=1, overrides={}, queue_max=8, queue_timeout=5)
+    slot = dispatcher.acquire("ollama", "m")
+    lane = dispatcher._lane("ollama", "m")
+    waiters = [dispatcher._admit("ollama", "m", f"u{i}", 0)[1] for i in range(3)]
+    assert all(w is not None for w in waiters)
+    assert lane.waiting == 3 and lane.shed == 0
+    slot.release()
+    assert waiters[0].granted
+
+
+def test_estimate_sheds_only_after_min_samples_and_with_a_waiter():
+    dispatcher = LLMDispatcher(concurrency=1, overrides={}, queue_max=8, queue_timeout=5, shed_min_samples=2)
+    lane = dispatcher._lane("ollama", "m")
+    # Dos llamadas terminadas de 20 s
+    for _ in range(2):
+        lane.active += 1
+        dispatcher._release(lane, 20.0)
+    assert lane.samples == 2 and lane.service_seconds == pytest.approx(20.0)
+    slot = dispatcher.acquire("ollama", "m")
+    # La primera llamada sin turno siempre puede esperar
+    _, waiter = dispatcher._admit("ollama", "m", "a", 0)
+    assert waiter is not None
+    with pytest.raises(LLMOverloaded) as excinfo:
+        dispatcher._admit("ollama", "m", "b", 0)
+    assert "espera estimada" in str(excinfo.value)
+    assert excinfo.value.retry_after == 5
+    slot.release()
+    dispatcher._release(lane, None)
+    assert lane.active == 0
+
+
+def test_first_sample_replaces_assumed_duration():
+    dispatcher = LLMDispatcher(concurrency=2, overrides={})
+    with dispatcher.acquire("openai", "m"):
+        pass
+    lane = dispatcher._lane("openai", "m")
+    assert lane.samples == 1
+    assert lane.service_seconds < 1.0
+
+
+def test_blocking_acquire_times_out_without_a_turn():
+    dispatcher = LLMDispatcher(concurrency=1, overrides={}, queue_timeout=0.05)
+    slot = dispatcher.acquire("ollama", "m")
+    with pytest.raises(LLMOverloaded):
+        dispatcher.acquire("ollama", "m", user="b")
+    assert dispatcher._lane("ollama", "m").timeouts == 1
+    slot.release()
+    done = threading.Event()
+
+    def worker():
+        with dispatcher.acquire("ollama", "m", user="c"):
+            done.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join(1)
+    assert done.is_set()
+
+
+def test_queue_is_fair_across_users_and_puts_background_last():
+    dispatcher = LLMDispatcher(concurrency=1, overrides={}, queue_max=16, queue_timeout=30)
+    slot = dispatcher.acquire("ollama", "m", user="A")
+    order = [("A", PRIORITY_INTERACTIVE), ("A", PRIORITY_INTERACTIVE), ("bg", PRIORITY_BACKGROUND),
+             ("A", PRIORITY_INTERACTIVE), ("B", PRIORITY_INTERACTIVE), ("C", PRIORITY_INTERACTIVE)]
+    lane = None
+    for user, priority in order:
+        lane, _ = dispatcher._admit("ollama", "m", user, priority)
+    served = []
+    while True:
+        waiter = lane.pop()
+        if waiter is None:
+            break
+        served.append(waiter.user)
+    assert served == ["A", "B", "C", "A", "A", "bg"]
+    slot.release()
+
+
+def test_full_queue_sheds_immediately():
+    dispatcher = LLMDispatcher(concurrency=1, overrides={}, queue_max=2, queue_timeout=30)
+    slot = dispatcher.acquire("ollama", "m")
+    for user in ("a", "b"):
+        dispatcher._admit("ollama", "m", user, PRIORITY_INTERACTIVE)
+    with pytest.raises(LLMOverloaded) as excinfo:
+        dispatcher._admit("ollama", "m", "c", PRIORITY_INTERACTIVE)
+    assert "cola llena" in str(excinfo.value)
+    assert excinfo.value.retry_after >= 1
+    assert 'reason="admission"} 1' in dispatcher.render_prometheus()
+    slot.release()
+
+
+def test_async_calls_never_exceed_the_lane_limit():
+    dispatcher = LLMDispatcher(concurrency=2, overrides={}, queue_max=32, queue_timeout=5)
+    running, peak = [0], [0]
+
+    async def call(user):
+        with await dispatcher.acquire_async("ollama", "m", user=user):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.01)
+            running[0] -= 1
+
+    async def main():
+        await asyncio.gather(*(call(i % 3) for i in range(10)))
+
+    asyncio.run(main())
+    assert peak[0] == 2
+    assert dispatcher.stats()[0]['admitted'] == 10
+    assert dispatcher.stats()[0]['active'] == 0
@@ -0,0 +1,64 @@
+# tests/test_local_index.py
+import pytest
+
+import lexical_index
+import local_index
+from local_index import LocalVectorIndex
+
+
+@pytest.fixture
+def index():
+    return LocalVectorIndex.build([
+        ("a", [1.0, 0.0, 0.0], "álgebra", {"subject_id": 1}, 1),
+        ("b", [0.9, 0.1, 0.0], "matrices", {"subject_id": 1}, 1),
+        ("c", [0.0, 1.0, 0.0], "contratos", {"subject_id": 2}, 2),
+        ("d", [0.7, 0.7, 0.0], "costos", {"subject_id": 3}, 3),
+        ("e", [0.0, 0.0, 1.0], "sin materia", {}, None),
+    ])
+
+
+def test_partitions_are_contiguous_blocks_per_subject(index):
+    assert index.partitions == {1: (0, 2), 2: (2, 3), 3: (3, 4), None: (4, 5)}
+    assert index.dim == 3
+
+
+def test_search_ranks_by_cosine_similarity(index):
+    hits = index.search([2.0, 0.0, 0.0], k=3)
+    assert [h.point_id for h in hits] == ["a", "b", "d"]
+    assert hits[0].score == pytest.approx(1.0)
+    assert hits[0].page_content == "álgebra"
+
+
+def test_search_only_looks_at_requested_subjects(index):
+    assert [h.point_id for h in index.search([1.0, 0.0, 0.0], subject_ids=[2], k=5)] == ["c"]
+    hits = index.search([1.0, 0.0, 0.0], subject_ids=[2, 3, 99], k=5)
+    assert [h.point_id for h in hits] == ["d", "c"]
+    assert index.search([1.0, 0.0, 0.0], subject_ids=[99]) == []
+
+
+def test_search_edge_cases(index):
+    assert index.search([0.0, 0.0, 0.0]) == []
+    assert index.search([1.0, 0.0, 0.0], k=0) == []
+    assert len(index.search([1.0, 0.0, 0.0], k=50)) == len(index)
+    assert LocalVectorIndex.build([]).search([1.0]) == []
+
+
+def test_save_and_load_round_trip(index, tmp_path):
+    vectors_path, meta_path = str(tmp_path / "c.npy"), str(tmp_path / "c.json.gz")
+    index.save(vectors_path, meta_path)
+    loaded = LocalVectorIndex.load(vectors_path, meta_path)
+    assert loaded.partitions == index.partitions
+    assert loaded.search([1.0, 0.0, 0.0], subject_ids=[1], k=2) == index.search([1.0, 0.0, 0.0], subject_ids=[1], k=2)
+
+
+def test_lexical_and_local_indexes_can_share_a_directory(index, tmp_path, monkeypatch):
+    monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(local_index, "LOCAL_INDEX_DIR", str(tmp_path))
+    lexical = lexical_index.LexicalIndex.build(
+        (pid, text, meta, subject) for pid, text, meta, subject in zip(index.ids, index.texts, index.metadatas,
+                                                                       [m.get("subject_id") for m in index.metadatas]))
+    lexical.save(lexical_index.index_path("tutor"))
+    index.save(*local_index.index_paths("tutor"))
+    assert lexical_index.index_path("tutor") not in local_index.index_paths("tutor")
+    assert [h.point_id for h in lexical_index.get_lexical_index("tutor").search("contratos")] == ["c"]
+    assert len(local_index.get_local_index("tutor")) == len(index)
@@ -0,0 +1,85 @@
+# tests/test_prompt_builder.py
+from prompt_builder import HISTORY_MAX_TURNS, _history_turn, _pack_history, _summary_block, build_prompt
+from token_accounting import count_tokens
+
+
+def test_short_summary_is_not_truncated():
+    plan = build_prompt("Eres un tutor.\n", "¿Qué es una derivada?", [], "", [], None, 3000,
+                        summary="resumen")
+    assert "Resumen de lo conversado: resumen\n" in plan.prompt
+
+
+def test_summary_fits_exactly_in_its_budget():
+    block = _summary_block("resumen")
+    budget = count_tokens("Historial de la conversación:\n") + 1 + count_tokens(block)
+    text, turns, used = _pack_history([], budget, "resumen")
+    assert block in text
+    assert turns == 0
+    assert used <= budget
+
+
+def test_long_summary_is_truncated_and_leaves_room_for_turns():
+    history = [{'user': "hola", 'tutor': "hola, ¿en qué te ayudo?"}]
+    summary = "palabra " * 500
+    text, turns, used = _pack_history(history, 60, summary)
+    assert "Resumen de lo conversado: palabra" in text
+    assert "Tú: hola" in text
+    assert turns == 1
+    assert used <= 60
+
+
+def _turns(n):
+    return [{'user': f"pregunta {i}", 'tutor': f"respuesta {i}"} for i in range(n)]
+
+
+def test_history_keeps_most_recent_turns_in_order():
+    text, turns, used = _pack_history(_turns(8), 1000)
+    assert turns == HISTORY_MAX_TURNS
+    assert "pregunta 2" not in text
+    assert text.index("pregunta 3") < text.index("pregunta 7")
+    assert used <= 1000
+
+
+def test_history_drops_older_turns_when_budget_is_tight():
+    history = _turns(3)
+    header = count_tokens("Historial de la conversación:\n") + 1
+    budget = header + count_tokens(_history_turn(history[-1])) + 1
+    text, turns, used = _pack_history(history, budget)
+    assert turns == 1
+    assert "pregunta 2" in text and "pregunta 1" not in text
+    assert used <= budget
+
+
+def test_history_truncates_the_last_turn_rather_than_dropping_it():
+    history = [{'user': "explica " * 200, 'tutor': "..."}]
+    text, turns, used = _pack_history(history, 30)
+    assert turns == 1
+    assert text.startswith("Historial de la conversación:\nTú: explica")
+    assert used <= 30
+    assert _pack_history(history, 1) == ("", 0, 0)
+    assert _pack_history([], 500) == ("", 0, 0)
+
+
+def test_build_prompt_stays_within_budget():
+    chunks = [f"fragmento {i} " + "contenido " * 80 for i in range(10)]
+    plan = build_prompt("Eres un tutor.\n", "¿Qué es una derivada?", chunks, "Cálculo " * 100,
+                        _turns(5), {'grade': 3}, 600, summary="resumen " * 50)
+    assert plan.section_tokens['total'] <= 600
+    assert plan.turns_used >= 1
+    assert 0 < plan.chunks_used < 10
+
+
+def test_metrics_use_the_plan_total_instead_of_retokenizing(monkeypatch):
+    import agents_rag
+
+    plan = build_prompt("Eres un tutor.\n", "¿Qué es una derivada?", ["La derivada mide el cambio."], "Cálculo",
+                        [], None, 3000)
+    assert plan.section_tokens['total'] == sum(v for k, v in plan.section_tokens.items() if k != 'total')
+    rows = []
+    monkeypatch.setattr(agents_rag.metrics_sink, "record", lambda **values: rows.append(values))
+    monkeypatch.setattr(agents_rag, "count_tokens", lambda text: len(text.split()))
+    record = agents_rag.TutorAgent.record_metrics
+    record(None, {}, None, [1], "ollama", "m", plan.section_tokens['total'], "dos palabras", 10)
+    record(None, {}, None, [1], "ollama", "m", plan.section_tokens['total'], "x", 10,
+           usage={'prompt_tokens': 7, 'completion_tokens': 3})
+    assert [(r['prompt_tokens'], r['completion_tokens']) for r in rows] == [(plan.section_tokens['total'], 2), (7, 3)]
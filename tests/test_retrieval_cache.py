@@ -0,0 +1,43 @@
+# tests/test_retrieval_cache.py
+from retrieval_cache import RetrievalCache, normalize_question
+
+
+def test_question_embeddings_are_keyed_by_model_and_normalized_text():
+    cache = RetrievalCache()
+    assert normalize_question("  ¿Qué es   la DERIVADA? ") == "qué es la derivada"
+    cache.put_embedding("m", "¿Qué es la derivada?", [0.1, 0.2])
+    assert cache.get_embedding("m", "qué es la   derivada") == [0.1, 0.2]
+    assert cache.get_embedding("otro", "qué es la derivada") is None
+
+
+def test_results_are_keyed_by_collection_subjects_and_k():
+    cache = RetrievalCache(threshold=0.97, bucket_bits=4, probes=1)
+    vector = [0.5, -0.4, 0.3, 0.6]
+    cache.put_results(vector, "tutor", [1, 2], 5, ["doc"])
+    assert cache.get_results(vector, "tutor", [2, 1], 5) == ["doc"]
+    assert cache.get_results([0.51, -0.39, 0.3, 0.6], "tutor", [1, 2], 5) == ["doc"]
+    assert cache.get_results(vector, "otra", [1, 2], 5) is None
+    assert cache.get_results(vector, "tutor", [1], 5) is None
+    assert cache.get_results(vector, "tutor", [1, 2], 3) is None
+    assert cache.get_results([-0.5, 0.4, 0.3, 0.6], "tutor", [1, 2], 5) is None
+
+
+def test_collection_version_change_clears_both_levels():
+    cache = RetrievalCache(bucket_bits=4)
+    cache.put_embedding("m", "hola", [1.0], version=1)
+    cache.put_results([1.0, 0.0, 0.0, 0.0], "tutor", [1], 5, ["doc"], version=1)
+    assert cache.get_results([1.0, 0.0, 0.0, 0.0], "tutor", [1], 5, version=1) == ["doc"]
+    assert cache.get_results([1.0, 0.0, 0.0, 0.0], "tutor", [1], 5, version=2) is None
+    assert cache.get_embedding("m", "hola", version=2) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_neighbouring_buckets_are_scored_together_and_best_match_wins():
+    cache = RetrievalCache(threshold=0.9, bucket_bits=4, probes=1)
+    # Difieren en el signo de la componente menos segura: buckets vecinos
+    cache.put_results([0.6, 0.5, 0.62, 0.02], "tutor", [1], 5, ["cerca"])
+    cache.put_results([0.6, 0.5, 0.62, -0.01], "tutor", [1], 5, ["mejor"])
+    assert cache.get_results([0.6, 0.5, 0.62, -0.005], "tutor", [1], 5) == ["mejor"]
+    assert cache.get_results([0.6, 0.5, 0.62, 0.015], "tutor", [1], 5) == ["cerca"]
+    # Un embedding de otra dimensión (otro modelo) nunca es candidato
+    assert cache.get_results([0.6, 0.5, 0.62, 0.02, 0.0], "tutor", [1], 5) is None
@@ -0,0 +1,91 @@
+# tests/test_semantic_cache.py
+import semantic_cache
+from semantic_cache import SemanticCache, cacheable_profile
+
+PROFILE = {'name': "Ana", 'language': "es", 'grade': 3, 'career': "Derecho"}
+
+
+def test_similar_question_in_same_group_hits():
+    cache = SemanticCache(threshold=0.95, ttl=60)
+    group = SemanticCache.group_key("ollama", "m", [2, 1], PROFILE)
+    cache.store([1.0, 0.0], group, "respuesta")
+    assert cache.lookup([0.99, 0.05], group) == "respuesta"
+    assert cache.lookup([0.0, 1.0], group) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_group_key_separates_model_subjects_and_profile_but_not_name():
+    key = SemanticCache.group_key("ollama", "m", [1, 2], PROFILE)
+    assert key == SemanticCache.group_key("ollama", "m", [2, 1], {**PROFILE, 'name': "Luis"})
+    assert key != SemanticCache.group_key("openai", "m", [1, 2], PROFILE)
+    assert key != SemanticCache.group_key("ollama", "m", [1], PROFILE)
+    assert key != SemanticCache.group_key("ollama", "m", [1, 2], {**PROFILE, 'grade': 4})
+    assert key != SemanticCache.group_key("ollama", "m", [1, 2], {**PROFILE, 'language': "en"})
+    assert 'name' not in cacheable_profile(PROFILE)
+
+    cache = SemanticCache(threshold=0.95, ttl=60)
+    cache.store([1.0, 0.0], key, "respuesta")
+    assert cache.lookup([1.0, 0.0], SemanticCache.group_key("ollama", "m", [1, 2], {**PROFILE, 'career': "Ingeniería"})) is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "monotonic", lambda: now[0])
+    cache = SemanticCache(threshold=0.95, ttl=10)
+    group = SemanticCache.group_key("ollama", "m", [1])
+    cache.store([1.0, 0.0], group, "vieja")
+    now[0] += 5
+    cache.store([0.0, 1.0], group, "nueva")
+    now[0] += 6
+    assert cache.lookup([1.0, 0.0], group) is None
+    assert cache.lookup([0.0, 1.0], group) == "nueva"
+    assert cache.stats()['entries'] == 1
+
+
+def test_version_change_and_lru_limit_drop_entries():
+    cache = SemanticCache(threshold=0.95, ttl=60, max_entries=2)
+    group = SemanticCache.group_key("ollama", "m", [1])
+    cache.store([1.0, 0.0, 0.0], group, "a", version=1)
+    assert cache.lookup([1.0, 0.0, 0.0], group, version=2) is None
+    for i, answer in enumerate("xyz"):
+        vector = [0.0, 0.0, 0.0]
+        vector[i] = 1.0
+        cache.store(vector, group, answer, version=2)
+    assert cache.stats()['entries'] == 2
+    assert cache.lookup([1.0, 0.0, 0.0], group, version=2) is None
+    assert cache.lookup([0.0, 0.0, 1.0], group, version=2) == "z"
+
+
+def test_follow_up_questions_are_not_standalone():
+    assert semantic_cache.is_standalone("¿Qué es una derivada parcial?")
+    assert semantic_cache.is_standalone("Explica la segunda ley de Newton")
+    for question in ("¿Y eso por qué?", "dame otro ejemplo", "¿por qué?", "No entendí la respuesta anterior",
+                     "Pero, ¿cómo se aplica?", "Explícame esto con más detalle"):
+        assert not semantic_cache.is_standalone(question), question
+
+
+def test_cache_applies_to_standalone_questions_in_a_conversation(monkeypatch):
+    from types import SimpleNamespace
+
+    import agents_rag
+
+    cache = SemanticCache(threshold=0.95, ttl=60)
+    monkeypatch.setattr(agents_rag, "semantic_cache", cache)
+    agent = SimpleNamespace(embed_question=lambda question, settings: [1.0, 0.0])
+    lookup = agents_rag.TutorAgent.lookup_cached_answer
+    history = [{'user': "hola", 'tutor': "hola"}]
+
+    _, key, cached = lookup(agent, "¿Qué es una derivada?", [1], None, {}, "ollama", "m", PROFILE)
+    assert key is not None and cached is None
+    cache.store([1.0, 0.0], key, "respuesta")
+    # La conversación retomada no impide usar la caché para una pregunta autónoma...
+    _, key, cached = lookup(agent, "¿Qué es una derivada?", [1], history, {}, "ollama", "m", PROFILE)
+    assert cached == "respuesta"
+    assert agents_rag.TutorAgent.prompt_history(history, "resumen", key) == ([], "")
+    # ...pero no para una de seguimiento, que se cuenta aparte
+    _, key, cached = lookup(agent, "¿Y eso por qué?", [1], history, {}, "ollama", "m", PROFILE)
+    assert key is None and cached is None
+    assert agents_rag.TutorAgent.prompt_history(history, "resumen", key) == (history, "resumen")
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['bypassed']) == (1, 1, 1)
+    assert stats['overall_hit_rate'] == round(1 / 3, 3)
@@ -0,0 +1,95 @@
+# tests/test_subject_sharding.py
+import pytest
+from langchain_core.embeddings import FakeEmbeddings
+from langchain_qdrant import Qdrant
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct
+
+import subject_sharding
+from subject_sharding import ShardedVectorStore, ShardRouter, get_router, shard_collection, subject_filter, subject_ids_from_filter
+
+
+def point(pid, vector, subject_id):
+    return PointStruct(id=pid, vector=vector, payload={
+        "page_content": f"chunk {pid}", "metadata": {"subject_id": subject_id}, "subject_id": subject_id})
+
+
+@pytest.fixture
+def points():
+    return [point(1, [1.0, 0.0, 0.0], 1), point(2, [0.9, 0.1, 0.0], 2), point(3, [0.8, 0.2, 0.0], 3)]
+
+
+def test_subject_filter_round_trip():
+    assert subject_ids_from_filter(subject_filter([4])) == [4]
+    assert subject_ids_from_filter(subject_filter([1, 2])) == [1, 2]
+    assert subject_ids_from_filter(None) is None
+
+
+def test_langchain_vectorstore_applies_the_native_filter(points):
+    client = QdrantClient(":memory:")
+    ShardRouter(client, "tutor", mode="none").upsert(points, 3)
+    vectorstore = Qdrant(client=client, collection_name="tutor", embeddings=FakeEmbeddings(size=3))
+    docs = vectorstore.similarity_search_by_vector([1.0, 0.0, 0.0], k=5, filter=subject_filter([2, 3]))
+    assert sorted(doc.metadata["subject_id"] for doc in docs) == [2, 3]
+
+
+@pytest.fixture
+def sharded(points):
+    client = QdrantClient(":memory:")
+    router = ShardRouter(client, "tutor", mode="collections")
+    router.upsert(points + [point(4, [0.0, 1.0, 0.0], None)], 3)
+    return client, router
+
+
+def stored(client, name):
+    return sorted(p.id for p in client.scroll(name, limit=100)[0])
+
+
+def test_collections_mode_routes_points_by_subject(sharded):
+    client, router = sharded
+    assert router.collections() == [shard_collection("tutor", s) for s in (1, 2, 3, "none")]
+    assert not client.collection_exists("tutor")
+    assert stored(client, "tutor__subject_2") == [2]
+    assert stored(client, "tutor__subject_none") == [4]
+    # Los ids no guardan la materia: se borran de todas las colecciones
+    router.delete([2, 4])
+    assert stored(client, "tutor__subject_2") == stored(client, "tutor__subject_none") == []
+    router.drop()
+    assert router.collections() == []
+
+
+def test_sharded_search_queries_only_the_filtered_subjects(sharded):
+    client, router = sharded
+    store = router.vectorstore(None)
+    assert isinstance(store, ShardedVectorStore)
+    docs = store.similarity_search_by_vector([1.0, 0.0, 0.0], k=5, filter=subject_filter([3, 1, 9]))
+    assert [(d.metadata['_id'], d.metadata['_collection_name']) for d in docs] == [
+        ("1", "tutor__subject_1"), ("3", "tutor__subject_3")]
+    assert [d.metadata['_id'] for d in store.similarity_search_by_vector([1.0, 0.0, 0.0], k=3)] == ["1", "2", "3"]
+    with pytest.raises(ValueError):
+        store.similarity_search("pregunta")
+    embedded = ShardedVectorStore(router, FakeEmbeddings(size=3)).similarity_search("pregunta", k=2, filter=subject_filter([2]))
+    assert [d.metadata['_id'] for d in embedded] == ["2"]
+
+
+def test_new_shards_are_seen_after_the_refresh_interval(sharded, monkeypatch):
+    client, router = sharded
+    now = [1000.0]
+    monkeypatch.setattr(subject_sharding.time, "monotonic", lambda: now[0])
+    store = router.vectorstore(None)
+    assert store.similarity_search_by_vector([0.0, 0.0, 1.0], k=5, filter=subject_filter([5])) == []
+    router.upsert([point(5, [0.0, 0.0, 1.0], 5)], 3)
+    assert store.similarity_search_by_vector([0.0, 0.0, 1.0], k=5, filter=subject_filter([5])) == []
+    now[0] += subject_sharding.SHARD_REFRESH_SECONDS
+    assert [d.metadata['_id'] for d in store.similarity_search_by_vector([0.0, 0.0, 1.0], k=5, filter=subject_filter([5]))] == ["5"]
+
+
+def test_router_configuration():
+    client = QdrantClient(":memory:")
+    with pytest.raises(ValueError):
+        ShardRouter(client, "tutor", mode="otro")
+    with pytest.raises(ValueError):
+        ShardRouter(client, "tutor", mode="shard_keys").upsert([point(1, [1.0, 0.0, 0.0], None)], 3)
+    assert ShardRouter(client, "tutor", mode="none").vectorstore("langchain") == "langchain"
+    assert get_router(client, "tutor") is get_router(client, "tutor")
+    assert get_router(client, "tutor") is not get_router(client, "otra")
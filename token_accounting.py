@@ -0,0 +1,91 @@
+# token_accounting.py
+"""
+Conteo de tokens para chat_metrics.
+
+- El encoder de tiktoken (TOKEN_ENCODING, cl100k_base por defecto) se carga
+  una sola vez por proceso. Si tiktoken no está instalado se usa una
+  aproximación de ~4 caracteres por token y se avisa una única vez.
+- La parte estática del prompt (instrucciones del tutor y plantilla) se
+  cuenta una sola vez por proceso (count_static_tokens). Los tokens de cada
+  prompt salen del armado con presupuesto (prompt_builder.PromptPlan), así
+  que el prompt no se vuelve a tokenizar al registrar la métrica.
+- Cuando el backend informa el uso real (Ollama: prompt_eval_count /
+  eval_count; OpenAI: usage.prompt_tokens / usage.completion_tokens) esos
+  valores tienen prioridad y no se tokeniza nada.
+"""
+
+import os
+import threading
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from app_logging import get_logger
+
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+CHARS_PER_TOKEN = 4
+
+logger = get_logger(__name__)
+
+_encoder = None
+_encoder_loaded = False
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    """Encoder de tiktoken del proceso, o None si no está disponible."""
+    global _encoder, _encoder_loaded
+    if _encoder_loaded:
+        return _encoder
+    with _encoder_lock:
+        if not _encoder_loaded:
+            try:
+                import tiktoken  # type: ignore
+                _encoder = tiktoken.get_encoding(TOKEN_ENCODING)
+            except Exception as e:
+                logger.warning("tiktoken no disponible (%s); se aproximan los tokens por longitud", e)
+                _encoder = None
+            _encoder_loaded = True
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = get_encoder()
+    if encoder is None:
+        return max(1, round(len(text) / CHARS_PER_TOKEN))
+    # disallowed_special=() evita errores si el texto del usuario contiene '<|endoftext|>'
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=8)
+def count_static_tokens(static_text: str) -> int:
+    """Tokens de un texto que no cambia entre prompts; se cuentan una vez por proceso."""
+    return count_tokens(static_text)
+
+
+def usage_from_response(backend: str, data: dict) -> Optional[Tuple[int, int]]:
+    """(prompt_tokens, completion_tokens) informados por el backend, o None si no vienen."""
+    if not isinstance(data, dict):
+        return None
+    if backend == "ollama":
+        prompt_tokens, completion_tokens = data.get("prompt_eval_count"), data.get("eval_count")
+    else:
+        usage = data.get("usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    if prompt_tokens is None or completion_tokens is None:
+        return None
+    return int(prompt_tokens), int(completion_tokens)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Recorta `text` a como máximo `max_tokens` tokens (sin partir caracteres)."""
+    if max_tokens <= 0 or not text:
+        return ""
+    encoder = get_encoder()
+    if encoder is None:
+        return text if count_tokens(text) <= max_tokens else text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoder.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoder.decode(tokens[:max_tokens]).rstrip("�")
@@ -0,0 +1,164 @@
+# tracing.py
+"""
+Trazas ligeras de latencia por etapa y exportación en formato Prometheus.
+
+`span(nombre)` mide un bloque: actualiza un histograma de duración, un gauge
+de ejecuciones en curso y un contador de errores para esa etapa. Si hay una
+traza activa (`trace(dict)`), la duración en milisegundos también se acumula
+en ese diccionario, que el TutorAgent guarda como columnas de chat_metrics.
+
+La traza activa vive en un ContextVar: asyncio.to_thread y stage_pipeline
+copian el contexto, así que las etapas lanzadas en otros hilos se siguen
+atribuyendo a la misma petición. Las métricas son por proceso; /metrics
+(auth_app.py) expone las del worker que atiende la petición.
+"""
+
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+# Límites superiores (segundos) de los buckets del histograma
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current_trace: ContextVar[Optional[Dict[str, int]]] = ContextVar("current_trace", default=None)
+_lock = threading.Lock()
+
+
+class _SpanStats:
+    __slots__ = ("buckets", "count", "sum", "in_flight", "errors")
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.in_flight = 0
+        self.errors = 0
+
+
+_spans: Dict[str, _SpanStats] = {}
+
+
+def _stats(name: str) -> _SpanStats:
+    stats = _spans.get(name)
+    if stats is None:
+        stats = _spans.setdefault(name, _SpanStats())
+    return stats
+
+
+def observe(name: str, seconds: float, error: bool = False) -> None:
+    """Registra una duración ya medida para la etapa `name`."""
+    with _lock:
+        stats = _stats(name)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                stats.buckets[i] += 1
+        stats.count += 1
+        stats.sum += seconds
+        if error:
+            stats.errors += 1
+    durations = _current_trace.get()
+    if durations is not None:
+        with _lock:
+            durations[name] = durations.get(name, 0) + int(seconds * 1000)
+
+
+def start_span(name: str):
+    """Abre una etapa sin context manager (p. ej. entre before/teardown_request de Flask)."""
+    with _lock:
+        _stats(name).in_flight += 1
+    return name, time.perf_counter(), _current_trace.get()
+
+
+def finish_span(handle, error: bool = False) -> None:
+    name, start, durations = handle
+    seconds = time.perf_counter() - start
+    with _lock:
+        _stats(name).in_flight -= 1
+    # Se usa la traza capturada al abrir: el bloque puede haber contenido yields
+    token = _current_trace.set(durations)
+    try:
+        observe(name, seconds, error)
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str):
+    """Mide el bloque como etapa `name` (histograma, en curso y errores)."""
+    handle = start_span(name)
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        finish_span(handle, error)
+
+
+def traced(name: str):
+    """Decorador: ejecuta la función (síncrona o async) dentro de span(name)."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def trace(durations: Dict[str, int]):
+    """
+    Activa `durations` como traza de la petición: los span() del bloque
+    (y de los hilos lanzados desde él) suman ahí sus milisegundos.
+    No debe abarcar un yield de un generador.
+    """
+    token = _current_trace.set(durations)
+    try:
+        yield durations
+    finally:
+        _current_trace.reset(token)
+
+
+def render_prometheus() -> str:
+    """Métricas de todas las etapas en formato de texto de Prometheus."""
+    with _lock:
+        snapshot = {
+            name: (list(s.buckets), s.count, s.sum, s.in_flight, s.errors)
+            for name, s in sorted(_spans.items())
+        }
+    lines = [
+        "# HELP tutor_stage_duration_seconds Duración de cada etapa del tutor.",
+        "# TYPE tutor_stage_duration_seconds histogram",
+    ]
+    for name, (buckets, count, total, _, _) in snapshot.items():
+        for bound, value in zip(LATENCY_BUCKETS, buckets):
+            lines.append(f'tutor_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {value}')
+        lines.append(f'tutor_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+        lines.append(f'tutor_stage_duration_seconds_sum{{stage="{name}"}} {total:.6f}')
+        lines.append(f'tutor_stage_duration_seconds_count{{stage="{name}"}} {count}')
+    lines += [
+        "# HELP tutor_stage_in_flight Ejecuciones en curso de cada etapa.",
+        "# TYPE tutor_stage_in_flight gauge",
+    ]
+    for name, (_, _, _, in_flight, _) in snapshot.items():
+        lines.append(f'tutor_stage_in_flight{{stage="{name}"}} {in_flight}')
+    lines += [
+        "# HELP tutor_stage_errors_total Ejecuciones de cada etapa que terminaron con excepción.",
+        "# TYPE tutor_stage_errors_total counter",
+    ]
+    for name, (_, _, _, _, errors) in snapshot.items():
+        lines.append(f'tutor_stage_errors_total{{stage="{name}"}} {errors}')
+    return "\n".join(lines) + "\n"
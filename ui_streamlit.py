@@ -3,59 +3,30 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from agents_rag import StudentProfileAgent, TutorAgent
+from conversation_memory import conversation_memory
 st.set_page_config(page_title="Tutor Inteligente", page_icon="🎓")
 st.title("🎓 Tutor Inteligente Demo")
-import psycopg2
-
-PG_HOST = "localhost"
-PG_PORT = 5432
-PG_DB = "tutor_db"
-PG_USER = "tutor_user"
-PG_PASSWORD = "tutor_pass"
+from db import get_conn
 
 def get_students():
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        port=PG_PORT,
-        dbname=PG_DB,
-        user=PG_USER,
-        password=PG_PASSWORD
-    )
-    cur = conn.cursor()
-    cur.execute("SELECT id, name FROM students ORDER BY id")
-    students = cur.fetchall()
-    cur.close()
-    conn.close()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, name FROM students ORDER BY id")
+            students = cur.fetchall()
     return students
 
 def authenticate_user(email, password):
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        port=PG_PORT,
-        dbname=PG_DB,
-        user=PG_USER,
-        password=PG_PASSWORD
-    )
-    cur = conn.cursor()
-    cur.execute("SELECT id, name FROM students WHERE email = %s AND password = %s", (email, password))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, name FROM students WHERE email = %s AND password = %s", (email, password))
+            user = cur.fetchone()
     return user
 
 def get_student_profile(student_id):
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        port=PG_PORT,
-        dbname=PG_DB,
-        user=PG_USER,
-        password=PG_PASSWORD
-    )
-    cur = conn.cursor()
-    cur.execute("SELECT name, email, career, grade, language FROM students WHERE id = %s", (student_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT name, email, career, grade, language FROM students WHERE id = %s", (student_id,))
+            row = cur.fetchone()
     if row:
         return {
             "name": row[0],
@@ -67,23 +38,15 @@ def get_student_profile(student_id):
     return None
 
 def get_student_subjects(student_id):
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        port=PG_PORT,
-        dbname=PG_DB,
-        user=PG_USER,
-        password=PG_PASSWORD
-    )
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT s.name, s.description
-        FROM enrollments e
-        JOIN subjects s ON e.subject_id = s.id
-        WHERE e.student_id = %s
-    """, (student_id,))
-    subjects = cur.fetchall()
-    cur.close()
-    conn.close()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT s.name, s.description
+                FROM enrollments e
+                JOIN subjects s ON e.subject_id = s.id
+                WHERE e.student_id = %s
+            """, (student_id,))
+            subjects = cur.fetchall()
     return subjects
 
 # --- Control de página: login o app principal ---
@@ -129,12 +92,15 @@ if st.session_state.get("page") == "app" and "user" in st.session_state:
 
     # Paso 3: Chat tipo ChatGPT
     st.header("Chat con el tutor")
-    if "chat_history" not in st.session_state:
-        st.session_state["chat_history"] = []
+    # La conversación se guarda en el servidor (todas las materias: subject_id None);
+    # se retoma la última del usuario, también desde otro dispositivo
+    if "conversation_id" not in st.session_state:
+        st.session_state["conversation_id"] = conversation_memory.resolve(user[0], None)
+    conversation_id = st.session_state["conversation_id"]
 
     chat_container = st.container()
     with chat_container:
-        for msg in st.session_state["chat_history"]:
+        for msg in conversation_memory.transcript(conversation_id):
             st.markdown(f"<div style='background-color:#e6f7ff;padding:8px 12px;border-radius:8px;margin-bottom:4px;'><b>Tú:</b> {msg['user']}</div>", unsafe_allow_html=True)
             st.markdown(f"<div style='background-color:#f6f6f6;padding:8px 12px;border-radius:8px;margin-bottom:12px;'><b>Tutor:</b> {msg['tutor']}</div>", unsafe_allow_html=True)
 
@@ -166,13 +132,16 @@ if st.session_state.get("page") == "app" and "user" in st.session_state:
                 student_profile=student_profile,
                 llm_backend="ollama",
                 llm_model="gemma3:4b",
-                chat_history=st.session_state["chat_history"]
+                conversation_id=conversation_id,
             )
-        st.session_state["chat_history"].append({"user": question, "tutor": respuesta})
+        st.rerun()
+
+    if st.button("Nueva conversación"):
+        st.session_state["conversation_id"] = conversation_memory.resolve(user[0], None, new=True)
         st.rerun()
 
     if st.button("Cerrar sesión"):
-        for k in ["user", "profile_agent", "tutor_agent", "chat_history"]:
+        for k in ["user", "profile_agent", "tutor_agent", "conversation_id"]:
             if k in st.session_state:
                 del st.session_state[k]
         st.session_state["page"] = "login"